@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark throughput of :class:`sfm.fingerprint.FingerPrint` algorithms.
+
+Measure MB/s of ``of_bytes`` and ``of_file`` (``stream``, ``mmap`` and
+``tree`` mode) for every available algorithm, and compare ``of_struct`` with
+the pickle based ``of_pyobj``::
+
+    $ python benchmarks/bench_fingerprint.py --size-mb 256 --output fp.json
+    $ python benchmarks/bench_fingerprint.py --targets pyobj
+
+**中文文档**
+
+比较不同哈希算法在 of_bytes 和 of_file 上的吞吐量, 以及 of_struct 和 of_pyobj 的速度。
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+import numpy as np
+
+from sfm.fingerprint import FingerPrint
+
+DIGEST_SIZES = {
+    "blake2b": [None, 8],
+    "blake2s": [None, 8],
+}
+
+
+def timeit(func, repeat):
+    """Best elapsed seconds of ``repeat`` runs.
+    """
+    best = None
+    for _ in range(repeat):
+        st = time.time()
+        func()
+        elapsed = time.time() - st
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def pyobj_samples():
+    """Typical objects used as cache key.
+    """
+    random = np.random.RandomState(0)
+    return {
+        "nested_dict": dict(
+            ("key%s" % i, {
+                "id": i,
+                "name": "name%s" % i,
+                "score": float(i) / 7,
+                "tags": ["a", "b", "c"],
+            })
+            for i in range(100000)
+        ),
+        "float_list": random.rand(1000000).tolist(),
+        "numpy_array": random.rand(4000000),
+    }
+
+
+def bench_files(args):
+    algorithms = args.algorithms or sorted(FingerPrint._mapper)
+    size = args.size_mb * 1024 * 1024
+    data = os.urandom(size)
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "data.bin")
+    with open(path, "wb") as f:
+        f.write(data)
+
+    results = list()
+    try:
+        for algorithm in algorithms:
+            for digest_size in DIGEST_SIZES.get(algorithm, [None, ]):
+                fp = FingerPrint()
+                fp.use(algorithm, digest_size=digest_size)
+                result = {
+                    "algorithm": fp.algorithm,
+                    "of_bytes_mb_per_sec":
+                        args.size_mb / timeit(
+                            lambda: fp.of_bytes(data), args.repeat),
+                }
+                for mode in args.modes:
+                    result["of_file_%s_mb_per_sec" % mode] = \
+                        args.size_mb / timeit(
+                            lambda: fp.of_file(path, mode=mode), args.repeat)
+                results.append(result)
+                print("%-12s" % fp.algorithm + "".join(
+                    "  %s %8.1f MB/s" % (key[:-len("_mb_per_sec")], value)
+                    for key, value in sorted(result.items())
+                    if key.endswith("_mb_per_sec")
+                ))
+    finally:
+        shutil.rmtree(tmpdir)
+    return results
+
+
+def bench_pyobj(args):
+    fp = FingerPrint(algorithm="md5", pk_protocol=4)
+    results = list()
+    for name, obj in sorted(pyobj_samples().items()):
+        result = {
+            "object": name,
+            "of_pyobj_sec": timeit(lambda: fp.of_pyobj(obj), args.repeat),
+            "of_struct_sec": timeit(lambda: fp.of_struct(obj), args.repeat),
+        }
+        results.append(result)
+        print("%-12s  of_pyobj %.3f sec  of_struct %.3f sec" % (
+            name, result["of_pyobj_sec"], result["of_struct_sec"]))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--targets", nargs="+", default=["file", "pyobj"],
+                        choices=["file", "pyobj"])
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--algorithms", nargs="+", default=None,
+                        help="default is all available")
+    parser.add_argument("--modes", nargs="+", default=["stream", "mmap", "tree"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+
+    output = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "size_mb": args.size_mb,
+    }
+    if "file" in args.targets:
+        output["results"] = bench_files(args)
+    if "pyobj" in args.targets:
+        output["pyobj_results"] = bench_pyobj(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=4, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
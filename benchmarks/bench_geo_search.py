@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark for :mod:`sfm.geo_search`.
+
+Generate reproducible point clouds, measure ``train`` throughput,
+``find_n_nearest`` p50 / p99 latency over a range of ``n`` and ``radius``,
+and the peak memory, then dump the results as JSON. Compare with a previous
+result to catch regression of index or storage changes::
+
+    $ python benchmarks/bench_geo_search.py --sizes 10000 100000 --output new.json
+    $ python benchmarks/bench_geo_search.py --sizes 10000 100000 --output new.json \\
+        --baseline old.json --tolerance 1.2
+
+The process exits with code 1 if any metric is more than ``tolerance`` times
+worse than the baseline.
+
+**中文文档**
+
+geo_search 的性能测试, 结果以JSON格式保存, 可以和之前的结果对比以发现性能倒退。
+"""
+
+from __future__ import print_function
+
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+
+import numpy as np
+
+from sfm.geo_search import GeoSearchEngine
+
+DEFAULT_SIZES = [10000, 100000, 1000000, 10000000]
+DEFAULT_NS = [1, 10, 100]
+DEFAULT_RADII = [None, 10.0, 100.0]
+
+
+def uniform_points(n_points, seed):
+    """Points uniformly distributed on the sphere.
+    """
+    random = np.random.RandomState(seed)
+    lats = np.degrees(np.arcsin(random.uniform(-1.0, 1.0, n_points)))
+    lngs = random.uniform(-180.0, 180.0, n_points)
+    return lats, lngs
+
+
+def clustered_points(n_points, seed, n_clusters=100, spread=0.5):
+    """Points around ``n_clusters`` random centers, like cities.
+
+    :param spread: standard deviation in degree around a center.
+    """
+    random = np.random.RandomState(seed)
+    center_lats, center_lngs = uniform_points(n_clusters, seed + 1)
+    # a few big clusters and a lot of small clusters
+    weights = random.zipf(1.5, n_clusters).astype(np.float64)
+    labels = random.choice(n_clusters, n_points, p=weights / weights.sum())
+    lats = np.clip(
+        center_lats[labels] + random.normal(0.0, spread, n_points), -90.0, 90.0)
+    lngs = (center_lngs[labels] + random.normal(0.0, spread, n_points)
+            + 180.0) % 360.0 - 180.0
+    return lats, lngs
+
+
+GENERATORS = {
+    "uniform": uniform_points,
+    "clustered": clustered_points,
+}
+
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q) * 1000.0)
+
+
+def bench_one(distribution, n_points, index, storage, ns, radii, n_queries,
+              seed):
+    """Run benchmark for one dataset and one engine setting.
+    """
+    lats, lngs = GENERATORS[distribution](n_points, seed)
+    data = list(zip(range(n_points), lats.tolist(), lngs.tolist()))
+    # query near the data, so clustered dataset gets realistic queries
+    query_inds = np.random.RandomState(seed + 2).choice(n_points, n_queries)
+    queries = list(zip(lats[query_inds].tolist(), lngs[query_inds].tolist()))
+
+    gc.collect()
+    tracemalloc.start()
+    engine = GeoSearchEngine(index=index, storage=storage)
+    st = time.time()
+    engine.train(data,
+                 key_id=lambda x: x[0],
+                 key_lat=lambda x: x[1],
+                 key_lng=lambda x: x[2],
+                 )
+    train_elapsed = time.time() - st
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "distribution": distribution,
+        "n_points": n_points,
+        "index": index,
+        "storage": storage,
+        "train_sec": train_elapsed,
+        "train_points_per_sec": n_points / train_elapsed,
+        "peak_memory_mb": peak_memory / 1024.0 / 1024.0,
+        "queries": [],
+    }
+    for n in ns:
+        for radius in radii:
+            latencies = list()
+            for lat, lng in queries:
+                st = time.time()
+                engine.find_n_nearest(lat, lng, n=n, radius=radius)
+                latencies.append(time.time() - st)
+            result["queries"].append({
+                "n": n,
+                "radius": radius,
+                "p50_ms": percentile_ms(latencies, 50),
+                "p99_ms": percentile_ms(latencies, 99),
+            })
+    return result
+
+
+def _key(result):
+    return (result["distribution"], result["n_points"],
+            result["index"], result["storage"])
+
+
+def compare(results, baseline, tolerance, min_ms=1.0):
+    """Compare with baseline results.
+
+    :param min_ms: latency smaller than this in both results are noise, and
+      never reported as regression.
+    :return: list of regression messages.
+    """
+    baseline = dict((_key(result), result) for result in baseline["results"])
+    messages = list()
+
+    def check(name, new, old, floor=0.0):
+        if max(new, old) < floor:
+            return
+        if old > 0 and new > old * tolerance:
+            messages.append("%s: %.4f -> %.4f (x%.2f)" % (
+                name, old, new, new / old))
+
+    for result in results:
+        old = baseline.get(_key(result))
+        if old is None:
+            continue
+        prefix = "%s/%s/%s/%s" % _key(result)
+        check(prefix + " train_sec", result["train_sec"], old["train_sec"])
+        check(prefix + " peak_memory_mb",
+              result["peak_memory_mb"], old["peak_memory_mb"])
+        old_queries = dict(
+            ((query["n"], query["radius"]), query) for query in old["queries"])
+        for query in result["queries"]:
+            old_query = old_queries.get((query["n"], query["radius"]))
+            if old_query is None:
+                continue
+            for metric in ["p50_ms", "p99_ms"]:
+                check("%s n=%s radius=%s %s" % (
+                    prefix, query["n"], query["radius"], metric),
+                    query[metric], old_query[metric], floor=min_ms)
+    return messages
+
+
+def parse_radius(value):
+    if value.lower() == "none":
+        return None
+    return float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--distributions", nargs="+",
+                        default=sorted(GENERATORS), choices=sorted(GENERATORS))
+    parser.add_argument("--indexes", nargs="+", default=["grid", "kdtree"])
+    parser.add_argument("--storages", nargs="+", default=["columnar"])
+    parser.add_argument("--ns", type=int, nargs="+", default=DEFAULT_NS)
+    parser.add_argument("--radii", type=parse_radius, nargs="+",
+                        default=DEFAULT_RADII,
+                        help="radius in miles, 'none' for no radius")
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_geo_search.json")
+    parser.add_argument("--baseline", default=None,
+                        help="previous result to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.2)
+    parser.add_argument("--min-ms", type=float, default=1.0,
+                        help="ignore latency regression below this")
+    args = parser.parse_args(argv)
+
+    results = list()
+    for distribution in args.distributions:
+        for n_points in args.sizes:
+            for index in args.indexes:
+                for storage in args.storages:
+                    result = bench_one(
+                        distribution, n_points, index, storage,
+                        args.ns, args.radii, args.n_queries, args.seed,
+                    )
+                    results.append(result)
+                    print("%s %s points, index=%s, storage=%s: train %.2f sec, "
+                          "peak memory %.1f MB" % (
+                              distribution, n_points, index, storage,
+                              result["train_sec"], result["peak_memory_mb"]))
+                    for query in result["queries"]:
+                        print("    n=%s radius=%s: p50 %.3f ms, p99 %.3f ms" % (
+                            query["n"], query["radius"],
+                            query["p50_ms"], query["p99_ms"]))
+
+    output = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "n_queries": args.n_queries,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        messages = compare(results, baseline, args.tolerance, args.min_ms)
+        for message in messages:
+            print("REGRESSION " + message)
+        if messages:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
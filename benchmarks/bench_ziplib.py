@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark :mod:`sfm.ziplib` codecs, codec x level x payload size matrix.
+
+Report compression ratio, compress and decompress MB/s::
+
+    $ python benchmarks/bench_ziplib.py --sizes 1024 1048576 --output zip.json
+
+**中文文档**
+
+比较 ziplib 中不同压缩算法, 压缩等级, 数据大小下的压缩率和速度。
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import time
+import pickle
+import random
+import itertools
+import argparse
+import platform
+
+from sfm import ziplib
+
+DEFAULT_LEVELS = {
+    "zlib": [1, 6, 9],
+    "bz2": [1, 9],
+    "lzma": [0, 6],
+    "lz4": [0, 9],
+    "zstd": [1, 3, 19],
+}
+
+
+def make_payload(size, seed=0):
+    """Pickled records, a typical cache payload, compressible but not
+    trivially.
+    """
+    rnd = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta"]
+    names = [" ".join(words3) for words3 in itertools.product(words, repeat=3)]
+    parts = list()
+    total = 0
+    while total < size:
+        records = [
+            {
+                "id": rnd.getrandbits(30),
+                "name": names[rnd.getrandbits(8) % len(names)],
+                "score": rnd.random(),
+            }
+            for _ in range(1000)
+        ]
+        part = pickle.dumps(records, protocol=2)
+        parts.append(part)
+        total += len(part)
+    return b"".join(parts)[:size]
+
+
+def timeit(func, min_time):
+    """Average seconds per call, run at least ``min_time`` seconds.
+    """
+    n = 0
+    st = time.time()
+    while True:
+        func()
+        n += 1
+        elapsed = time.time() - st
+        if elapsed >= min_time:
+            return elapsed / n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--codecs", nargs="+", default=None,
+                        help="default is all available")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024])
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="run each measurement at least this seconds")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args(argv)
+
+    codecs = args.codecs or ziplib.available_codecs()
+    results = list()
+    for size in args.sizes:
+        payload = make_payload(size)
+        for codec in codecs:
+            for level in DEFAULT_LEVELS.get(codec, [6, ]):
+                compressed = ziplib.compress(payload, level=level, codec=codec)
+                compress_sec = timeit(
+                    lambda: ziplib.compress(payload, level=level, codec=codec),
+                    args.min_time,
+                )
+                decompress_sec = timeit(
+                    lambda: ziplib.decompress(compressed), args.min_time)
+                result = {
+                    "codec": codec,
+                    "level": level,
+                    "size": size,
+                    "ratio": float(size) / len(compressed),
+                    "compress_mb_per_sec": size / compress_sec / 1024 ** 2,
+                    "decompress_mb_per_sec": size / decompress_sec / 1024 ** 2,
+                }
+                results.append(result)
+                print("%10s bytes  %-5s level %-2s  ratio %6.2f  "
+                      "compress %8.1f MB/s  decompress %8.1f MB/s" % (
+                          size, codec, level, result["ratio"],
+                          result["compress_mb_per_sec"],
+                          result["decompress_mb_per_sec"]))
+
+    if args.output:
+        output = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=4, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
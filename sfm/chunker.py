@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+"""
+Content defined chunking, split a file into chunks at positions decided by
+the content itself, so inserting or deleting bytes only changes the chunks
+nearby, the other chunks and their digests stay the same. It's the basis of
+deduplication and incremental backup.
+
+The algorithm is FastCDC:
+
+- Gear rolling hash, ``h = (h << 1) + GEAR[byte]``, only the last 64 bytes
+  affect ``h``. It's vectorized by numpy.
+- A chunk is cut when the high bits of ``h`` are all zero. Between
+  ``min_size`` and ``avg_size`` a harder mask (more bits) is used, after
+  ``avg_size`` an easier mask is used, this "normalized chunking" keeps chunk
+  sizes close to ``avg_size``. A chunk never exceeds ``max_size``.
+
+Usage::
+
+    >>> from sfm.chunker import Chunker, ChunkIndex
+    >>> chunker = Chunker(avg_size=8192)
+    >>> index = ChunkIndex()
+    >>> chunks = list(chunker.chunks_of_file("v1.bin"))
+    >>> index.add(chunks)
+    >>> to_upload = index.missing(chunker.chunks_of_file("v2.bin"))
+    >>> index.dump("chunk-index.json")
+
+**中文文档**
+
+基于内容的文件分块。分块的位置由文件内容决定, 在文件中插入或删除数据只会影响附近的
+块, 其他块以及它们的哈希值不变。常用于去重和增量备份, 只需上传变化了的块。
+"""
+
+import json
+import collections
+
+import numpy as np
+
+from .fingerprint import FingerPrint
+
+#: Gear table, 256 random uint64 from a fixed seed, never change it, otherwise
+#: all cut points change.
+GEAR = np.frombuffer(
+    np.random.RandomState(20170101).bytes(256 * 8), dtype="<u8").astype(np.uint64)
+
+WINDOW_SIZE = 64
+
+Chunk = collections.namedtuple("Chunk", "offset length digest")
+
+
+def gear_hash(data):
+    """Gear hash at every position of ``data``, ``result[i]`` covers
+    ``data[i - 63: i + 1]``.
+
+    :param data: bytes like object.
+    :return: numpy uint64 array.
+    """
+    h = GEAR[np.frombuffer(data, dtype=np.uint8)]
+    # window doubling, h_2w[i] = (h_w[i - w] << w) + h_w[i]
+    width = 1
+    while width < WINDOW_SIZE:
+        h[width:] += h[:-width] << np.uint64(width)
+        width *= 2
+    return h
+
+
+#: gear hash is computed piece by piece, small piece stays in CPU cache, it's
+#: 3 times faster than hashing a 4MB block at once.
+PIECE_SIZE = 32 * 1024
+
+
+def _high_bits_mask(n_bits):
+    """Low bits of gear hash only depend on the last few bytes, use high bits.
+    """
+    return np.uint64(((1 << n_bits) - 1) << (64 - n_bits))
+
+
+class Chunker(object):
+    """FastCDC content defined chunker.
+
+    :type min_size: int
+    :param min_size: minimal chunk size, at least 64.
+
+    :type avg_size: int
+    :param avg_size: expected chunk size, has to be power of 2.
+
+    :type max_size: int
+    :param max_size: maximal chunk size.
+
+    :type normalization: int
+    :param normalization: normalized chunking level, number of bits added to
+      / removed from the mask before / after ``avg_size``.
+
+    :type fingerprint: :class:`~sfm.fingerprint.FingerPrint`
+    :param fingerprint: compute digest of chunks, default is md5.
+    """
+
+    def __init__(self, min_size=2048, avg_size=8192, max_size=65536,
+                 normalization=2, fingerprint=None):
+        if avg_size & (avg_size - 1):
+            raise ValueError("avg_size has to be power of 2!")
+        if not (WINDOW_SIZE <= min_size <= avg_size <= max_size):
+            raise ValueError("has to be 64 <= min_size <= avg_size <= max_size!")
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        bits = avg_size.bit_length() - 1
+        self.mask_s = _high_bits_mask(bits + normalization)
+        self.mask_l = _high_bits_mask(max(bits - normalization, 1))
+        if fingerprint is None:
+            fingerprint = FingerPrint()
+        self.fingerprint = fingerprint
+
+    def _candidates(self, data):
+        """Positions where ``h & mask_s == 0`` and where ``h & mask_l == 0``.
+        Each piece is hashed with the 63 bytes before it, so the hash is the
+        same as hashing entire data.
+        """
+        view = memoryview(data)
+        list_s, list_l = list(), list()
+        for start in range(0, len(data), PIECE_SIZE):
+            context = min(start, WINDOW_SIZE - 1)
+            h = gear_hash(view[start - context: start + PIECE_SIZE])[context:]
+            # mask_s has more bits, candidates_s is a subset of candidates_l
+            positions = np.flatnonzero((h & self.mask_l) == 0)
+            list_l.append(positions + start)
+            list_s.append(
+                positions[(h[positions] & self.mask_s) == 0] + start)
+        view.release()
+        return np.concatenate(list_s), np.concatenate(list_l)
+
+    def _cut(self, data, eof):
+        """Find cut points in ``data``, which starts at a chunk boundary.
+
+        :return: list of chunk end offset. If ``eof`` is False, the rest of
+          data after the last cut point is not a complete chunk.
+        """
+        size = len(data)
+        if size == 0:
+            return []
+        candidates_s, candidates_l = self._candidates(data)
+        cuts = list()
+        start = 0
+        while start < size:
+            end = None
+            # cut after the byte at position i, chunk is data[start: i + 1]
+            lo, mid, hi = (start + self.min_size - 1,
+                           start + self.avg_size - 1,
+                           start + self.max_size - 1)
+            i = np.searchsorted(candidates_s, lo)
+            if i < len(candidates_s) and candidates_s[i] < mid:
+                end = candidates_s[i] + 1
+            else:
+                i = np.searchsorted(candidates_l, mid)
+                if i < len(candidates_l) and candidates_l[i] < hi:
+                    end = candidates_l[i] + 1
+                elif hi < size:
+                    end = hi + 1
+            if end is None:  # not enough data to decide
+                if eof:
+                    cuts.append(size)
+                break
+            cuts.append(int(end))
+            start = int(end)
+        return cuts
+
+    def cut_points(self, data):
+        """Chunk end offsets of ``data``.
+
+        :param data: bytes like object.
+        :return: list of int.
+        """
+        return self._cut(data, eof=True)
+
+    def chunks_of_bytes(self, data):
+        """Split ``data`` into chunks.
+
+        :param data: bytes like object.
+        :return: list of :class:`Chunk`.
+        """
+        view = memoryview(data)
+        chunks = list()
+        start = 0
+        for end in self._cut(data, eof=True):
+            chunks.append(Chunk(
+                start, end - start, self.fingerprint.of_bytes(view[start:end])))
+            start = end
+        return chunks
+
+    def iter_chunks(self, fileobj, block_size=4 * 1024 * 1024):
+        """Split a binary file-like object into chunks, read ``block_size``
+        bytes at a time.
+
+        :return: generator of :class:`Chunk`.
+        """
+        block_size = max(block_size, self.max_size)
+        buffer = b""
+        offset = 0
+        eof = False
+        while not eof:
+            data = fileobj.read(block_size)
+            eof = not data
+            buffer = buffer + data if buffer else data
+            view = memoryview(buffer)
+            start = 0
+            for end in self._cut(buffer, eof=eof):
+                yield Chunk(offset + start, end - start,
+                            self.fingerprint.of_bytes(view[start:end]))
+                start = end
+            view.release()
+            buffer = buffer[start:]
+            offset += start
+
+    def chunks_of_file(self, abspath, block_size=4 * 1024 * 1024):
+        """Split a file into chunks.
+
+        :return: generator of :class:`Chunk`.
+        """
+        with open(abspath, "rb") as f:
+            for chunk in self.iter_chunks(f, block_size=block_size):
+                yield chunk
+
+
+class ChunkIndex(object):
+    """Chunk digest index, find out which chunks already exist.
+
+    ``chunks`` attribute is a dict, digest -> chunk length.
+
+    **中文文档**
+
+    块哈希值的索引, 用于找出新文件中哪些块已经存在。
+    """
+
+    def __init__(self, chunks=None):
+        if chunks is None:
+            chunks = dict()
+        self.chunks = chunks
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __contains__(self, digest):
+        return digest in self.chunks
+
+    def add(self, chunks):
+        """Add chunks into index.
+
+        :param chunks: iterable of :class:`Chunk`.
+        """
+        for chunk in chunks:
+            self.chunks[chunk.digest] = chunk.length
+
+    def missing(self, chunks):
+        """Chunks not in the index, duplicate chunks in ``chunks`` are
+        returned only once.
+
+        :param chunks: iterable of :class:`Chunk`.
+        :return: list of :class:`Chunk`.
+        """
+        result = list()
+        seen = set()
+        for chunk in chunks:
+            if chunk.digest not in self.chunks and chunk.digest not in seen:
+                seen.add(chunk.digest)
+                result.append(chunk)
+        return result
+
+    def dump(self, abspath):
+        """Dump index to a json file.
+        """
+        with open(abspath, "w") as f:
+            json.dump(self.chunks, f)
+
+    @classmethod
+    def load(cls, abspath):
+        """Load index from a json file.
+        """
+        with open(abspath, "r") as f:
+            return cls(chunks=json.load(f))
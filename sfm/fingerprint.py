@@ -19,6 +19,29 @@ You can switch the hash algorithm to use::
     
     >>> fingerprint.use("md5") # also "sha1", "sha256", "sha512"
 
+Non-cryptographic but much faster algorithms are good for change detection
+and cache key::
+
+    >>> fingerprint.use("blake2b", digest_size=16) # also "blake2s"
+    >>> fingerprint.use("xxh3_64") # requires ``pip install xxhash``
+    >>> fingerprint.use("fast") # xxh3_64 if available, else 8 bytes blake2b
+
+Multi-GB file can be hashed with large reusable buffer, memory map, or a
+tree-hash on a thread pool::
+
+    >>> fingerprint.of_file("big.iso", mode="mmap")
+    >>> fingerprint.of_file("big.iso", mode="tree", chunk_size=4 * 1024 * 1024)
+
+Hash the structure of a Python object, independent of pickle protocol, dict
+order and Python version, good for cross process cache key::
+
+    >>> fingerprint.of_struct({"b": [1, 2.0, "x"], "a": {1, 2}})
+
+Hash many files concurrently, skip unchanged files with a cache::
+
+    >>> mapping = fingerprint.of_files(paths, cache_path="digest-cache.json")
+    >>> mapping, root = fingerprint.of_dir("data", cache_path="digest-cache.json")
+
 
 **中文文档**
 
@@ -27,14 +50,243 @@ You can switch the hash algorithm to use::
 """
 
 from six import PY2, PY3, text_type, binary_type
+import os
+import mmap
+import json
 import pickle
+import struct
 import hashlib
+import tempfile
+import functools
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+try:
+    import xxhash
+except ImportError:  # pragma: no cover
+    xxhash = None
 
 if PY2:  # pragma: no cover
     default_pk_protocol = 2
 elif PY3:  # pragma: no cover
     default_pk_protocol = 2
 
+#: default buffer size used by :meth:`FingerPrint.of_file`
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def _pread(f, size, offset):
+    """Read ``size`` bytes at ``offset``, use ``os.pread`` if possible,
+    it doesn't move the file position and is thread safe.
+    """
+    if hasattr(os, "pread"):
+        return os.pread(f.fileno(), size, offset)
+    else:  # pragma: no cover
+        f.seek(offset)
+        return f.read(size)
+
+
+_pack_size = struct.Struct("<Q").pack
+_pack_double = struct.Struct("<d").pack
+
+
+def _encode_none(obj, parts):
+    parts.append(b"N")
+
+
+def _encode_bool(obj, parts):
+    parts.append(b"T" if obj else b"F")
+
+
+def _encode_int(obj, parts):
+    parts.append(b"i%d;" % obj)
+
+
+def _encode_float(obj, parts):
+    parts.append(b"f" + _pack_double(obj))
+
+
+def _encode_text(obj, parts):
+    data = obj.encode("utf-8")
+    parts.append(b"s" + _pack_size(len(data)))
+    parts.append(data)
+
+
+def _encode_bytes(obj, parts):
+    parts.append(b"b" + _pack_size(len(obj)))
+    parts.append(bytes(obj))
+
+
+def _encode_sequence(obj, parts):
+    """Encode list or tuple, list of all float, all int or all str are packed
+    in one block, it's much faster than item by item.
+    """
+    n = len(obj)
+    parts.append((b"l" if type(obj) is list else b"t") + _pack_size(n))
+    if n:
+        types = set(map(type, obj))
+        first_type = types.pop()
+        if first_type in (float, int, text_type) and not types:
+            if first_type is float:
+                parts.append(b"f" + struct.pack("<%sd" % n, *obj))
+            elif first_type is int:
+                parts.append(b"i" + ",".join(map(str, obj)).encode("ascii"))
+                parts.append(b";")
+            else:
+                data = [item.encode("utf-8") for item in obj]
+                parts.append(b"s" + struct.pack("<%sQ" % n, *map(len, data)))
+                parts.append(b"".join(data))
+            return
+    parts.append(b"*")
+    get = _ENCODERS.get
+    for item in obj:
+        get(type(item), _encode_other)(item, parts)
+
+
+#: dicts with the same str keys (records) share the sorted, encoded keys.
+_LAYOUT_CACHE = dict()
+_LAYOUT_CACHE_SIZE = 1024
+
+
+def _str_keys_layout(obj):
+    """``[(key, encoded key), ...]`` sorted by encoded key, if all keys are
+    str, else None.
+    """
+    keys = tuple(obj)
+    layout = _LAYOUT_CACHE.get(keys)
+    if layout is not None:
+        return layout
+    if not set(map(type, keys)) <= _STR_TYPE:
+        return None
+    encoded = list()
+    for key in keys:
+        data = key.encode("utf-8")
+        encoded.append((b"s" + _pack_size(len(data)) + data, key))
+    encoded.sort()
+    layout = [(key, data) for data, key in encoded]
+    if len(_LAYOUT_CACHE) < _LAYOUT_CACHE_SIZE and \
+            sum(map(len, keys)) <= 1024:
+        _LAYOUT_CACHE[keys] = layout
+    return layout
+
+
+def _encode_dict(obj, parts):
+    """Items are sorted by encoded key, keys are unique so the order is well
+    defined. Everything is appended to the shared ``parts``, common scalar
+    values are inlined, it's the hot loop of nested dict.
+    """
+    append = parts.append
+    append(b"d" + _pack_size(len(obj)))
+    get = _ENCODERS.get
+    layout = _str_keys_layout(obj)
+    if layout is not None:
+        for key, key_data in layout:
+            append(key_data)
+            value = obj[key]
+            t = type(value)
+            if t is text_type:
+                data = value.encode("utf-8")
+                append(b"s" + _pack_size(len(data)) + data)
+            elif t is int:
+                append(b"i%d;" % value)
+            elif t is float:
+                append(b"f" + _pack_double(value))
+            else:
+                get(t, _encode_other)(value, parts)
+        return
+
+    # general case, encode items in place, then reorder the
+    # (encoded key, start, end) spans of parts by encoded key
+    base = len(parts)
+    spans = list()
+    for key, value in obj.items():
+        start = len(parts)
+        get(type(key), _encode_other)(key, parts)
+        key_data = b"".join(parts[start:])
+        get(type(value), _encode_other)(value, parts)
+        spans.append((key_data, start, len(parts)))
+    spans.sort(key=lambda span: span[0])
+    items = parts[base:]
+    parts[base:] = [
+        part
+        for _, start, end in spans
+        for part in items[start - base:end - base]
+    ]
+
+
+_STR_TYPE = frozenset([text_type, ])
+
+
+def _encode_set(obj, parts):
+    items = sorted([b"".join(_encode_struct(item, list())) for item in obj])
+    parts.append(b"S" + _pack_size(len(obj)))
+    parts.extend(items)
+
+
+def _encode_array(array, parts):
+    interface = array.__array_interface__
+    typestr = interface["typestr"]
+    if typestr[1] == "O":  # python objects
+        parts.append(b"o" + repr(interface["shape"]).encode("ascii"))
+        _encode_struct(array.tolist(), parts)
+        return
+    parts.append(("a%s%r" % (typestr, interface["shape"])).encode("ascii"))
+    try:
+        view = memoryview(array)
+        if not view.c_contiguous:
+            raise ValueError
+        parts.append(view.cast("B") if view.ndim else view.tobytes())
+    except (BufferError, ValueError, TypeError):
+        parts.append(array.tobytes())
+
+
+def _encode_other(obj, parts):
+    if hasattr(obj, "__array_interface__"):
+        return _encode_array(obj, parts)
+    # subclass of supported types
+    for base in (bool, int, float, text_type, binary_type, bytearray,
+                 list, tuple, dict, set, frozenset):
+        if isinstance(obj, base):
+            return _ENCODERS[base](base(obj), parts)
+    raise TypeError("%r is not supported by of_struct!" % type(obj))
+
+
+_ENCODERS = {
+    type(None): _encode_none,
+    bool: _encode_bool,
+    int: _encode_int,
+    float: _encode_float,
+    text_type: _encode_text,
+    binary_type: _encode_bytes,
+    bytearray: _encode_bytes,
+    list: _encode_sequence,
+    tuple: _encode_sequence,
+    dict: _encode_dict,
+    set: _encode_set,
+    frozenset: _encode_set,
+}
+
+
+def _encode_struct(obj, parts):
+    """Canonical, type tagged and prefix free encoding of ``obj``, append
+    encoded parts into ``parts``. Contiguous array buffers are appended as
+    ``memoryview``.
+    """
+    _ENCODERS.get(type(obj), _encode_other)(obj, parts)
+    return parts
+
+
+class _HashWriter(object):
+    """A write-only file-like object feeds everything into a hash object.
+    """
+
+    def __init__(self, m):
+        self.m = m
+
+    def write(self, data):
+        self.m.update(data)
+        return len(data)
+
 
 class FingerPrint(object):
     """A hashlib wrapper class allow you to use one line to do hash as you wish.
@@ -62,9 +314,18 @@ class FingerPrint(object):
         "sha1": hashlib.sha1,
         "sha256": hashlib.sha256,
         "sha512": hashlib.sha512,
+        "blake2b": hashlib.blake2b,
+        "blake2s": hashlib.blake2s,
     }
+    if xxhash is not None:  # pragma: no cover
+        _mapper["xxh64"] = xxhash.xxh64
+        if hasattr(xxhash, "xxh3_64"):
+            _mapper["xxh3_64"] = xxhash.xxh3_64
+            _mapper["xxh3_128"] = xxhash.xxh3_128
+    _digest_size_algorithms = ("blake2b", "blake2s")
 
     def __init__(self, algorithm="md5", pk_protocol=default_pk_protocol):
+        self.algorithm = "md5"
         self.hash_algo = hashlib.md5
         self.return_int = False
         self.pk_protocol = 2
@@ -73,15 +334,45 @@ class FingerPrint(object):
         self.set_return_str()
         self.set_pickle_protocol(pk_protocol)
 
-    def use(self, algorithm):
+    def use(self, algorithm, digest_size=None):
         """Change the hash algorithm you gonna use.
+
+        :type algorithm: str
+        :param algorithm: one of "md5", "sha1", "sha256", "sha512",
+          "blake2b", "blake2s", "xxh64", "xxh3_64", "xxh3_128" (xxhash
+          family requires ``xxhash`` installed), or "fast", the fastest
+          available one, ``xxh3_64`` or 8 bytes ``blake2b`` as fallback.
+
+        :type digest_size: int
+        :param digest_size: digest size in bytes, only for blake2b (1 ~ 64)
+          and blake2s (1 ~ 32).
+
+        ``algorithm`` attribute records the resolved algorithm, for example
+        ``"blake2b-8"``, it is used in tree hash and digest cache.
         """
+        algorithm = algorithm.strip().lower()
+        if algorithm == "fast":
+            if "xxh3_64" in self._mapper:  # pragma: no cover
+                algorithm = "xxh3_64"
+            else:  # pragma: no cover
+                algorithm, digest_size = "blake2b", 8
         try:
-            self.hash_algo = self._mapper[algorithm.strip().lower()]
-        except IndexError:  # pragma: no cover
+            hash_algo = self._mapper[algorithm]
+        except KeyError:
             template = "'%s' is not supported, try one of %s."
             raise ValueError(template % (algorithm, list(self._mapper)))
 
+        if digest_size is not None:
+            if algorithm not in self._digest_size_algorithms:
+                raise ValueError("digest_size is only supported by %s!" %
+                                 list(self._digest_size_algorithms))
+            hash_algo(digest_size=digest_size)  # validate digest_size
+            hash_algo = functools.partial(hash_algo, digest_size=digest_size)
+            algorithm = "%s-%s" % (algorithm, digest_size)
+
+        self.hash_algo = hash_algo
+        self.algorithm = algorithm
+
     def use_md5(self):
         """
         Use md5 hash algorithm.
@@ -124,8 +415,9 @@ class FingerPrint(object):
     def set_pickle_protocol(self, pk_protocol):
         """Set pickle protocol.
         """
-        if pk_protocol not in [2, 3]:
-            raise ValueError("pickle protocol has to be 2 or 3!")
+        if pk_protocol not in range(2, pickle.HIGHEST_PROTOCOL + 1):
+            raise ValueError("pickle protocol has to be in 2 ~ %s!" %
+                             pickle.HIGHEST_PROTOCOL)
         self.pk_protocol = pk_protocol
 
     def set_pickle2(self):
@@ -170,18 +462,117 @@ class FingerPrint(object):
         m.update(text.encode(encoding))
         return self.digest(m)
 
-    def of_pyobj(self, pyobj):
+    def of_pyobj(self, pyobj, stream=False):
         """
         Use default hash method to return hash value of a piece of Python
         picklable object.
 
         :param pyobj: any python object
+
+        :type stream: bool
+        :param stream: if True, pickle the object straight into the hasher
+          with ``pickle.Pickler``, the result is the same. Memory usage is
+          constant only with pickle protocol 4 or above, lower protocol
+          buffers the entire pickle before writing.
+        """
+        m = self.hash_algo()
+        if stream:
+            pickle.Pickler(_HashWriter(m), protocol=self.pk_protocol).dump(pyobj)
+        else:
+            m.update(pickle.dumps(pyobj, protocol=self.pk_protocol))
+        return self.digest(m)
+
+    def of_struct(self, obj):
+        """
+        Use default hash method to return canonical hash value of the
+        structure of a Python object. Unlike :meth:`of_pyobj`, it doesn't
+        depend on pickle protocol, Python version or the order of dict and
+        set, so it can be used as a cross process cache key.
+
+        Every value is encoded with a type tag, length prefixed if needed, so
+        ``[1, 2]``, ``(1, 2)``, ``[1.0, 2.0]`` and ``["1", "2"]`` all have
+        different digest. Supported types:
+
+        - ``None``, ``bool``, ``int``, ``float``, ``str``, ``bytes``,
+          ``bytearray``
+        - ``list``, ``tuple``: items in order, list of all float, all int or
+          all str is packed in one block.
+        - ``dict``, ``set``, ``frozenset``: items are sorted by their
+          encoding, so order doesn't matter.
+        - NumPy array and scalar, or anything has ``__array_interface__``:
+          dtype, shape and the data buffer, contiguous buffer is hashed
+          without copy. NumPy is not required.
+
+        It trades speed for stability: the encoder is pure Python, on dict
+        heavy data (e.g. a list of JSON records) it is about 5 - 10 times
+        slower than :meth:`of_pyobj`. Use :meth:`of_pyobj` if the digest
+        doesn't have to survive a process restart. Large arrays are not
+        affected, they are hashed from the buffer directly.
+
+        :param obj: a Python object made of supported types.
+
+        **中文文档**
+
+        计算 Python 对象结构的哈希值。与 pickle 协议, Python 版本以及字典, 集合中
+        元素的顺序无关, 可以作为跨进程的缓存键。以速度换取稳定性: 对于大量字典
+        组成的数据, 比 :meth:`of_pyobj` 慢 5 - 10 倍。
+        """
+        m = self.hash_algo()
+        parts = _encode_struct(obj, list())
+        if memoryview not in set(map(type, parts)):
+            m.update(b"".join(parts))
+            return self.digest(m)
+        pending = list()
+        for part in parts:
+            if type(part) is memoryview:  # big buffer, don't copy
+                m.update(b"".join(pending))
+                m.update(part)
+                pending = list()
+            else:
+                pending.append(part)
+        m.update(b"".join(pending))
+        return self.digest(m)
+
+    def of_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Use default hash method to return hash value of everything can be
+        read from a binary file-like object, for example an opened file,
+        a socket file or a http response. Only ``chunk_size`` bytes are held
+        in memory.
+
+        :param fileobj: a binary file-like object has ``read`` method.
+        """
+        m = self.hash_algo()
+        if hasattr(fileobj, "readinto"):
+            view = memoryview(bytearray(chunk_size))
+            while True:
+                n = fileobj.readinto(view)
+                if not n:
+                    break
+                m.update(view[:n])
+        else:
+            while True:
+                data = fileobj.read(chunk_size)
+                if not data:
+                    break
+                m.update(data)
+        return self.digest(m)
+
+    def of_chunks(self, chunks):
+        """
+        Use default hash method to return hash value of concatenation of
+        bytes chunks. The result is the same as
+        ``of_bytes(b"".join(chunks))``.
+
+        :param chunks: iterable of binary object.
         """
         m = self.hash_algo()
-        m.update(pickle.dumps(pyobj, protocol=self.pk_protocol))
+        for chunk in chunks:
+            m.update(chunk)
         return self.digest(m)
 
-    def of_file(self, abspath, nbytes=0, chunk_size=1024):
+    def of_file(self, abspath, nbytes=0, chunk_size=DEFAULT_CHUNK_SIZE,
+                mode="stream", processes=None):
         """
         Use default hash method to return hash value of a piece of a file
 
@@ -194,10 +585,27 @@ class FingerPrint(object):
         :param nbytes: only has first N bytes of the file. if 0, hash all file.
 
         :type chunk_size: int
-        :param chunk_size: The max memory we use at one time. 
+        :param chunk_size: The max memory we use at one time. In ``tree``
+          mode, it is also the size of a leaf.
+
+        :type mode: str
+        :param mode: one of
+
+          - ``"stream"``: read into one reusable buffer with ``readinto``.
+          - ``"mmap"``: memory map the file, fall back to ``"stream"`` if the
+            file can't be mapped. Gives the same digest as ``"stream"``.
+          - ``"tree"``: hash every ``chunk_size`` leaf on a thread pool, then
+            hash ``"sfm-tree:<algorithm>:<chunk_size>:"`` plus all leaf
+            digests. The digest is NOT the same as ``"stream"``, it depends
+            on ``algorithm`` and ``chunk_size``, which are recorded in the
+            root, so the same setting always gives the same digest.
+
+        :type processes: int
+        :param processes: number of threads used in ``tree`` mode, default
+          is the number of CPU.
 
         CPU = i7-4600U 2.10GHz - 2.70GHz, RAM = 8.00 GB
-        1 second can process 0.25GB data
+        1 second can process 0.25GB data with ``chunk_size=1024``
 
         - 0.59G - 2.43 sec
         - 1.3G - 5.68 sec
@@ -205,41 +613,347 @@ class FingerPrint(object):
         - 2.5G - 10.32 sec
         - 3.9G - 16.0 sec
 
+        With 1MB buffer the stream mode is bounded by the hash algorithm
+        itself (md5 is about 0.6GB/s per core), ``tree`` mode scales with the
+        number of cores, because hashlib releases the GIL.
+
         ATTENTION:
             if you change the meta data (for example, the title, years 
             information in audio, video) of a multi-media file, then the hash 
             value gonna also change.
+
+        **中文文档**
+
+        ``stream`` 和 ``mmap`` 模式的结果与对整个文件做哈希相同。``tree`` 模式
+        使用多线程分别计算每个块的哈希, 再对所有块的哈希值计算哈希, 结果与块大小
+        和算法有关。
         """
         if nbytes < 0:
             raise ValueError("chunk_size cannot smaller than 0")
         if chunk_size < 1:
             raise ValueError("chunk_size cannot smaller than 1")
-        if (nbytes > 0) and (nbytes < chunk_size):
+        if mode not in ("stream", "mmap", "tree"):
+            raise ValueError("mode has to be one of 'stream', 'mmap', 'tree'!")
+        if (nbytes > 0) and (nbytes < chunk_size) and (mode != "tree"):
             chunk_size = nbytes
 
-        m = self.hash_algo()
-        with open(abspath, "rb") as f:
-            if nbytes:  # use first n bytes
-                have_reads = 0
-                while True:
-                    have_reads += chunk_size
-                    if have_reads > nbytes:
-                        n = nbytes - (have_reads - chunk_size)
-                        if n:
-                            data = f.read(n)
-                            m.update(data)
-                        break
+        with open(abspath, "rb", buffering=0) as f:
+            if mode == "stream":
+                return self._of_file_stream(f, nbytes, chunk_size)
+
+            size = os.fstat(f.fileno()).st_size
+            length = min(nbytes, size) if nbytes else size
+            mm = None
+            if length:
+                try:
+                    mm = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ)
+                except (ValueError, EnvironmentError):  # pragma: no cover
+                    pass
+
+            if mm is None:
+                if mode == "mmap":
+                    return self._of_file_stream(f, nbytes, chunk_size)
+                chunks = self._iter_file_chunks(f, nbytes, chunk_size)
+                return self._of_chunks_tree(chunks, chunk_size, processes)
+
+            try:
+                view = memoryview(mm)
+                try:
+                    if mode == "mmap":
+                        m = self.hash_algo()
+                        for start in range(0, length, chunk_size):
+                            m.update(view[start:start + chunk_size])
+                        return m.hexdigest()
                     else:
-                        data = f.read(chunk_size)
-                        m.update(data)
-            else:  # use entire content
-                while True:
-                    data = f.read(chunk_size)
-                    if not data:
-                        break
-                    m.update(data)
+                        chunks = (
+                            view[start:start + chunk_size]
+                            for start in range(0, length, chunk_size)
+                        )
+                        return self._of_chunks_tree(
+                            chunks, chunk_size, processes)
+                finally:
+                    view.release()
+            finally:
+                mm.close()
+
+    def of_file_sample(self, abspath, n_samples=16, block_size=64 * 1024):
+        """
+        Sampled fingerprint of a huge file in constant time. Hash a header
+        ``"sfm-sample:<algorithm>:<file size>:<block_size>:<n_samples>:"``,
+        then the ``block_size`` bytes at the head, at the tail and at
+        ``n_samples`` evenly spaced offsets in between. Small file, which is
+        not bigger than ``(n_samples + 2) * block_size``, is hashed entirely
+        after the header.
+
+        :type abspath: text_type
+        :param abspath: the absolute path to the file.
+
+        :type n_samples: int
+        :param n_samples: number of blocks sampled between head and tail.
+
+        :type block_size: int
+        :param block_size: size of each sampled block.
+
+        ATTENTION:
+            This is for change detection, not for integrity check. Any change
+            of the file size, or any change inside the sampled blocks changes
+            the digest, such as rewriting meta data at the head or appending
+            frames at the tail. But a same size in-place edit outside of the
+            sampled blocks is NOT detected, two different files with the same
+            size and sampled blocks collide. Only
+            ``(n_samples + 2) * block_size`` bytes are read, increase
+            ``n_samples`` or ``block_size`` to cover more of the file.
+
+        **中文文档**
+
+        对大文件进行抽样哈希, 只读取文件头, 文件尾以及中间均匀分布的若干块数据,
+        加上文件大小计算哈希值, 耗时与文件大小无关。代价是文件大小不变, 且修改
+        发生在抽样块之外时无法检测到变化。
+        """
+        if n_samples < 0:
+            raise ValueError("n_samples cannot smaller than 0")
+        if block_size < 1:
+            raise ValueError("block_size cannot smaller than 1")
+
+        m = self.hash_algo()
+        with open(abspath, "rb", buffering=0) as f:
+            fd = f.fileno()
+            size = os.fstat(fd).st_size
+            m.update(("sfm-sample:%s:%s:%s:%s:" % (
+                self.algorithm, size, block_size, n_samples)).encode("ascii"))
+
+            if size <= (n_samples + 2) * block_size:
+                return self._of_file_stream(f, 0, block_size, m=m)
+
+            last = size - block_size
+            offsets = [0, ] + [
+                last * i // (n_samples + 1) for i in range(1, n_samples + 1)
+            ] + [last, ]
+            for offset in offsets:
+                m.update(_pread(f, block_size, offset))
+        return m.hexdigest()
 
+    def _of_file_stream(self, f, nbytes, chunk_size, m=None):
+        if m is None:
+            m = self.hash_algo()
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        remaining = nbytes
+        while True:
+            if nbytes:
+                if not remaining:
+                    break
+                n = f.readinto(view[:min(chunk_size, remaining)])
+            else:
+                n = f.readinto(view)
+            if not n:
+                break
+            m.update(view[:n])
+            remaining -= n
         return m.hexdigest()
 
+    def _iter_file_chunks(self, f, nbytes, chunk_size):
+        remaining = nbytes
+        while True:
+            if nbytes:
+                if not remaining:
+                    break
+                data = f.read(min(chunk_size, remaining))
+            else:
+                data = f.read(chunk_size)
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    def _hash_leaf(self, chunk):
+        m = self.hash_algo()
+        m.update(chunk)
+        return m.digest()
+
+    def _of_chunks_tree(self, chunks, chunk_size, processes=None):
+        """Tree hash of chunks. Chunks are consumed in batches, so at most
+        ``4 * processes`` chunks are held in memory.
+        """
+        if processes is None:
+            processes = cpu_count()
+        root = self.hash_algo()
+        root.update(
+            ("sfm-tree:%s:%s:" % (self.algorithm, chunk_size)).encode("ascii"))
+        pool = ThreadPool(processes)
+        try:
+            batch = list()
+            for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) == 4 * processes:
+                    for digest in pool.map(self._hash_leaf, batch):
+                        root.update(digest)
+                    batch = list()
+            for digest in pool.map(self._hash_leaf, batch):
+                root.update(digest)
+        finally:
+            pool.close()
+            pool.join()
+        return root.hexdigest()
+
+    def _file_digest_kind(self, nbytes, chunk_size, mode):
+        """Describe the setting that affects the file digest. ``stream`` and
+        ``mmap`` give the same digest, buffer size doesn't matter.
+        """
+        kind = self.algorithm
+        if mode == "tree":
+            kind = "%s:tree:%s" % (kind, chunk_size)
+        if nbytes:
+            kind = "%s:nbytes=%s" % (kind, nbytes)
+        return kind
+
+    def _load_cache(self, cache_path):
+        try:
+            with open(cache_path, "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return dict()
+
+    def _dump_cache(self, cache_path, cache):
+        """Write cache to a temp file then rename it, so a crash never leaves
+        a half written cache.
+        """
+        dirpath = os.path.dirname(os.path.abspath(cache_path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirpath, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, cache_path)
+        except:  # pragma: no cover
+            os.remove(tmp_path)
+            raise
+
+    def of_files(self, paths, cache_path=None, processes=None,
+                 nbytes=0, chunk_size=DEFAULT_CHUNK_SIZE, mode="stream"):
+        """
+        Hash many files concurrently on a thread pool.
+
+        :param paths: list of file path.
+
+        :type cache_path: str
+        :param cache_path: a json file to store digest of hashed file. A file
+          is skipped if its inode, size and mtime_ns are the same as cached.
+          Cache are separated by algorithm and ``of_file`` setting.
+
+        :type processes: int
+        :param processes: number of threads, default is number of CPU.
+
+        ``nbytes``, ``chunk_size`` and ``mode`` are passed to :meth:`of_file`.
+
+        :return: dict, path -> hexdigest.
+
+        **中文文档**
+
+        多线程计算多个文件的哈希值。如果指定了 ``cache_path``, 则 inode, 文件大小
+        和修改时间都没有变化的文件直接使用缓存中的结果。
+        """
+        kind = self._file_digest_kind(nbytes, chunk_size, mode)
+        if cache_path:
+            cache = self._load_cache(cache_path)
+            entries = cache.setdefault(kind, dict())
+        else:
+            cache = None
+            entries = dict()
+
+        result = dict()
+        stats = dict()
+        todo = list()
+        for path in paths:
+            abspath = os.path.abspath(path)
+            st = os.stat(abspath)
+            stat = [st.st_ino, st.st_size, st.st_mtime_ns]
+            entry = entries.get(abspath)
+            if entry is not None and entry[:3] == stat:
+                result[path] = entry[3]
+            else:
+                stats[path] = (abspath, stat)
+                todo.append(path)
+
+        def hash_file(path):
+            # files are already hashed in parallel, don't nest thread pool
+            return path, self.of_file(
+                path, nbytes=nbytes, chunk_size=chunk_size, mode=mode,
+                processes=1)
+
+        if todo:
+            pool = ThreadPool(processes or cpu_count())
+            try:
+                for path, digest in pool.imap_unordered(hash_file, todo):
+                    result[path] = digest
+                    abspath, stat = stats[path]
+                    entries[abspath] = stat + [digest, ]
+            finally:
+                pool.close()
+                pool.join()
+
+        if cache is not None and todo:
+            self._dump_cache(cache_path, cache)
+        return result
+
+    def of_dir(self, dirpath, cache_path=None, processes=None,
+               nbytes=0, chunk_size=DEFAULT_CHUNK_SIZE, mode="stream"):
+        """
+        Hash all files in a directory, and a Merkle-style digest of the
+        directory.
+
+        A directory digest is hash of its sorted entries, each entry is
+        ``kind + " " + name + "\\0" + raw digest``, ``kind`` is ``f`` for
+        file and ``d`` for sub directory. So the root digest changes if any
+        file content, file name or directory structure changes.
+
+        Arguments are the same as :meth:`of_files`.
+
+        :return: (dict, str), relative path (use "/") -> hexdigest of files,
+          and hexdigest of the directory.
+
+        **中文文档**
+
+        计算目录下所有文件的哈希值, 以及整个目录的 Merkle 树哈希值。
+        """
+        dirpath = os.path.abspath(dirpath)
+        relpaths = dict()  # abspath -> relpath
+        children = dict()  # relative dir -> list of (kind, name, relpath)
+        for root, dirnames, filenames in os.walk(dirpath):
+            reldir = os.path.relpath(root, dirpath).replace(os.sep, "/")
+            if reldir == ".":
+                reldir = ""
+            prefix = reldir + "/" if reldir else ""
+            entries = children.setdefault(reldir, list())
+            for dirname in dirnames:
+                entries.append(("d", dirname, prefix + dirname))
+            for filename in filenames:
+                abspath = os.path.join(root, filename)
+                if not os.path.isfile(abspath):  # broken symlink, fifo, ...
+                    continue
+                relpath = prefix + filename
+                entries.append(("f", filename, relpath))
+                relpaths[abspath] = relpath
+
+        digests = self.of_files(
+            list(relpaths), cache_path=cache_path, processes=processes,
+            nbytes=nbytes, chunk_size=chunk_size, mode=mode,
+        )
+        mapping = dict(
+            (relpaths[path], digest) for path, digest in digests.items())
+
+        def dir_digest(reldir):
+            m = self.hash_algo()
+            for kind, name, relpath in sorted(
+                    children.get(reldir, list()), key=lambda x: x[1]):
+                if kind == "f":
+                    digest = mapping[relpath]
+                else:
+                    digest = dir_digest(relpath)
+                m.update(("%s %s\0" % (kind, name)).encode("utf-8"))
+                m.update(bytearray.fromhex(digest))
+            return m.hexdigest()
+
+        return mapping, dir_digest("")
+
 
 fingerprint = FingerPrint()
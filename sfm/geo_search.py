@@ -4,14 +4,29 @@
 n nearest 2D sphere search implementation.
 """
 
+import os
+import json
 import heapq
-from math import radians, cos, sin, asin, sqrt
+import pickle
+import multiprocessing
+from array import array
+from math import radians, cos, sin, asin, sqrt, floor, ceil
+import numpy as np
 from sqlalchemy import create_engine, MetaData, Table, Column, Index
 from sqlalchemy import String, Float, PickleType
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, or_, literal_column
 
 
 AVG_EARTH_RADIUS = 6371  # in km
+KM_TO_MILES = 0.621371
+INF = float("inf")
+
+#: batch query with more points than this is executed on a process pool
+PARALLEL_THRESHOLD = 10000
+#: max number of query points evaluated together in one bucket
+BUCKET_SIZE = 512
+
+_pool_engine = None  # the engine shared with forked worker processes
 
 
 def great_circle(point1, point2, miles=True):
@@ -36,13 +51,864 @@ def great_circle(point1, point2, miles=True):
     d = sin(lat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(lng / 2) ** 2
     h = 2 * AVG_EARTH_RADIUS * asin(sqrt(d))
     if miles:
-        return h * 0.621371  # in miles
+        return h * KM_TO_MILES  # in miles
+    else:
+        return h  # in kilometers
+
+
+def great_circle_many(point, lats, lngs, miles=True):
+    """Vectorized version of :func:`great_circle`, calculate the great-circle
+    distance between one point and many points.
+
+    :param point: 2-tuple of latitude and longitude.
+    :param lats: array like of latitude.
+    :param lngs: array like of longitude.
+    :return: 1-d ``numpy.ndarray`` of distance, same length as ``lats``.
+
+    Example::
+
+        >>> great_circle_many((45.7597, 4.8422), [48.8567, 40.7128], [2.3508, -74.0060])
+        array([  243.71209416,  3819.4255547 ])
+    """
+    lat1, lng1 = radians(point[0]), radians(point[1])
+    lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+    lng2 = np.radians(np.asarray(lngs, dtype=np.float64))
+
+    d = np.sin((lat2 - lat1) / 2) ** 2 + \
+        cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    h = 2 * AVG_EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(d, 0.0, 1.0)))
+    if miles:
+        return h * KM_TO_MILES  # in miles
+    else:
+        return h  # in kilometers
+
+
+def great_circle_pairwise(points1, points2, miles=True):
+    """Calculate the great-circle distance between every pair of points of
+    two point sets.
+
+    :param points1: array like of N (latitude, longitude) pairs.
+    :param points2: array like of M (latitude, longitude) pairs.
+    :return: ``numpy.ndarray`` of shape ``(N, M)``, the element ``[i, j]`` is
+        the distance between ``points1[i]`` and ``points2[j]``.
+    """
+    points1 = np.radians(np.asarray(points1, dtype=np.float64).reshape(-1, 2))
+    points2 = np.radians(np.asarray(points2, dtype=np.float64).reshape(-1, 2))
+    lat1, lng1 = points1[:, 0:1], points1[:, 1:2]
+    lat2, lng2 = points2[:, 0], points2[:, 1]
+
+    d = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    h = 2 * AVG_EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(d, 0.0, 1.0)))
+    if miles:
+        return h * KM_TO_MILES  # in miles
     else:
         return h  # in kilometers
 
 
+def _n_smallest(dists, positions, n):
+    """Keep the n smallest distance, return them with their position in
+    ascending order.
+    """
+    if len(dists) > n:
+        keep = np.argpartition(dists, n - 1)[:n]
+        dists, positions = dists[keep], positions[keep]
+    order = np.argsort(dists, kind="mergesort")
+    return dists[order], positions[order]
+
+
+def _write_buffer(buffer, size, values):
+    """Write ``values`` into ``buffer`` after the first ``size`` elements. The
+    buffer capacity is doubled when it is full, so appending is amortized
+    O(len(values)).
+
+    :return: the buffer, may be a new one.
+    """
+    values = np.asarray(values)
+    if size == 0:
+        dtype = values.dtype
+    else:
+        try:
+            dtype = np.result_type(buffer, values)
+        except TypeError:
+            dtype = np.dtype(object)
+    end = size + len(values)
+    if (end > len(buffer)) or (dtype != buffer.dtype):
+        new_buffer = np.zeros(max(end, 2 * len(buffer), 16), dtype=dtype)
+        new_buffer[:size] = buffer[:size]
+        buffer = new_buffer
+    buffer[size:end] = values
+    return buffer
+
+
+def in_box(lats, lngs, lat_lo, lat_hi, lng_lo, lng_hi):
+    """Test if points are inside a lat / lng box, boundary included.
+
+    :param lng_lo, lng_hi: if ``lng_lo > lng_hi``, the box crosses the
+        anti-meridian, for example ``(170, -170)``.
+    :return: boolean ``numpy.ndarray``.
+    """
+    lats, lngs = np.asarray(lats), np.asarray(lngs)
+    mask = (lats >= lat_lo) & (lats <= lat_hi)
+    if lng_lo <= lng_hi:
+        return mask & (lngs >= lng_lo) & (lngs <= lng_hi)
+    else:
+        return mask & ((lngs >= lng_lo) | (lngs <= lng_hi))
+
+
+def in_polygon(lats, lngs, polygon):
+    """Test if points are inside a polygon with the even-odd rule, edges are
+    straight lines on the lat / lng plane.
+
+    :param polygon: list of (lat, lng) vertices, it should not cross the
+        anti-meridian.
+    :return: boolean ``numpy.ndarray``.
+    """
+    polygon = list(polygon)
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    inside = np.zeros(lats.shape, dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for (lat1, lng1), (lat2, lng2) in \
+                zip(polygon, polygon[-1:] + polygon[:-1]):
+            crossed = (lat1 > lats) != (lat2 > lats)
+            lng_cross = (lng2 - lng1) * (lats - lat1) / (lat2 - lat1) + lng1
+            inside ^= crossed & (lngs < lng_cross)
+    return inside
+
+
+def _earth_radius(miles=True):
+    if miles:
+        return AVG_EARTH_RADIUS * KM_TO_MILES
+    else:
+        return AVG_EARTH_RADIUS
+
+
+class GridIndex(object):
+    """Uniform lat / lng grid spatial index.
+
+    The sphere is cut into roughly ``cell_size`` x ``cell_size`` degree cells,
+    each cell remembers the position of the points inside it. A query starts
+    from the cell containing the center point and expands ring by ring, for
+    each ring it also gives a lower bound of the distance to any point that
+    has not been visited yet, so the caller knows when to stop.
+
+    :param cell_size: cell size in degree, the grid is slightly adjusted so
+        that 180 / 360 degree are divided evenly.
+
+    **中文文档**
+
+    将地球表面按照经纬度划分为均匀的网格, 查询时从中心点所在的网格开始一圈一圈
+    向外扩展, 直到剩余的点不可能比已找到的点更近为止。
+    """
+
+    def __init__(self, cell_size=1.0):
+        if not (0 < cell_size <= 90):
+            raise ValueError("cell_size has to be in (0, 90]!")
+        self.n_row = int(round(180.0 / cell_size))
+        self.n_col = int(round(360.0 / cell_size))
+        self.lat_cell = 180.0 / self.n_row
+        self.lng_cell = 360.0 / self.n_col
+        self.clear()
+
+    def locate(self, lat, lng):
+        """Find the ``(row, col)`` of the cell containing a point.
+        """
+        i = int((lat + 90.0) // self.lat_cell)
+        j = int(((lng + 180.0) % 360.0) // self.lng_cell)
+        return min(max(i, 0), self.n_row - 1), min(j, self.n_col - 1)
+
+    def clear(self):
+        # the points are stored in compressed sparse row format: positions of
+        # cell ``codes[k]`` are ``positions[offsets[k]:offsets[k + 1]]``, a
+        # cell's code is ``row * n_col + col``.
+        self._codes = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._positions = np.zeros(0, dtype=np.intp)
+        self._slices = None  # code -> (start, end)
+        # cells changed after the build, (row, col) -> list of positions
+        self.cells = dict()
+
+    def _base_positions(self, cell):
+        if self._slices is None:  # built on demand, so loading stays fast
+            offsets = self._offsets.tolist()
+            self._slices = dict(zip(
+                self._codes.tolist(), zip(offsets[:-1], offsets[1:])))
+        try:
+            start, end = self._slices[cell[0] * self.n_col + cell[1]]
+            return self._positions[start:end]
+        except KeyError:
+            return self._positions[0:0]
+
+    def cell_positions(self, cell):
+        """Positions of the points in a cell.
+        """
+        try:
+            return self.cells[cell]
+        except KeyError:
+            return self._base_positions(cell)
+
+    def _mutable_cell(self, cell):
+        try:
+            return self.cells[cell]
+        except KeyError:
+            positions = self._base_positions(cell).tolist()
+            self.cells[cell] = positions
+            return positions
+
+    def add(self, pos, lat, lng):
+        """Add a point to the index.
+
+        :param pos: position of the point in the engine storage.
+        """
+        self._mutable_cell(self.locate(lat, lng)).append(pos)
+
+    def build(self, lats, lngs, positions):
+        """(Re)build the index.
+
+        :param lats: latitude of all points in the engine storage.
+        :param lngs: longitude of all points in the engine storage.
+        :param positions: position of points to index.
+        """
+        self.clear()
+        if not len(positions):
+            return
+        positions = np.asarray(positions, dtype=np.intp)
+        lats, lngs = lats[positions], lngs[positions]
+        rows = np.clip(
+            ((lats + 90.0) // self.lat_cell).astype(np.int64), 0, self.n_row - 1)
+        cols = np.minimum(
+            (((lngs + 180.0) % 360.0) // self.lng_cell).astype(np.int64),
+            self.n_col - 1,
+        )
+        codes = rows * self.n_col + cols
+        order = np.argsort(codes, kind="mergesort")
+        codes = codes[order]
+        starts = np.flatnonzero(np.diff(codes)) + 1
+        self._codes = codes[np.concatenate([[0], starts])]
+        self._offsets = np.concatenate([[0], starts, [len(codes)]])
+        self._positions = positions[order]
+
+    def insert(self, lats, lngs, positions):
+        """Add points to the index.
+        """
+        for pos in positions:
+            self.add(int(pos), lats[pos], lngs[pos])
+
+    def remove(self, lats, lngs, positions):
+        """Remove points from the index.
+        """
+        for pos in positions:
+            self._mutable_cell(self.locate(lats[pos], lngs[pos])).remove(pos)
+
+    def save(self, dirpath):
+        """Save the index into a directory as ``.npy`` files. Points changed
+        after the build are not saved, rebuild it before calling this.
+        """
+        np.save(os.path.join(dirpath, "grid_codes.npy"), self._codes)
+        np.save(os.path.join(dirpath, "grid_offsets.npy"), self._offsets)
+        np.save(os.path.join(dirpath, "grid_positions.npy"), self._positions)
+
+    def load(self, dirpath, mmap_mode="c"):
+        """Load the index saved by :meth:`save`, arrays are memory-mapped.
+        """
+        self.clear()
+        self._codes = np.load(
+            os.path.join(dirpath, "grid_codes.npy"), mmap_mode=mmap_mode)
+        self._offsets = np.load(
+            os.path.join(dirpath, "grid_offsets.npy"), mmap_mode=mmap_mode)
+        self._positions = np.load(
+            os.path.join(dirpath, "grid_positions.npy"), mmap_mode=mmap_mode)
+
+    def _ring_cells(self, i0, j0, k):
+        if k == 0:
+            yield i0, j0
+            return
+        if 2 * k + 1 >= self.n_col:
+            cols = range(self.n_col)
+        else:
+            cols = [j % self.n_col for j in range(j0 - k, j0 + k + 1)]
+        for i in (i0 - k, i0 + k):
+            if 0 <= i < self.n_row:
+                for j in cols:
+                    yield i, j
+        for i in range(max(i0 - k + 1, 0), min(i0 + k, self.n_row)):
+            for j in ((j0 - k) % self.n_col, (j0 + k) % self.n_col):
+                yield i, j
+
+    def _outside_bound(self, lat, lng, i0, j0, k):
+        """Lower bound of the angular distance (in radian) between the center
+        point and any point outside of the first ``k`` rings.
+        """
+        lat_lo = -90.0 + (i0 - k) * self.lat_cell
+        lat_hi = -90.0 + (i0 + k + 1) * self.lat_cell
+        if lat_lo <= -90.0 and lat_hi >= 90.0:
+            lat_gap = INF
+        else:
+            lat_gap = min(
+                lat - lat_lo if lat_lo > -90.0 else INF,
+                lat_hi - lat if lat_hi < 90.0 else INF,
+            )
+
+        if 2 * k + 1 >= self.n_col:
+            return radians(lat_gap) if lat_gap != INF else INF
+
+        offset = (lng + 180.0) % 360.0 - j0 * self.lng_cell
+        lng_gap = min(
+            offset + k * self.lng_cell,
+            (self.lng_cell - offset) + k * self.lng_cell,
+        )
+        # a point with latitude phi and longitude difference dlng is at least
+        # asin(cos(phi) * sin(dlng)) away from the meridian of the center.
+        phi_max = min(max(abs(lat_lo), abs(lat_hi)), 90.0)
+        lng_bound = asin(
+            cos(radians(phi_max)) * sin(radians(min(lng_gap, 90.0)))
+        )
+        return min(radians(lat_gap), lng_bound)
+
+    def iter_cell_rings(self, i0, j0):
+        """Visit the index ring by ring around the cell ``(i0, j0)``.
+
+        :return: generator of ``(k, positions)``, ``positions`` is the array of
+            points in the k-th ring, it stops after the whole sphere is visited.
+        """
+        visited = set()
+        k = 0
+        while True:
+            chunks = list()
+            for cell in self._ring_cells(i0, j0, k):
+                if cell not in visited:
+                    visited.add(cell)
+                    positions = self.cell_positions(cell)
+                    if len(positions):
+                        chunks.append(positions)
+            if chunks:
+                positions = np.concatenate(chunks).astype(np.intp, copy=False)
+            else:
+                positions = self._positions[0:0]
+            yield k, positions
+            if (i0 - k <= 0) and (i0 + k + 1 >= self.n_row) \
+                    and (2 * k + 1 >= self.n_col):
+                break
+            k += 1
+
+    def iter_rings(self, lat, lng):
+        """Visit the index ring by ring around a center point.
+
+        :return: generator of ``(positions, bound)``, ``positions`` is the
+            array of points in the current ring, ``bound`` is the lower bound of angular
+            distance (in radian) to every point not visited yet.
+        """
+        i0, j0 = self.locate(lat, lng)
+        for k, positions in self.iter_cell_rings(i0, j0):
+            yield positions, self._outside_bound(lat, lng, i0, j0, k)
+
+    def query(self, lats, lngs, lat, lng, n, radius):
+        """Find n nearest point within ``radius`` miles.
+
+        Rings are visited from inside to outside, and the search stops as soon
+        as the n-th best distance is smaller than the distance to any point
+        outside the visited rings.
+
+        :param lats: latitude of all indexed points.
+        :param lngs: longitude of all indexed points.
+        :return: ``(dists, positions)``, in ascending order of distance.
+        """
+        earth_radius = _earth_radius(miles=True)
+        best_dists = np.zeros(0, dtype=np.float64)
+        best_positions = np.zeros(0, dtype=np.intp)
+        for positions, bound in self.iter_rings(lat, lng):
+            if len(positions):
+                dists = great_circle_many(
+                    (lat, lng), lats[positions], lngs[positions])
+                within = dists <= radius
+                best_dists, best_positions = _n_smallest(
+                    np.concatenate([best_dists, dists[within]]),
+                    np.concatenate([best_positions, positions[within]]),
+                    n,
+                )
+            bound = bound * earth_radius
+            if bound > radius:
+                break
+            if len(best_dists) == n and best_dists[-1] <= bound:
+                break
+        return best_dists, best_positions
+
+    def bucket_key(self, lat, lng):
+        """Center points with the same bucket key are queried together by
+        :meth:`query_bucket`.
+        """
+        return self.locate(lat, lng)
+
+    def iter_box(self, lats, lngs, lat_lo, lat_hi, lng_lo, lng_hi):
+        """Find points in a lat / lng box, only cells overlapping the box
+        are visited.
+
+        :return: generator of array of positions.
+        """
+        i_lo = self.locate(lat_lo, 0.0)[0]
+        i_hi = self.locate(lat_hi, 0.0)[0]
+        j_lo = min(max(int((lng_lo + 180.0) // self.lng_cell), 0), self.n_col - 1)
+        j_hi = min(max(int((lng_hi + 180.0) // self.lng_cell), 0), self.n_col - 1)
+        if lng_lo <= lng_hi:
+            cols = list(range(j_lo, j_hi + 1))
+        else:  # cross the anti-meridian
+            cols = list(range(j_lo, self.n_col)) + list(range(0, j_hi + 1))
+        # lng 180 is stored in column 0 together with -180, see locate()
+        if lng_hi >= 180.0 and 0 not in cols:
+            cols.append(0)
+        for i in range(i_lo, i_hi + 1):
+            for j in cols:
+                positions = self.cell_positions((i, j))
+                if len(positions):
+                    positions = np.asarray(positions, dtype=np.intp)
+                    yield positions[in_box(
+                        lats[positions], lngs[positions],
+                        lat_lo, lat_hi, lng_lo, lng_hi,
+                    )]
+
+    def query_bucket(self, lats, lngs, key, points, n, radius):
+        """Find n nearest point for many center points in the same grid cell.
+
+        The rings are only fetched once, and the distance between all center
+        points and the candidates is computed as one matrix.
+
+        :return: list of ``(dists, positions)``.
+        """
+        earth_radius = _earth_radius(miles=True)
+        i0, j0 = key
+        n_query = len(points)
+
+        # the n best so far of each center point, padded by inf
+        best_dists = np.full((n_query, n), INF)
+        best_positions = np.zeros((n_query, n), dtype=np.intp)
+        rows = np.arange(n_query)[:, None]
+        for k, positions in self.iter_cell_rings(i0, j0):
+            if len(positions):
+                dists = great_circle_pairwise(
+                    points, np.column_stack([lats[positions], lngs[positions]]))
+                dists[dists > radius] = INF
+                dists = np.concatenate([best_dists, dists], axis=1)
+                positions = np.concatenate([
+                    best_positions,
+                    np.broadcast_to(positions, (n_query, len(positions))),
+                ], axis=1)
+                keep = np.argpartition(dists, n - 1, axis=1)[:, :n]
+                best_dists = dists[rows, keep]
+                best_positions = positions[rows, keep]
+
+            bounds = earth_radius * np.array([
+                self._outside_bound(lat, lng, i0, j0, k)
+                for lat, lng in points
+            ])
+            done = (bounds > radius) | (best_dists.max(axis=1) <= bounds)
+            if done.all():
+                break
+
+        results = list()
+        for dists, positions in zip(best_dists, best_positions):
+            order = np.argsort(dists, kind="mergesort")
+            order = order[dists[order] != INF]
+            results.append((dists[order], positions[order]))
+        return results
+
+
+def _to_unit_vectors(lats, lngs):
+    """Convert latitude, longitude in degree to 3D unit vectors.
+
+    :return: array of shape ``(N, 3)``.
+    """
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs = np.radians(np.asarray(lngs, dtype=np.float64))
+    cos_lats = np.cos(lats)
+    return np.column_stack(
+        [cos_lats * np.cos(lngs), cos_lats * np.sin(lngs), np.sin(lats)])
+
+
+def _interval_cos(lo, hi):
+    """Range of cos(x) for x in [lo, hi] (degree), ``lo <= hi``.
+    """
+    values = [cos(radians(lo)), cos(radians(hi))]
+    # cos(x) is 1 at x = 360k, and -1 at x = 180 + 360k
+    if floor(hi / 360.0) >= ceil(lo / 360.0):
+        values.append(1.0)
+    if floor((hi - 180.0) / 360.0) >= ceil((lo - 180.0) / 360.0):
+        values.append(-1.0)
+    return min(values), max(values)
+
+
+def _box_to_3d(lat_lo, lat_hi, lng_lo, lng_hi):
+    """Bounding box of the unit vectors of all points in a lat / lng box.
+
+    :return: ``(x_lo, y_lo, z_lo, x_hi, y_hi, z_hi)``.
+    """
+    if lng_hi < lng_lo:  # cross the anti-meridian
+        lng_hi += 360.0
+    lat_cos_lo, lat_cos_hi = _interval_cos(lat_lo, lat_hi)
+    lng_cos_lo, lng_cos_hi = _interval_cos(lng_lo, lng_hi)
+    # sin(x) = cos(x - 90)
+    lng_sin_lo, lng_sin_hi = _interval_cos(lng_lo - 90.0, lng_hi - 90.0)
+    xs = [a * b for a in (lat_cos_lo, lat_cos_hi) for b in (lng_cos_lo, lng_cos_hi)]
+    ys = [a * b for a in (lat_cos_lo, lat_cos_hi) for b in (lng_sin_lo, lng_sin_hi)]
+    eps = 1e-12  # absorb rounding error of the node boxes
+    return (
+        min(xs) - eps, min(ys) - eps, sin(radians(lat_lo)) - eps,
+        max(xs) + eps, max(ys) + eps, sin(radians(lat_hi)) + eps,
+    )
+
+
+class SphereKDTree(object):
+    """KD-tree built on the 3D unit vector of the points.
+
+    Unlike a lat / lng box, the euclidean (chord) distance between unit
+    vectors has no singularity at the pole or the anti-meridian, and it is
+    monotonic with the great-circle distance. Each node keeps the bounding
+    box of its points, the chord distance to the box is a lower bound of
+    the great-circle distance to every point inside, so a best-first search
+    answers exact k nearest and radius queries in logarithmic time.
+
+    The tree itself is static. Inserted points are kept in a pending list
+    that is scanned on every query, removed points are masked out, the tree
+    is rebuilt once the pending or removed points exceed ``rebuild_ratio`` of
+    the tree size, so the cost of update is amortized.
+
+    :param leaf_size: max number of points in a leaf node.
+    :param rebuild_ratio: rebuild the tree when that many points are changed
+        since the last build.
+
+    **中文文档**
+
+    将经纬度转换为单位球面上的三维坐标, 在其上建立KD树。没有极点和180度经线
+    附近的问题, 可以精确地回答最近邻和半径查询。
+    """
+
+    def __init__(self, leaf_size=32, rebuild_ratio=0.1):
+        if leaf_size < 1:
+            raise ValueError("leaf_size has to be at least 1!")
+        self.leaf_size = leaf_size
+        self.rebuild_ratio = rebuild_ratio
+        self.clear()
+
+    def clear(self):
+        self._pending = list()  # inserted since the last build
+        self._removed = set()  # removed from the tree since the last build
+        self._removed_mask = np.zeros(0, dtype=bool)
+        self._perm = np.zeros(0, dtype=np.intp)
+        self._starts = list()
+        self._ends = list()
+        self._lefts = list()
+        self._rights = list()
+        self._boxes = list()  # (x_lo, y_lo, z_lo, x_hi, y_hi, z_hi)
+
+    def build(self, lats, lngs, positions):
+        """(Re)build the tree.
+
+        :param lats: latitude of all points in the engine storage.
+        :param lngs: longitude of all points in the engine storage.
+        :param positions: position of points to index.
+        """
+        self.clear()
+        positions = np.array(positions, dtype=np.intp)
+        self._removed_mask = np.zeros(len(lats), dtype=bool)
+        xyz = _to_unit_vectors(lats[positions], lngs[positions])
+        perm = np.arange(len(positions), dtype=np.intp)
+        starts, ends, lefts, rights, boxes = \
+            self._starts, self._ends, self._lefts, self._rights, self._boxes
+
+        def new_node(start, end):
+            points = xyz[perm[start:end]]
+            lo, hi = points.min(axis=0), points.max(axis=0)
+            starts.append(start)
+            ends.append(end)
+            lefts.append(-1)
+            rights.append(-1)
+            boxes.append(tuple(lo.tolist() + hi.tolist()))
+            return len(starts) - 1
+
+        if len(perm):
+            stack = [new_node(0, len(perm))]
+            while stack:
+                node = stack.pop()
+                start, end = starts[node], ends[node]
+                if end - start <= self.leaf_size:
+                    continue
+                box = boxes[node]
+                axis = int(np.argmax(np.subtract(box[3:], box[:3])))
+                mid = (start + end) // 2
+                sub = perm[start:end]
+                order = np.argpartition(xyz[sub, axis], mid - start)
+                perm[start:end] = sub[order]
+                lefts[node] = new_node(start, mid)
+                rights[node] = new_node(mid, end)
+                stack.append(lefts[node])
+                stack.append(rights[node])
+        self._perm = positions[perm]
+
+    def save(self, dirpath):
+        """Save the tree into a directory as ``.npy`` files. Points changed
+        after the build are not saved, rebuild it before calling this.
+        """
+        np.save(os.path.join(dirpath, "kdtree_perm.npy"), self._perm)
+        np.save(
+            os.path.join(dirpath, "kdtree_nodes.npy"),
+            np.array(
+                [self._starts, self._ends, self._lefts, self._rights],
+                dtype=np.int64,
+            ).reshape(4, -1),
+        )
+        np.save(
+            os.path.join(dirpath, "kdtree_boxes.npy"),
+            np.array(self._boxes, dtype=np.float64).reshape(-1, 6),
+        )
+
+    def load(self, dirpath, mmap_mode="c"):
+        """Load the tree saved by :meth:`save`, the point positions are
+        memory-mapped.
+        """
+        self.clear()
+        self._perm = np.load(
+            os.path.join(dirpath, "kdtree_perm.npy"), mmap_mode=mmap_mode)
+        self._removed_mask = np.zeros(
+            int(self._perm.max()) + 1 if len(self._perm) else 0, dtype=bool)
+        nodes = np.load(os.path.join(dirpath, "kdtree_nodes.npy"))
+        self._starts, self._ends, self._lefts, self._rights = \
+            [row.tolist() for row in nodes]
+        boxes = np.load(os.path.join(dirpath, "kdtree_boxes.npy"))
+        self._boxes = [tuple(box) for box in boxes.tolist()]
+
+    def _maybe_rebuild(self, lats, lngs):
+        n_changed = len(self._pending) + len(self._removed)
+        if n_changed > max(self.leaf_size, self.rebuild_ratio * len(self._perm)):
+            perm = self._perm
+            if self._removed:
+                perm = perm[~self._removed_mask[perm]]
+            self.build(lats, lngs, np.concatenate(
+                [perm, np.array(self._pending, dtype=np.intp)]))
+
+    def insert(self, lats, lngs, positions):
+        """Add points to the index.
+        """
+        self._pending.extend(int(pos) for pos in positions)
+        self._maybe_rebuild(lats, lngs)
+
+    def remove(self, lats, lngs, positions):
+        """Remove points from the index.
+        """
+        pending = set(self._pending)
+        for pos in positions:
+            pos = int(pos)
+            if pos in pending:
+                self._pending.remove(pos)
+            else:
+                self._removed.add(pos)
+                self._removed_mask[pos] = True
+        self._maybe_rebuild(lats, lngs)
+
+    def _min_dist(self, node, x, y, z, earth_radius):
+        """Lower bound of the great-circle distance between ``(x, y, z)`` and
+        every point in ``node``.
+        """
+        x_lo, y_lo, z_lo, x_hi, y_hi, z_hi = self._boxes[node]
+        dx = x_lo - x if x < x_lo else (x - x_hi if x > x_hi else 0.0)
+        dy = y_lo - y if y < y_lo else (y - y_hi if y > y_hi else 0.0)
+        dz = z_lo - z if z < z_lo else (z - z_hi if z > z_hi else 0.0)
+        chord = sqrt(dx * dx + dy * dy + dz * dz)
+        return 2 * earth_radius * asin(min(chord / 2, 1.0))
+
+    def query(self, lats, lngs, lat, lng, n, radius):
+        """Find n nearest point within ``radius`` miles.
+
+        :param lats: latitude of all indexed points.
+        :param lngs: longitude of all indexed points.
+        :return: ``(dists, positions)``, in ascending order of distance.
+        """
+        earth_radius = _earth_radius(miles=True)
+        best_dists = np.zeros(0, dtype=np.float64)
+        best_positions = np.zeros(0, dtype=np.intp)
+        if self._pending:
+            positions = np.array(self._pending, dtype=np.intp)
+            dists = great_circle_many(
+                (lat, lng), lats[positions], lngs[positions])
+            within = dists <= radius
+            best_dists, best_positions = _n_smallest(
+                dists[within], positions[within], n)
+        if not self._starts:
+            return best_dists, best_positions
+
+        x, y, z = _to_unit_vectors([lat], [lng])[0].tolist()
+        heap = [(0.0, 0)]
+        while heap:
+            bound, node = heapq.heappop(heap)
+            if bound > radius:
+                break
+            if len(best_dists) == n and bound > best_dists[-1]:
+                break
+            left = self._lefts[node]
+            if left == -1:  # leaf
+                positions = self._perm[self._starts[node]:self._ends[node]]
+                if self._removed:
+                    positions = positions[~self._removed_mask[positions]]
+                dists = great_circle_many(
+                    (lat, lng), lats[positions], lngs[positions])
+                within = dists <= radius
+                best_dists, best_positions = _n_smallest(
+                    np.concatenate([best_dists, dists[within]]),
+                    np.concatenate([best_positions, positions[within]]),
+                    n,
+                )
+            else:
+                for child in (left, self._rights[node]):
+                    bound = self._min_dist(child, x, y, z, earth_radius)
+                    if bound <= radius:
+                        heapq.heappush(heap, (bound, child))
+        return best_dists, best_positions
+
+    def bucket_key(self, lat, lng):
+        """All center points are queried together by :meth:`query_bucket`.
+        """
+        return None
+
+    def iter_box(self, lats, lngs, lat_lo, lat_hi, lng_lo, lng_hi):
+        """Find points in a lat / lng box, only nodes whose bounding box
+        intersects the 3D bounding box of the lat / lng box are visited.
+
+        :return: generator of array of positions.
+        """
+        box = (lat_lo, lat_hi, lng_lo, lng_hi)
+        if self._pending:
+            positions = np.array(self._pending, dtype=np.intp)
+            yield positions[in_box(lats[positions], lngs[positions], *box)]
+        if not self._starts:
+            return
+
+        x_lo, y_lo, z_lo, x_hi, y_hi, z_hi = _box_to_3d(*box)
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            bx_lo, by_lo, bz_lo, bx_hi, by_hi, bz_hi = self._boxes[node]
+            if bx_lo > x_hi or bx_hi < x_lo or by_lo > y_hi or by_hi < y_lo \
+                    or bz_lo > z_hi or bz_hi < z_lo:
+                continue
+            left = self._lefts[node]
+            if left == -1:  # leaf
+                positions = self._perm[self._starts[node]:self._ends[node]]
+                if self._removed:
+                    positions = positions[~self._removed_mask[positions]]
+                yield positions[in_box(lats[positions], lngs[positions], *box)]
+            else:
+                stack.append(self._rights[node])
+                stack.append(left)
+
+    def query_bucket(self, lats, lngs, key, points, n, radius):
+        """Find n nearest point for many center points.
+
+        :return: list of ``(dists, positions)``.
+        """
+        return [
+            self.query(lats, lngs, lat, lng, n, radius)
+            for lat, lng in points
+        ]
+
+
+class PayloadStore(object):
+    """Append only store of pickled payloads.
+
+    All payloads are pickled into one contiguous buffer, a payload is only
+    unpickled when it is asked for. Compared to a list of live Python objects,
+    it uses much less memory and keeps the payload out of the candidate scan.
+    """
+
+    def __init__(self, protocol=pickle.HIGHEST_PROTOCOL):
+        self.protocol = protocol
+        self._buffer = bytearray()
+        self._offsets = array("q", [0])
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def extend(self, records):
+        """Append many payloads.
+        """
+        if not isinstance(self._buffer, bytearray):
+            self._buffer = bytearray(self._buffer)
+        if not isinstance(self._offsets, array):
+            self._offsets = array("q", self._offsets.tolist())
+        buffer, offsets = self._buffer, self._offsets
+        for record in records:
+            buffer.extend(pickle.dumps(record, protocol=self.protocol))
+            offsets.append(len(buffer))
+
+    def get(self, pos):
+        """Unpickle the payload at ``pos``.
+        """
+        return pickle.loads(bytes(
+            self._buffer[int(self._offsets[pos]):int(self._offsets[pos + 1])]))
+
+    def clear(self):
+        self._buffer = bytearray()
+        self._offsets = array("q", [0])
+
+    def save(self, dirpath, positions):
+        """Save payloads at ``positions`` into a directory, ``payloads.bin``
+        is the pickled payloads, ``payload_offsets.npy`` is their offsets.
+        """
+        offsets = np.frombuffer(self._offsets, dtype=np.int64) \
+            if isinstance(self._offsets, array) else self._offsets
+        new_offsets = [0]
+        with open(os.path.join(dirpath, "payloads.bin"), "wb") as f:
+            for pos in positions:
+                blob = self._buffer[offsets[pos]:offsets[pos + 1]]
+                f.write(blob)
+                new_offsets.append(new_offsets[-1] + len(blob))
+        np.save(os.path.join(dirpath, "payload_offsets.npy"),
+                np.array(new_offsets, dtype=np.int64))
+
+    def load(self, dirpath):
+        """Load payloads saved by :meth:`save`, both the payloads and the
+        offsets are memory-mapped, they are copied into memory at the first
+        :meth:`extend`.
+        """
+        self._offsets = np.load(
+            os.path.join(dirpath, "payload_offsets.npy"), mmap_mode="r")
+        if self._offsets[-1]:
+            self._buffer = np.memmap(
+                os.path.join(dirpath, "payloads.bin"), dtype=np.uint8, mode="r")
+        else:  # empty file can not be memory-mapped
+            self._buffer = bytearray()
+
+
 class GeoSearchEngine(object):
-    def __init__(self, name="point", database=":memory:"):
+    """
+    :param name: table name.
+    :param database: sqlite database file, default in memory.
+    :param index: in-memory spatial index to use, ``"grid"``, ``"kdtree"``
+        or ``None``. if ``None``, every query scans the sqlite table.
+        ``"kdtree"`` (see :class:`SphereKDTree`) has no problem near the pole
+        and the anti-meridian, and stays fast when ``radius`` is None.
+    :param cell_size: cell size in degree of the ``"grid"`` index.
+    :param leaf_size: leaf size of the ``"kdtree"`` index.
+    :param storage: ``"sql"`` or ``"columnar"``. ``"sql"`` writes every
+        record to the sqlite table, with an index the records are also kept
+        as Python object in memory, so memory usage is about doubled. If the
+        table already has data, e.g. an existing ``database`` file, the
+        index is built from the table at the first use. ``"columnar"``
+        skips sqlite, keeps id, lat, lng in contiguous numpy array and
+        pickled payloads in a :class:`PayloadStore`, a payload is only
+        unpickled when it is in the final result. ``"columnar"`` requires an
+        index.
+    """
+
+    def __init__(self, name="point", database=":memory:",
+                 index="grid", cell_size=1.0, leaf_size=32, storage="sql"):
+        if storage not in ("sql", "columnar"):
+            raise ValueError("storage has to be one of 'sql' or 'columnar'!")
+        if (storage == "columnar") and (index is None):
+            raise ValueError("'columnar' storage requires an index!")
+        self.name = name
+        self.storage = storage
+        self.index_type = index
+        self.cell_size = cell_size
+        self.leaf_size = leaf_size
         self.engine = create_engine("sqlite:///%s" % database)
         self.metadata = MetaData()
         self.t_point = Table(name, self.metadata,
@@ -51,6 +917,49 @@ class GeoSearchEngine(object):
                              Column("lng", Float),
                              Column("data", PickleType),
                              )
+        Index("idx_%s_lat_lng" % name, self.t_point.c.lat, self.t_point.c.lng)
+        Index("idx_%s_id" % name, self.t_point.c.id)
+
+        self._index = self._new_index()
+        self._key_id = self._key_lat = self._key_lng = None
+        self._clear_memory()
+        # the index of "sql" storage is built from existing table lazily
+        self._index_loaded = storage != "sql"
+
+    def _load_index(self):
+        """Build the in-memory index from the points already in the sqlite
+        table, the first time the index is used.
+        """
+        if self._index_loaded or self._index is None:
+            return
+        self._index_loaded = True
+        if not self.engine.has_table(self.name):
+            return
+        t_point = self.t_point
+        rows = self.engine.execute(select([
+            t_point.c.id, t_point.c.lat, t_point.c.lng, t_point.c.data,
+        ])).fetchall()
+        if not rows:
+            return
+        ids, lats, lngs, data = [list(column) for column in zip(*rows)]
+        self._append(ids, lats, lngs, data)
+        self._index.build(
+            self._lats, self._lngs, np.flatnonzero(self._alive[:self._size]))
+
+    def _clear_memory(self):
+        self._size = 0
+        self._ids = np.zeros(0)
+        self._lats = np.zeros(0, dtype=np.float64)
+        self._lngs = np.zeros(0, dtype=np.float64)
+        self._alive = np.zeros(0, dtype=bool)
+        self._id_to_pos = dict()
+        self._records = list()
+        if self.storage == "columnar":
+            self._payloads = PayloadStore()
+        else:
+            self._payloads = None
+        if self._index is not None:
+            self._index.clear()
 
     def train(self, data, key_id, key_lat, key_lng, clear_old=True):
         """
@@ -72,27 +981,269 @@ class GeoSearchEngine(object):
         :param key_lng: callable function, take point object as input, return object
             longitude, for example: lambda x: x["lng"]
         """
-        engine, t_point = self.engine, self.t_point
-        if clear_old:
-            try:
-                t_point.drop(engine)
-            except:
-                pass
-        t_point.create(engine)
+        self._key_id, self._key_lat, self._key_lng = key_id, key_lat, key_lng
+        data = list(data)
+        ids, lats, lngs = self._extract(data)
+        if not clear_old:
+            # load existing points before the new ones are written
+            self._load_index()
+
+        if self.storage == "sql":
+            engine, t_point = self.engine, self.t_point
+            if clear_old:
+                try:
+                    t_point.drop(engine)
+                except:
+                    pass
+            t_point.create(engine, checkfirst=True)
+
+            ins = t_point.insert()
+            engine.execute(ins, self._table_data(ids, lats, lngs, data))
+
+        if self._index is not None:
+            if clear_old:
+                self._clear_memory()
+                self._index_loaded = True
+            self._append(ids, lats, lngs, data)
+            self._index.build(
+                self._lats, self._lngs, np.flatnonzero(self._alive[:self._size]))
+
+    def _extract(self, data):
+        if self._key_id is None:
+            raise ValueError("call train() first to set key_id, key_lat, key_lng!")
+        ids = [self._key_id(record) for record in data]
+        lats = [self._key_lat(record) for record in data]
+        lngs = [self._key_lng(record) for record in data]
+        return ids, lats, lngs
+
+    @staticmethod
+    def _table_data(ids, lats, lngs, data):
+        return [
+            {"id": id, "lat": lat, "lng": lng, "data": record}
+            for id, lat, lng, record in zip(ids, lats, lngs, data)
+        ]
+
+    def _append(self, ids, lats, lngs, data):
+        """Append points to the in-memory storage.
+
+        :return: positions of the new points.
+        """
+        size, n = self._size, len(data)
+        self._ids = _write_buffer(self._ids, size, ids)
+        self._lats = _write_buffer(
+            self._lats, size, np.asarray(lats, dtype=np.float64))
+        self._lngs = _write_buffer(
+            self._lngs, size, np.asarray(lngs, dtype=np.float64))
+        self._alive = _write_buffer(self._alive, size, np.ones(n, dtype=bool))
+        if self._payloads is not None:
+            self._payloads.extend(data)
+        else:
+            self._records.extend(data)
+        id_to_pos = self._get_id_to_pos()
+        for pos, id in enumerate(ids, size):
+            id_to_pos.setdefault(self._id_key(id), list()).append(pos)
+        self._size = size + n
+        return np.arange(size, size + n, dtype=np.intp)
+
+    def _remove(self, ids):
+        """Remove points from the in-memory storage.
+
+        :return: positions of the removed points.
+        """
+        id_to_pos = self._get_id_to_pos()
+        positions = list()
+        for id in ids:
+            positions.extend(id_to_pos.pop(self._id_key(id), ()))
+        positions = np.array(positions, dtype=np.intp)
+        self._alive[positions] = False
+        if self._payloads is None:
+            for pos in positions:
+                self._records[pos] = None
+        return positions
+
+    def insert(self, data):
+        """Insert new points without re-training, the key functions used
+        in the last :meth:`train` are used to extract id, lat and lng. The
+        sqlite table is updated in one transaction, the index is updated
+        in place.
+
+        :type data: list
+        :param data: list of point object.
+        """
+        self._upsert(data, replace=False)
+
+    def upsert(self, data):
+        """Insert new points, existing points with the same id are replaced.
+
+        :type data: list
+        :param data: list of point object.
+        """
+        self._upsert(data, replace=True)
+
+    def delete(self, ids):
+        """Delete points by id without re-training.
+
+        :type ids: list
+        :param ids: list of point id.
+        """
+        ids = list(ids)
+        self._load_index()
+        if self.storage == "sql":
+            with self.engine.begin() as connection:
+                self._sql_delete(connection, ids)
+        if self._index is not None:
+            positions = self._remove(ids)
+            self._index.remove(self._lats, self._lngs, positions)
+
+    def _sql_delete(self, connection, ids):
+        t_point = self.t_point
+        chunk_size = 500  # sqlite has a limit on number of variables
+        for i in range(0, len(ids), chunk_size):
+            connection.execute(
+                t_point.delete().where(t_point.c.id.in_(ids[i:i + chunk_size])))
+
+    def _upsert(self, data, replace):
+        data = list(data)
+        ids, lats, lngs = self._extract(data)
+        # load existing points before the new ones are written
+        self._load_index()
+        if self.storage == "sql":
+            with self.engine.begin() as connection:
+                if replace:
+                    self._sql_delete(connection, ids)
+                if data:
+                    connection.execute(
+                        self.t_point.insert(),
+                        self._table_data(ids, lats, lngs, data),
+                    )
+        if self._index is not None:
+            if replace:
+                positions = self._remove(ids)
+                self._index.remove(self._lats, self._lngs, positions)
+            positions = self._append(ids, lats, lngs, data)
+            self._index.insert(self._lats, self._lngs, positions)
 
-        table_data = list()
-        for record in data:
-            id = key_id(record)
-            lat = key_lat(record)
-            lng = key_lng(record)
-            row = {"id": id, "lat": lat, "lng": lng, "data": record}
-            table_data.append(row)
+    def save(self, dirpath):
+        """Save a snapshot of the engine into a directory.
 
-        ins = t_point.insert()
-        engine.execute(ins, table_data)
+        The coordinates, ids, spatial index and payloads are written as flat
+        ``.npy`` / binary files, deleted points are dropped. :meth:`open`
+        memory-maps them, so a new or forked worker process is ready to
+        serve in milliseconds, and all of them share the same pages.
 
-        index = Index('idx_lat_lng', t_point.c.lat, t_point.c.lng)
-        index.create(engine)
+        :param dirpath: the directory, created if not exists.
+
+        **中文文档**
+
+        将引擎的快照保存到一个目录中, 可以用 :meth:`open` 以内存映射的方式快速打开。
+        """
+        if self._index is None:
+            raise ValueError("only engine with an index can be saved!")
+        self._load_index()
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+
+        positions = np.flatnonzero(self._alive[:self._size])
+        lats, lngs = self._lats[positions], self._lngs[positions]
+        ids = self._ids[positions]
+        np.save(os.path.join(dirpath, "lats.npy"), lats)
+        np.save(os.path.join(dirpath, "lngs.npy"), lngs)
+        np.save(os.path.join(dirpath, "ids.npy"), ids)
+
+        if self._payloads is not None:
+            self._payloads.save(dirpath, positions)
+        else:
+            payloads = PayloadStore()
+            payloads.extend(self._records[pos] for pos in positions)
+            payloads.save(dirpath, range(len(positions)))
+
+        # the index is rebuilt on the compacted positions
+        index = self._new_index()
+        index.build(lats, lngs, np.arange(len(positions)))
+        index.save(dirpath)
+
+        meta = {
+            "name": self.name,
+            "index": self.index_type,
+            "cell_size": self.cell_size,
+            "leaf_size": self.leaf_size,
+            "size": len(positions),
+            "ids_dtype": ids.dtype.str,
+        }
+        with open(os.path.join(dirpath, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def open(cls, dirpath, key_id=None, key_lat=None, key_lng=None):
+        """Open a snapshot saved by :meth:`save`. The opened engine always use
+        the ``"columnar"`` storage.
+
+        :param key_id, key_lat, key_lng: optional key functions, see
+            :meth:`train`, only needed for :meth:`insert` and :meth:`upsert`.
+        """
+        with open(os.path.join(dirpath, "meta.json"), "r") as f:
+            meta = json.load(f)
+        engine = cls(
+            name=meta["name"], index=meta["index"], storage="columnar",
+            cell_size=meta["cell_size"], leaf_size=meta["leaf_size"],
+        )
+        engine._key_id, engine._key_lat, engine._key_lng = \
+            key_id, key_lat, key_lng
+
+        # copy-on-write memory map, pages are shared until they are modified
+        engine._lats = np.load(
+            os.path.join(dirpath, "lats.npy"), mmap_mode="c")
+        engine._lngs = np.load(
+            os.path.join(dirpath, "lngs.npy"), mmap_mode="c")
+        if np.dtype(meta["ids_dtype"]).hasobject:
+            engine._ids = np.load(
+                os.path.join(dirpath, "ids.npy"), allow_pickle=True)
+        else:
+            engine._ids = np.load(
+                os.path.join(dirpath, "ids.npy"), mmap_mode="c")
+        engine._size = meta["size"]
+        engine._alive = np.ones(engine._size, dtype=bool)
+        engine._id_to_pos = None
+        engine._payloads.load(dirpath)
+        engine._index.load(dirpath)
+        return engine
+
+    def _new_index(self):
+        if self.index_type == "grid":
+            return GridIndex(cell_size=self.cell_size)
+        elif self.index_type == "kdtree":
+            return SphereKDTree(leaf_size=self.leaf_size)
+        elif self.index_type is None:
+            return None
+        else:
+            raise ValueError(
+                "index has to be one of 'grid', 'kdtree' or None!")
+
+    def _id_key(self, id):
+        """The sqlite ``id`` column is text, points loaded from an existing
+        table have text id, so ``"sql"`` storage matches id as text.
+        """
+        if self.storage == "sql":
+            return "%s" % (id, )
+        return id
+
+    def _get_id_to_pos(self):
+        """The id to positions mapping is built on demand, so opening a
+        snapshot doesn't pay for it.
+        """
+        if self._id_to_pos is None:
+            self._id_to_pos = dict()
+            positions = np.flatnonzero(self._alive[:self._size])
+            for pos, id in zip(positions.tolist(), self._ids[positions].tolist()):
+                self._id_to_pos.setdefault(
+                    self._id_key(id), list()).append(pos)
+        return self._id_to_pos
+
+    def _get_record(self, pos):
+        if self._payloads is not None:
+            return self._payloads.get(pos)
+        else:
+            return self._records[pos]
 
     def find_n_nearest(self, lat, lng, n=5, radius=None):
         """Find n nearest point within certain distance from a point.
@@ -104,38 +1255,252 @@ class GeoSearchEngine(object):
 
         **中文文档**
         """
+        if self._index is not None:
+            self._load_index()
+            return self._find_n_nearest_index(lat, lng, n, radius)
+        else:
+            return self._find_n_nearest_sql(lat, lng, n, radius)
+
+    def _find_n_nearest_index(self, lat, lng, n, radius):
+        """Find n nearest point using the in-memory spatial index.
+        """
+        if n <= 0:
+            return list()
+        if radius is None:
+            radius = INF
+        dists, positions = self._index.query(
+            self._lats, self._lngs, lat, lng, n, radius)
+        return [
+            (float(dist), self._get_record(pos))
+            for dist, pos in zip(dists, positions)
+        ]
+
+    def find_n_nearest_many(self, points, n=5, radius=None, processes=None):
+        """Find n nearest point for many center points at once.
+
+        With the ``"grid"`` index, center points falling into the same grid
+        cell share one candidate fetch, their distance to the candidates is computed as one
+        ``(n_points, n_candidates)`` matrix. Large batch is spread over a
+        process pool.
+
+        :param points: list of (lat, lng) of center points.
+        :param n: max number of record to return for each center point.
+        :param radius: only search point within ``radius`` distance.
+        :param processes: number of worker processes, default is the number of
+            cpu. Use ``1`` to disable multi-processing. Pool is only used
+            for batch larger than ``PARALLEL_THRESHOLD``.
+        :return: list of ``find_n_nearest`` result, in the same order as
+            ``points``.
+
+        **中文文档**
+
+        批量查询多个中心点的n个最近点, 返回结果的顺序与输入顺序一致。
+        """
+        points = [(float(lat), float(lng)) for lat, lng in points]
+        self._load_index()
+        if self._index is None:
+            return [
+                self._find_n_nearest_sql(lat, lng, n, radius)
+                for lat, lng in points
+            ]
+
+        # group query points by bucket, for example the cell they fall in
+        buckets = dict()
+        for ind, (lat, lng) in enumerate(points):
+            key = self._index.bucket_key(lat, lng)
+            buckets.setdefault(key, list()).append(ind)
+        tasks, task_inds = list(), list()
+        for key, inds in buckets.items():
+            for i in range(0, len(inds), BUCKET_SIZE):
+                chunk = inds[i:i + BUCKET_SIZE]
+                tasks.append((key, [points[ind] for ind in chunk], n, radius))
+                task_inds.append(chunk)
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if (processes > 1) and (len(points) > PARALLEL_THRESHOLD) \
+                and ("fork" in multiprocessing.get_all_start_methods()):
+            global _pool_engine
+            _pool_engine = self
+            try:
+                context = multiprocessing.get_context("fork")
+                pool = context.Pool(processes)
+                try:
+                    chunksize = max(1, len(tasks) // (processes * 4))
+                    bucket_results = pool.map(
+                        _find_n_nearest_bucket, tasks, chunksize)
+                finally:
+                    pool.close()
+                    pool.join()
+            finally:
+                _pool_engine = None
+        else:
+            bucket_results = [
+                self._find_n_nearest_bucket(*task) for task in tasks
+            ]
+
+        results = [None] * len(points)
+        for inds, bucket_result in zip(task_inds, bucket_results):
+            for ind, result in zip(inds, bucket_result):
+                results[ind] = result
+        return results
+
+    def _find_n_nearest_bucket(self, key, points, n, radius):
+        """Find n nearest point for center points in the same bucket.
+        """
+        if n <= 0:
+            return [list() for _ in points]
+        if radius is None:
+            radius = INF
+        return [
+            [
+                (float(dist), self._get_record(pos))
+                for dist, pos in zip(dists, positions)
+            ]
+            for dists, positions in self._index.query_bucket(
+                self._lats, self._lngs, key, points, n, radius)
+        ]
+
+    def find_within_box(self, lat_lo, lat_hi, lng_lo, lng_hi):
+        """Find all points inside a lat / lng box, boundary included.
+
+        :param lat_lo, lat_hi: latitude range.
+        :param lng_lo, lng_hi: longitude range, if ``lng_lo > lng_hi``, the box
+            crosses the anti-meridian, for example ``(170, -170)``.
+        :return: generator of point object, it is lazily evaluated, so large
+            box doesn't have to be fully materialized.
+
+        **中文文档**
+
+        找到经纬度矩形内的所有点, 以生成器的形式返回。
+        """
+        if lat_lo > lat_hi:
+            raise ValueError("lat_lo can not be greater than lat_hi!")
+        for lats, lngs, records in self._iter_box(
+                lat_lo, lat_hi, lng_lo, lng_hi):
+            for record in records:
+                yield record
+
+    def find_within_polygon(self, polygon):
+        """Find all points inside a polygon.
+
+        Candidates are pruned by the bounding box of the polygon with the
+        index, then the exact point in polygon test is applied.
+
+        :param polygon: list of (lat, lng) vertices, edges are straight lines
+            on the lat / lng plane, it should not cross the anti-meridian.
+        :return: generator of point object.
+
+        **中文文档**
+
+        找到多边形内的所有点, 以生成器的形式返回。
+        """
+        polygon = [(float(lat), float(lng)) for lat, lng in polygon]
+        if len(polygon) < 3:
+            raise ValueError("polygon needs at least 3 vertices!")
+        lat_lo, lat_hi = min(p[0] for p in polygon), max(p[0] for p in polygon)
+        lng_lo, lng_hi = min(p[1] for p in polygon), max(p[1] for p in polygon)
+        for lats, lngs, records in self._iter_box(
+                lat_lo, lat_hi, lng_lo, lng_hi):
+            for record, inside in zip(records, in_polygon(lats, lngs, polygon)):
+                if inside:
+                    yield record
+
+    def _iter_box(self, lat_lo, lat_hi, lng_lo, lng_hi):
+        """Find points in a box chunk by chunk.
+
+        :return: generator of ``(lats, lngs, records)``, ``records`` is a lazy
+            iterable of point object.
+        """
+        if self._index is not None:
+            self._load_index()
+            for positions in self._index.iter_box(
+                    self._lats, self._lngs, lat_lo, lat_hi, lng_lo, lng_hi):
+                if len(positions):
+                    yield (
+                        self._lats[positions],
+                        self._lngs[positions],
+                        (self._get_record(pos) for pos in positions),
+                    )
+            return
+
+        t_point = self.t_point
+        if lng_lo <= lng_hi:
+            lng_filter = and_(t_point.c.lng >= lng_lo, t_point.c.lng <= lng_hi)
+        else:
+            lng_filter = or_(t_point.c.lng >= lng_lo, t_point.c.lng <= lng_hi)
+        s = select([t_point.c.lat, t_point.c.lng, t_point.c.data]).where(and_(
+            t_point.c.lat >= lat_lo, t_point.c.lat <= lat_hi, lng_filter))
+        result = self.engine.execute(s)
+        while True:
+            rows = result.fetchmany(1000)
+            if not rows:
+                break
+            yield (
+                np.array([row.lat for row in rows], dtype=np.float64),
+                np.array([row.lng for row in rows], dtype=np.float64),
+                [row.data for row in rows],
+            )
+
+    def _find_n_nearest_sql(self, lat, lng, n, radius):
+        """Find n nearest point by scanning the sqlite table.
+        """
         engine, t_point = self.engine, self.t_point
         if radius:
             # Use a simple box filter to minimize candidates
             # Define latitude longitude boundary
             dist_btwn_lat_deg = 69.172
-            dist_btwn_lon_deg = cos(lat) * 69.172
+            dist_btwn_lon_deg = cos(radians(lat)) * 69.172
             lat_degr_rad = abs(radius * 1.05 / dist_btwn_lat_deg)
-            lon_degr_rad = abs(radius * 1.05 / dist_btwn_lon_deg)
 
             lat_lower = lat - lat_degr_rad
             lat_upper = lat + lat_degr_rad
-            lng_lower = lng - lon_degr_rad
-            lng_upper = lng + lon_degr_rad
 
             filters = [
                 t_point.c.lat >= lat_lower,
                 t_point.c.lat <= lat_upper,
-                t_point.c.lat >= lng_lower,
-                t_point.c.lat >= lng_upper,
             ]
+
+            # the longitude box is meaningless near the pole or when it
+            # crosses the anti-meridian
+            if dist_btwn_lon_deg > 1e-6:
+                lon_degr_rad = abs(radius * 1.05 / dist_btwn_lon_deg)
+                lng_lower = lng - lon_degr_rad
+                lng_upper = lng + lon_degr_rad
+                if -180.0 <= lng_lower and lng_upper <= 180.0:
+                    filters.extend([
+                        t_point.c.lng >= lng_lower,
+                        t_point.c.lng <= lng_upper,
+                    ])
         else:
             radius = 999999.9
             filters = []
 
-        s = select([t_point]).where(and_(*filters))
+        # only fetch coordinate for the scan, payload is fetched and
+        # unpickled for the final n nearest
+        rowid = literal_column("rowid")
+        s = select([rowid, t_point.c.lat, t_point.c.lng]).where(and_(*filters))
+        rows = engine.execute(s).fetchall()
+        if (n <= 0) or (not rows):
+            return list()
+        dists = great_circle_many(
+            (lat, lng),
+            [row.lat for row in rows],
+            [row.lng for row in rows],
+        )
+        positions = np.flatnonzero(dists <= radius)
+        dists, positions = _n_smallest(dists[positions], positions, n)
 
-        heap = list()
-        for row in engine.execute(s):
-            dist = great_circle((lat, lng), (row.lat, row.lng))
-            if dist <= radius:
-                heap.append((dist, row.data))
+        rowids = [rows[pos][0] for pos in positions]
+        s = select([rowid, t_point.c.data]).where(rowid.in_(rowids))
+        data = dict(engine.execute(s).fetchall())
+        return [
+            (float(dist), data[i])
+            for dist, i in zip(dists, rowids)
+        ]
 
-        # Use heap sort to find top-K nearest
-        n_nearest = heapq.nsmallest(n, heap, key=lambda x: x[0])
-        return n_nearest
+
+def _find_n_nearest_bucket(task):
+    """Worker function for :meth:`GeoSearchEngine.find_n_nearest_many`.
+    """
+    return _pool_engine._find_n_nearest_bucket(*task)
@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import os
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
 from pathlib_mate import Path
 
 
@@ -18,15 +22,70 @@ def filter_pure_text(path):
         return False
 
 
-def count_lines(abspath):
+CHUNK_SIZE = 1024 * 1024
+
+#: files bigger than this are counted by multiple threads.
+PARALLEL_THRESHOLD = 64 * 1024 * 1024
+
+
+def _count_newlines(abspath, start, end, chunk_size):
+    """Count ``b"\\n"`` in byte range ``[start, end)`` of a file, read into a
+    reused buffer, no bytes object is created per line.
+    """
+    buffer = bytearray(chunk_size)
+    n = 0
+    with open(abspath, "rb", buffering=0) as f:
+        f.seek(start)
+        remain = end - start
+        while remain > 0:
+            if remain < chunk_size:
+                size = f.readinto(memoryview(buffer)[:remain])
+            else:
+                size = f.readinto(buffer)
+            if not size:
+                break
+            n += buffer.count(b"\n", 0, size)
+            remain -= size
+    return n
+
+
+def count_lines(abspath, processes=None, chunk_size=CHUNK_SIZE):
     """Count how many lines in a pure text file.
+
+    Same as ``len(list(open(abspath, "rb")))``, a last line without
+    ``\\n`` is counted as well. It counts ``b"\\n"`` in large buffers,
+    a file bigger than :data:`PARALLEL_THRESHOLD` is split into byte ranges
+    counted by a thread pool.
+
+    :param processes: number of threads, default is number of CPU for big
+        file, 1 for small file.
+    :param chunk_size: read buffer size.
     """
+    size = os.path.getsize(abspath)
+    if size == 0:
+        return 0
+    if processes is None:
+        processes = cpu_count() if size >= PARALLEL_THRESHOLD else 1
+    if processes > 1:
+        step = -(-size // processes)
+        ranges = [(start, min(start + step, size))
+                  for start in range(0, size, step)]
+        pool = ThreadPool(processes)
+        try:
+            n = sum(pool.map(
+                lambda r: _count_newlines(abspath, r[0], r[1], chunk_size),
+                ranges,
+            ))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        n = _count_newlines(abspath, 0, size, chunk_size)
     with open(abspath, "rb") as f:
-        i = 0
-        for line in f:
-            i += 1
-            pass
-        return i
+        f.seek(size - 1)
+        if f.read(1) != b"\n":
+            n += 1
+    return n
 
 
 def lines_stats(dir_path, file_filter):
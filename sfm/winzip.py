@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
 
-"""
+r"""
 A file compress utility module. You can easily programmatically add files
 and directorys to zip archives. And compress arbitrary binary content.
 
 - :func:`zip_a_folder`: add folder to archive.
 - :func:`zip_everything_in_a_folder`: add everything in a folder to archive.
 - :func:`zip_many_files`: Add many files to a zip archive.
+- :class:`ZipArchiveBuilder`: build zip archive, compress members in
+  parallel.
+- :func:`extract`: extract members in parallel, with filter.
+- :func:`read_member`: read a member, the opened archive is cached.
 - :func:`write_gzip`: Write binary content to gzip file.
 - :func:`read_gzip`: Read binary content from gzip file.
+- :func:`iter_gzip`: Read binary content from gzip file chunk by chunk.
+- :func:`concat_gzip`: Concatenate gzip files into a multi-member gzip file.
 
 **中文文档**
 
@@ -17,8 +23,13 @@ and directorys to zip archives. And compress arbitrary binary content.
 - :func:`zip_a_folder`: 将目录添加到压缩包。
 - :func:`zip_everything_in_a_folder`: 将目录内的所有文件添加到压缩包。
 - :func:`zip_many_files`: 将多个文件添加到压缩包。
+- :class:`ZipArchiveBuilder`: 多线程并行压缩, 创建压缩包。
+- :func:`extract`: 多线程并行解压, 可以选择解压哪些文件。
+- :func:`read_member`: 读取压缩包中的单个文件, 打开的压缩包会被缓存。
 - :func:`write_gzip`: 将二进制数据写入文件, 例如python pickle, bytes string。
 - :func:`read_gzip`: 读取解压后的二进制数据内容。
+- :func:`iter_gzip`: 流式读取解压后的二进制数据内容。
+- :func:`concat_gzip`: 将多个gzip文件拼接成一个。
 
 注: python中zipfile包自带的ZipFile方法的用法如下:
 
@@ -34,16 +45,409 @@ and directorys to zip archives. And compress arbitrary binary content.
 比如你有一个路径 ``C:\download\readme.txt``, 如果当前路径是 ``C:\``,
 而此时你将 ``readme.txt`` 添加到压缩包时则是在压缩包内添加一个: ``download\readme.txt``,
 如果当前路径是 ``C:\download\``, 则在压缩包内添加的路径则是: ``readme.txt``
+
+本模块使用 ``arcname`` 参数指定压缩包内的路径, 不再切换当前目录。
 """
 
 
 from __future__ import print_function
 
 import os
-from zipfile import ZipFile
+import stat
+import time
+import uuid
+import zlib
+import shutil
+import struct
+import fnmatch
+import gzip
+import tempfile
+import threading
+from collections import OrderedDict
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from zipfile import (
+    ZipFile, ZipInfo, BadZipfile, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT,
+)
+
+#: file extensions already compressed, they are stored without compression.
+DEFAULT_STORE_EXTENSIONS = frozenset([
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".lzma", ".7z", ".rar", ".zst",
+    ".lz4", ".jar", ".whl", ".egg",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic",
+    ".mp3", ".aac", ".ogg", ".flac", ".m4a",
+    ".mp4", ".m4v", ".mkv", ".avi", ".mov", ".webm",
+    ".docx", ".xlsx", ".pptx", ".pdf",
+])
+
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+#: local file header, signature ... file name length, extra field length
+_local_header = struct.Struct("<4s2B4HL2L2H")
+
+
+def _iter_files(src, arcname):
+    """Walk ``src`` with ``os.scandir`` and yield (abspath, arcname) of every
+    file, entries of a directory are sorted by name, so the archive is
+    reproducible. Like ``os.walk``, symlinks to directories are not
+    followed, symlinks to files are yielded.
+    """
+    entries = sorted(os.scandir(src), key=lambda entry: entry.name)
+    for entry in entries:
+        name = "%s/%s" % (arcname, entry.name) if arcname else entry.name
+        if entry.is_dir(follow_symlinks=False):
+            for item in _iter_files(entry.path, name):
+                yield item
+        elif entry.is_file():
+            yield entry.path, name
+
+
+def _same_dos_time(date_time1, date_time2):
+    """Zip archive stores modify time in DOS format, seconds / 2.
+    """
+    return date_time1[:5] == date_time2[:5] and \
+        date_time1[5] // 2 == date_time2[5] // 2
+
+
+def _file_crc(abspath):
+    crc = 0
+    with open(abspath, "rb") as f:
+        while True:
+            data = f.read(_COPY_BUFFER_SIZE)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+    return crc & 0xFFFFFFFF
+
+
+def _member_data_offset(fileobj, zinfo):
+    """Offset of compressed data of a member, right after its local header.
+    Length of extra field in local header may differ from central directory,
+    so the local header has to be read.
+    """
+    fileobj.seek(zinfo.header_offset)
+    header = fileobj.read(_local_header.size)
+    if len(header) != _local_header.size or header[:4] != b"PK\x03\x04":
+        raise BadZipfile("Bad local file header of %r" % zinfo.filename)
+    fields = _local_header.unpack(header)
+    return zinfo.header_offset + _local_header.size + fields[-2] + fields[-1]
+
+
+#: private attributes of ``ZipFile`` used by :func:`_write_raw_member`, they
+#: come with the write mode of ``ZipFile.open`` in CPython 3.6.
+_RAW_WRITE_ATTRS = (
+    "_lock", "_writing", "_seekable", "_writecheck", "_didModify",
+    "start_dir", "fp", "filelist", "NameToInfo",
+)
+
+
+def _supports_raw_write(zf):
+    """Whether :func:`_write_raw_member` works with this ``ZipFile``.
+    """
+    return all(hasattr(zf, attr) for attr in _RAW_WRITE_ATTRS)
+
+
+def _write_raw_member(zf, zinfo, fileobj, length=None):
+    """Append a member whose compressed data is already made to a
+    ``ZipFile`` opened for writing. ``zinfo.CRC``, ``zinfo.compress_size``
+    and ``zinfo.file_size`` have to be set. Copy ``length`` bytes from
+    ``fileobj``, default is until EOF.
+
+    ``ZipFile`` doesn't have a public API for this, it follows what
+    ``ZipFile.open(zinfo, "w")`` does since CPython 3.6 (tested on 3.11),
+    without the compressor. Check :func:`_supports_raw_write` before using
+    it.
+    """
+    zip64 = zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+    zinfo.flag_bits = 0x00
+    if not zinfo.external_attr:
+        zinfo.external_attr = 0o600 << 16
+    with zf._lock:
+        if zf._writing:
+            raise ValueError("Can't write to the ZIP file while there is "
+                             "another write handle open on it.")
+        if zf._seekable:
+            zf.fp.seek(zf.start_dir)
+        zinfo.header_offset = zf.fp.tell()
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        zf.fp.write(zinfo.FileHeader(zip64))
+        if length is None:
+            shutil.copyfileobj(fileobj, zf.fp, _COPY_BUFFER_SIZE)
+        else:
+            while length:
+                data = fileobj.read(min(length, _COPY_BUFFER_SIZE))
+                if not data:
+                    raise BadZipfile("Truncated member %r" % zinfo.filename)
+                zf.fp.write(data)
+                length -= len(data)
+        zf.start_dir = zf.fp.tell()
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+
+
+class ZipArchiveBuilder(object):
+    """Build a zip archive, members are deflated on a thread pool (zlib
+    releases the GIL) into temporary buffers, then appended to the archive
+    in the order they are added.
+
+    Example::
+
+        with ZipArchiveBuilder("paper.zip") as builder:
+            builder.add_dir("paper", arcname="paper")
+            builder.add_file("notes.txt", arcname="notes/notes.txt")
+
+    :param dst: path of the zip file.
+    :param compresslevel: deflate level, 0 ~ 9.
+    :param store_extensions: files with these extensions (lower case, with
+        dot) are stored without compression, because they are already
+        compressed. Besides, any file doesn't get smaller after deflating
+        is stored.
+    :param processes: number of threads, default is number of CPU.
+    :param spool_size: compressed data smaller than this is buffered in
+        memory, bigger one goes to a temporary file.
+    :param update: incremental mode, if ``dst`` exists, a member of the
+        existing archive with the same name, size and CRC32 is copied
+        without recompressing. CRC32 is not computed if the modify time is
+        the same and older than the existing archive. Members not added
+        again are dropped.
+
+    The archive is written to a temporary file next to ``dst``, it replaces
+    ``dst`` on :meth:`close`. If an exception is raised in the ``with``
+    block, or on :meth:`abort`, the temporary file is removed and existing
+    ``dst`` is kept.
+
+    Compressed data is appended through ``ZipFile`` internals of CPython
+    3.6+. If they are missing, files are compressed serially by
+    ``ZipFile.write`` and update mode recompresses everything.
+
+    **中文文档**
 
+    创建zip压缩包, 使用多线程将文件并行压缩到临时缓存中, 然后按照添加的顺序写入
+    压缩包。已经压缩过的媒体文件等只存储不压缩。
 
-def zip_a_folder(src, dst):
+    ``update=True`` 时为增量模式, 未改变的文件直接从旧压缩包中复制压缩后的数据,
+    只压缩新增或修改过的文件。
+    """
+
+    def __init__(self, dst, compresslevel=6,
+                 store_extensions=DEFAULT_STORE_EXTENSIONS,
+                 processes=None, spool_size=8 * 1024 * 1024,
+                 update=False):
+        self.dst = os.path.abspath(dst)
+        self.compresslevel = compresslevel
+        self.store_extensions = frozenset(store_extensions)
+        self.processes = processes or cpu_count()
+        self.spool_size = spool_size
+        self._old_members = dict()
+        self._old_fileobj = None
+        # archive is built in a temporary file next to dst, it replaces dst
+        # only if everything succeeded
+        self._tmp_path = os.path.join(
+            os.path.dirname(self.dst),
+            ".%s.%s.tmp" % (os.path.basename(self.dst), uuid.uuid4().hex[:8]))
+        self._zf = ZipFile(self._tmp_path, "x", ZIP_DEFLATED, allowZip64=True)
+        self._pool = ThreadPool(self.processes)
+        self._pending = list()
+        #: number of members copied from the existing archive
+        self.n_unchanged = 0
+        try:
+            # (st_dev, st_ino) of the archives, they may be reached by
+            # another path, e.g. through a symlink
+            self._archive_ids = set()
+            st = os.stat(self._tmp_path)
+            self._archive_ids.add((st.st_dev, st.st_ino))
+            if os.path.exists(self.dst):
+                st = os.stat(self.dst)
+                self._archive_ids.add((st.st_dev, st.st_ino))
+                os.chmod(self._tmp_path, stat.S_IMODE(st.st_mode))
+            self._raw_write = _supports_raw_write(self._zf)
+            if update and self._raw_write and os.path.exists(self.dst):
+                self._load_old_archive()
+        except:
+            self.abort()
+            raise
+
+    def _load_old_archive(self):
+        """Read central directory of existing ``dst``, an unreadable ``dst``
+        is rebuilt from scratch.
+        """
+        try:
+            with ZipFile(self.dst) as old:
+                for zinfo in old.infolist():
+                    if not zinfo.flag_bits & 0x01:  # skip encrypted
+                        self._old_members[zinfo.filename] = zinfo
+            self._old_fileobj = open(self.dst, "rb")
+            self._old_mtime = os.fstat(self._old_fileobj.fileno()).st_mtime
+        except (BadZipfile, OSError):
+            self._old_members = dict()
+            if self._old_fileobj is not None:
+                self._old_fileobj.close()
+                self._old_fileobj = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def add_file(self, abspath, arcname=None):
+        """Add a file.
+
+        :param abspath: path of the file.
+        :param arcname: path in archive, default is the file name.
+        """
+        abspath = os.path.abspath(abspath)
+        if arcname is None:
+            arcname = os.path.basename(abspath)
+        st = os.stat(abspath)
+        if (st.st_dev, st.st_ino) in self._archive_ids:  # never add archive
+            return
+        self._pending.append((abspath, arcname))
+        if len(self._pending) >= 4 * self.processes:
+            self._flush()
+
+    def add_dir(self, src, arcname=""):
+        """Add every file in a directory, recursively.
+
+        :param src: path of the directory.
+        :param arcname: path of the directory in archive, "" means files
+            are at the root of archive.
+        """
+        arcname = arcname.replace(os.sep, "/").strip("/")
+        for abspath, name in _iter_files(os.path.abspath(src), arcname):
+            self.add_file(abspath, name)
+
+    def _is_store(self, abspath):
+        return os.path.splitext(abspath)[1].lower() in self.store_extensions
+
+    def _unchanged_member(self, abspath, zinfo):
+        """Find the member of existing archive having the same content.
+        """
+        old = self._old_members.get(zinfo.filename)
+        if old is None or old.file_size != zinfo.file_size:
+            return None
+        # DOS time has 2 seconds resolution, a file rewritten in the same
+        # slot looks unchanged, so trust it only if the file was modified
+        # clearly before the existing archive was written
+        if _same_dos_time(old.date_time, zinfo.date_time) and \
+                os.stat(abspath).st_mtime + 2 < self._old_mtime:
+            return old
+        if old.CRC == _file_crc(abspath):
+            return old
+        return None
+
+    def _compress_member(self, task):
+        """Deflate a file into a spooled temporary file.
+
+        :return: (zinfo, buffer, old_zinfo), buffer is None if it should be
+            stored, old_zinfo is the unchanged member of existing archive.
+        """
+        abspath, arcname = task
+        zinfo = ZipInfo.from_file(abspath, arcname)
+        if self._old_members:
+            old = self._unchanged_member(abspath, zinfo)
+            if old is not None:
+                for attr in ["compress_type", "CRC", "compress_size"]:
+                    setattr(zinfo, attr, getattr(old, attr))
+                return zinfo, None, old
+        if self._is_store(abspath):
+            return zinfo, None, None
+        buffer = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        compressor = zlib.compressobj(
+            self.compresslevel, zlib.DEFLATED, -15)
+        crc = 0
+        file_size = 0
+        with open(abspath, "rb") as f:
+            while True:
+                data = f.read(_COPY_BUFFER_SIZE)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                file_size += len(data)
+                buffer.write(compressor.compress(data))
+        buffer.write(compressor.flush())
+        compress_size = buffer.tell()
+        if file_size and compress_size >= file_size:  # not worth it
+            buffer.close()
+            return zinfo, None, None
+        zinfo.compress_type = ZIP_DEFLATED
+        zinfo.CRC = crc & 0xFFFFFFFF
+        zinfo.file_size = file_size
+        zinfo.compress_size = compress_size
+        buffer.seek(0)
+        return zinfo, buffer, None
+
+    def _flush(self):
+        tasks, self._pending = self._pending, list()
+        if not self._raw_write:  # unknown ZipFile internals, compress serially
+            for abspath, arcname in tasks:
+                compress_type = ZIP_STORED if self._is_store(abspath) \
+                    else ZIP_DEFLATED
+                self._zf.write(abspath, arcname, compress_type=compress_type,
+                               compresslevel=self.compresslevel)
+            return
+        for (abspath, arcname), (zinfo, buffer, old) in zip(
+                tasks, self._pool.map(self._compress_member, tasks)):
+            if old is not None:
+                # raw copy, data descriptor flag is cleared since sizes and
+                # CRC are in the local header
+                self._old_fileobj.seek(
+                    _member_data_offset(self._old_fileobj, old))
+                _write_raw_member(self._zf, zinfo, self._old_fileobj,
+                                  length=old.compress_size)
+                self.n_unchanged += 1
+            elif buffer is None:
+                self._zf.write(abspath, arcname, compress_type=ZIP_STORED)
+            else:
+                try:
+                    _write_raw_member(self._zf, zinfo, buffer)
+                finally:
+                    buffer.close()
+
+    def close(self):
+        """Compress pending files and finish the archive.
+        """
+        if self._zf is None:
+            return
+        try:
+            self._flush()
+            self._release()
+            os.replace(self._tmp_path, self.dst)
+        except:
+            self.abort()
+            raise
+        self._tmp_path = None
+
+    def abort(self):
+        """Stop building and remove the unfinished archive, existing ``dst``
+        is kept.
+        """
+        try:
+            if self._zf is not None:
+                self._release()
+        finally:
+            if self._tmp_path is not None:
+                if os.path.exists(self._tmp_path):
+                    os.remove(self._tmp_path)
+                self._tmp_path = None
+
+    def _release(self):
+        self._pool.close()
+        self._pool.join()
+        try:
+            self._zf.close()
+        finally:
+            self._zf = None
+            if self._old_fileobj is not None:
+                self._old_fileobj.close()
+                self._old_fileobj = None
+
+
+def zip_a_folder(src, dst, update=False):
     """Add a folder and everything inside to zip archive.
 
     Example::
@@ -61,33 +465,24 @@ def zip_a_folder(src, dst):
                 |--- images
                     |--- 1.jpg
 
+    :param update: if ``dst`` exists, update it incrementally, see
+        :class:`ZipArchiveBuilder`.
+
     **中文文档**
 
-    将整个文件夹添加到压缩包, 包括根目录本身。
+    将整个文件夹添加到压缩包, 包括根目录本身。``update=True`` 时增量更新已存在的
+    压缩包。
     """
-    if os.path.exists(dst):
+    if os.path.exists(dst) and not update:
         print("destination '%s' already exist." % dst)
         return
 
-    src, dst = os.path.abspath(src), os.path.abspath(dst)
-    cwd = os.getcwd()
-    todo = list()
-
-    dirname, basename = os.path.split(src)
-    os.chdir(dirname)
-    for dirname, _, fnamelist in os.walk(basename):
-        for fname in fnamelist:
-            newname = os.path.join(dirname, fname)
-            todo.append(newname)
-
-    with ZipFile(dst, "w") as f:
-        for newname in todo:
-            f.write(newname)
-
-    os.chdir(cwd)
+    src = os.path.abspath(src)
+    with ZipArchiveBuilder(dst, update=update) as builder:
+        builder.add_dir(src, arcname=os.path.basename(src))
 
 
-def zip_everything_in_a_folder(src, dst):
+def zip_everything_in_a_folder(src, dst, update=False):
     """Add everything in a folder except the root folder it self to zip archive.
 
     Example::
@@ -104,48 +499,400 @@ def zip_everything_in_a_folder(src, dst):
             |--- images
                 |--- 1.jpg
 
+    :param update: if ``dst`` exists, update it incrementally, see
+        :class:`ZipArchiveBuilder`.
+
     **中文文档**
 
-    将目录内部的所有文件添加到压缩包, 不包括根目录本身。
+    将目录内部的所有文件添加到压缩包, 不包括根目录本身。``update=True`` 时增量
+    更新已存在的压缩包。
     """
-    if os.path.exists(dst):
+    if os.path.exists(dst) and not update:
         print("destination '%s' already exist." % dst)
         return
 
-    src, dst = os.path.abspath(src), os.path.abspath(dst)
-    cwd = os.getcwd()
-    todo = list()
-
-    os.chdir(src)
-    for dirname, _, fnamelist in os.walk(os.getcwd()):
-        for fname in fnamelist:
-            newname = os.path.relpath(os.path.join(dirname, fname), src)
-            todo.append(newname)
-
-    with ZipFile(dst, "w") as f:
-        for newname in todo:
-            f.write(newname)
+    with ZipArchiveBuilder(dst, update=update) as builder:
+        builder.add_dir(src, arcname="")
 
-    os.chdir(cwd)
 
-
-def zip_many_files(list_of_abspath, dst):
+def zip_many_files(list_of_abspath, dst, update=False):
     """Add many files to a zip archive.
 
     **中文文档**
 
     将一系列的文件压缩到一个压缩包中, 若有重复的文件名, 在zip中保留所有的副本。
+    ``update=True`` 时增量更新已存在的压缩包。
     """
-    if os.path.exists(dst):
+    if os.path.exists(dst) and not update:
         print("destination '%s' already exist." % dst)
         return
 
-    base_dir = os.getcwd()
-
-    with ZipFile(dst, "w") as f:
+    with ZipArchiveBuilder(dst, update=update) as builder:
         for abspath in list_of_abspath:
-            dirname, basename = os.path.split(abspath)
-            os.chdir(dirname)
-            f.write(basename)
+            builder.add_file(abspath, os.path.basename(abspath))
+
+
+def _safe_path(dst, name):
+    """Local path of a member, reject absolute path and ``..``, so a
+    malicious archive can't write outside of ``dst`` (zip slip).
+    """
+    name = name.replace("\\", "/")
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if name.startswith("/") or ".." in parts or \
+            (parts and os.path.splitdrive(parts[0])[0]):
+        raise ValueError("unsafe member name %r" % name)
+    path = os.path.join(dst, *parts)
+    if os.path.commonpath([dst, os.path.realpath(path)]) != dst:
+        raise ValueError("unsafe member name %r" % name)
+    return path
+
+
+def _make_filter(members):
+    """``members`` can be None (everything), a glob pattern, a list of
+    glob patterns, or a function takes member name and returns bool.
+    """
+    if members is None:
+        return lambda name: True
+    if callable(members):
+        return members
+    if isinstance(members, str):
+        members = [members, ]
+    patterns = list(members)
+    return lambda name: any(
+        fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def extract(archive, dst, members=None, processes=None):
+    """Extract members of a zip archive on a thread pool.
+
+    The central directory is read once, decompression releases the GIL,
+    data is copied with a large buffer. Modify time of files is restored.
+
+    Example::
+
+        extract("paper.zip", "paper", members="*.pdf")
+        extract("paper.zip", "paper", members=lambda name: "images" in name)
+
+    :param archive: path of the zip file.
+    :param dst: the directory to extract to.
+    :param members: None means all, or a glob pattern, a list of glob
+        patterns, or a function takes member name and returns bool.
+    :param processes: number of threads, default is number of CPU.
+    :return: list of extracted file path.
 
-    os.chdir(base_dir)
+    **中文文档**
+
+    使用多线程并行解压。可以用 glob 模式或函数选择需要解压的文件。压缩包中试图写到
+    ``dst`` 之外的文件名 (zip slip) 会抛出 ``ValueError``。
+    """
+    dst = os.path.realpath(dst)
+    accept = _make_filter(members)
+    with ZipFile(archive) as zf:
+        todo = list()
+        for zinfo in zf.infolist():
+            if not accept(zinfo.filename):
+                continue
+            path = _safe_path(dst, zinfo.filename)
+            if zinfo.filename.endswith("/"):
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+            else:
+                todo.append((zinfo, path))
+        # create all parent directories first, avoid race between threads
+        for dirname in sorted(set(os.path.dirname(path) for _, path in todo)):
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+
+        def extract_one(task):
+            zinfo, path = task
+            with zf.open(zinfo) as src, open(path, "wb") as f:
+                shutil.copyfileobj(src, f, _COPY_BUFFER_SIZE)
+            mtime = time.mktime(zinfo.date_time + (0, 0, -1))
+            os.utime(path, (mtime, mtime))
+            return path
+
+        pool = ThreadPool(processes or cpu_count())
+        try:
+            return pool.map(extract_one, todo)
+        finally:
+            pool.close()
+            pool.join()
+
+
+#: max number of archives kept open by :func:`read_member`.
+MAX_OPEN_ARCHIVES = 16
+
+_archive_cache = OrderedDict()
+_archive_cache_lock = threading.Lock()
+
+
+class _CachedArchive(object):
+    """An opened ``ZipFile`` in the cache, with reference count. It's closed
+    when it's dropped from the cache and not used by any thread.
+    """
+
+    def __init__(self, key, zf):
+        self.key = key
+        self.zf = zf
+        self.refs = 0
+        self.dropped = False
+
+    def drop(self):
+        """Called with ``_archive_cache_lock`` held.
+        """
+        self.dropped = True
+        if not self.refs:
+            self.zf.close()
+
+
+def _acquire_archive(archive):
+    """Opened archive from the LRU cache, it's reopened if the file has
+    been changed since it was opened. :func:`_release_archive` has to be
+    called after use.
+    """
+    abspath = os.path.abspath(archive)
+    st = os.stat(abspath)
+    key = (st.st_mtime, st.st_size, st.st_ino)
+    with _archive_cache_lock:
+        item = _archive_cache.pop(abspath, None)
+        if item is not None and item.key != key:
+            item.drop()
+            item = None
+        if item is None:
+            item = _CachedArchive(key, ZipFile(abspath))
+        _archive_cache[abspath] = item
+        while len(_archive_cache) > MAX_OPEN_ARCHIVES:
+            _archive_cache.popitem(last=False)[1].drop()
+        item.refs += 1
+        return item
+
+
+def _release_archive(item):
+    with _archive_cache_lock:
+        item.refs -= 1
+        if item.dropped and not item.refs:
+            item.zf.close()
+
+
+def read_member(archive, name):
+    """Read content of a member. The opened archive is cached, so repeated
+    reads don't parse the central directory again.
+
+    :param archive: path of the zip file.
+    :param name: member name.
+    :return: bytes.
+
+    **中文文档**
+
+    读取压缩包中某个文件的内容。打开的压缩包会被缓存, 重复读取时无需再次解析
+    中央目录。压缩包文件被修改后会自动重新打开。
+    """
+    item = _acquire_archive(archive)
+    try:
+        return item.zf.read(name)
+    finally:
+        _release_archive(item)
+
+
+def close_archives():
+    """Close all archives cached by :func:`read_member`.
+    """
+    with _archive_cache_lock:
+        while _archive_cache:
+            _archive_cache.popitem()[1].drop()
+
+
+GZIP_BLOCK_SIZE = 128 * 1024
+
+#: deflate window size, dictionary of each block in parallel mode
+_WINDOW_SIZE = 32 * 1024
+
+
+def _iter_gzip_input(data, chunk_size):
+    """Iterate bytes chunks from bytes, file-like object or iterable of bytes.
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+    elif hasattr(data, "read"):
+        while True:
+            chunk = data.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in data:
+            yield chunk
+
+
+def _iter_blocks(data, block_size):
+    """Regroup input into blocks of exactly ``block_size`` bytes, except the
+    last one.
+    """
+    buffer = bytearray()
+    for chunk in _iter_gzip_input(data, block_size):
+        if not buffer and len(chunk) == block_size:
+            yield bytes(chunk)
+            continue
+        buffer += chunk
+        while len(buffer) >= block_size:
+            yield bytes(buffer[:block_size])
+            del buffer[:block_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _deflate_block(task):
+    """Raw deflate a block, primed with the last 32KB of the previous block,
+    end with a sync flush, so the outputs can be concatenated.
+    """
+    block, dictionary, compresslevel = task
+    if dictionary:
+        compressor = zlib.compressobj(
+            compresslevel, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY,
+            dictionary)
+    else:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15, 9)
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _write_gzip_parallel(data, f, compresslevel, mtime, processes,
+                         block_size):
+    """pigz style, blocks are deflated on a thread pool, output is one
+    standard gzip member.
+    """
+    xfl = b"\x02" if compresslevel == 9 else (
+        b"\x04" if compresslevel == 1 else b"\x00")
+    f.write(b"\x1f\x8b\x08\x00" + struct.pack("<L", int(mtime))
+            + xfl + b"\xff")
+    crc = 0
+    size = 0
+    dictionary = b""
+    pool = ThreadPool(processes)
+    try:
+        tasks = list()
+        blocks = _iter_blocks(data, block_size)
+        while True:
+            block = next(blocks, None)
+            if block is not None:
+                tasks.append((block, dictionary, compresslevel))
+                dictionary = block[-_WINDOW_SIZE:]
+            if tasks and (block is None or len(tasks) >= 4 * processes):
+                for (block_, _, _), compressed in zip(
+                        tasks, pool.map(_deflate_block, tasks)):
+                    crc = zlib.crc32(block_, crc)
+                    size += len(block_)
+                    f.write(compressed)
+                tasks = list()
+            if block is None:
+                break
+    finally:
+        pool.close()
+        pool.join()
+    # an empty final block
+    f.write(zlib.compressobj(compresslevel, zlib.DEFLATED, -15).flush())
+    f.write(struct.pack("<LL", crc & 0xFFFFFFFF, size & 0xFFFFFFFF))
+
+
+def write_gzip(data, abspath, compresslevel=6, processes=1,
+               block_size=GZIP_BLOCK_SIZE, append=False, mtime=None):
+    """Write binary content to gzip file.
+
+    :param data: bytes, binary file-like object, or iterable of bytes.
+    :param abspath: path of the gzip file.
+    :param compresslevel: compression level, 1 ~ 9.
+    :param processes: number of threads. If more than 1, input is split
+        into blocks deflated in parallel like ``pigz``, each block uses the
+        last 32KB of previous block as dictionary, output is still a
+        standard gzip file, slightly bigger.
+    :param block_size: block size of parallel mode.
+    :param append: append a new gzip member to the file, the result is a
+        multi-member gzip file, it can be read as the concatenated content.
+    :param mtime: modify time in gzip header, default is now.
+
+    **中文文档**
+
+    将二进制数据流式写入gzip文件。``processes`` 大于1时, 类似 ``pigz``, 将数据分块
+    后多线程并行压缩, 输出仍是标准的gzip文件。
+    """
+    if mtime is None:
+        mtime = time.time()
+    with open(abspath, "ab" if append else "wb") as f:
+        if processes > 1:
+            _write_gzip_parallel(
+                data, f, compresslevel, mtime, processes, block_size)
+        else:
+            with gzip.GzipFile(filename="", mode="wb", fileobj=f,
+                               compresslevel=compresslevel,
+                               mtime=mtime) as gz:
+                for chunk in _iter_gzip_input(data, block_size):
+                    gz.write(chunk)
+
+
+def iter_gzip(abspath, chunk_size=1024 * 1024):
+    """Read binary content from gzip file chunk by chunk, multi-member gzip
+    file is supported.
+
+    :param abspath: path of the gzip file, or a binary file-like object.
+    :param chunk_size: read size, also the max size of each chunk.
+    :return: generator of bytes.
+
+    **中文文档**
+
+    流式读取gzip文件, 支持多个gzip文件拼接而成的文件。
+    """
+    if hasattr(abspath, "read"):
+        f, close = abspath, False
+    else:
+        f, close = open(abspath, "rb"), True
+    try:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        in_member = False
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            while data:
+                if decompressor.eof:  # next member
+                    if not data.strip(b"\x00"):  # trailing padding
+                        break
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                chunk = decompressor.decompress(data, chunk_size)
+                if chunk:
+                    yield chunk
+                in_member = not decompressor.eof
+                if in_member:
+                    data = decompressor.unconsumed_tail
+                else:
+                    data = decompressor.unused_data
+        if in_member:
+            raise EOFError("Compressed file ended before the "
+                           "end-of-stream marker was reached")
+    finally:
+        if close:
+            f.close()
+
+
+def read_gzip(abspath):
+    """Read binary content from gzip file.
+
+    **中文文档**
+
+    读取解压后的二进制数据内容。
+    """
+    return b"".join(iter_gzip(abspath))
+
+
+def concat_gzip(list_of_abspath, dst):
+    """Concatenate gzip files into one multi-member gzip file, without
+    decompressing. Useful for shards compressed in parallel.
+
+    **中文文档**
+
+    将多个gzip文件直接拼接成一个gzip文件, 无需解压。常用于合并并行生成的分片。
+    """
+    with open(dst, "wb") as f:
+        for abspath in list_of_abspath:
+            with open(abspath, "rb") as src:
+                shutil.copyfileobj(src, f, _COPY_BUFFER_SIZE)
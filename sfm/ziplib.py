@@ -2,13 +2,75 @@
 
 """
 compress and decompress data using zlib.
+
+For large payload, use the streaming API, only one chunk is held in memory::
+
+    >>> for chunk in compress_stream(open("big.bin", "rb")):
+    ...     out.write(chunk)
+    >>> with open("big.obj.gz", "wb") as f:
+    ...     dump(big_obj, f)
+    >>> with open("big.obj.gz", "rb") as f:
+    ...     big_obj = load(f)
+
+Output of :func:`compress_stream` and :func:`dump` is a plain zlib stream, it
+can be decompressed by :func:`decompress` as well.
+
+Other codec can be used by name, the output starts with a header byte tells
+the codec and the payload type, so :func:`decompress` returns the original
+object without ``return_type``::
+
+    >>> b = compress({"a": 1}, codec="lzma")
+    >>> decompress(b)
+    {"a": 1}
+
+Built-in codecs are "zlib", "bz2", "lzma", and "lz4", "zstd" if ``lz4``,
+``zstandard`` are installed. Use :func:`register_codec` to add more.
+
+Large data can be split into independent blocks and compressed on all cores,
+any block can be read without decompressing the others::
+
+    >>> b = compress_blocks(big_bytes, block_size=1024 * 1024)
+    >>> decompress(b) == big_bytes
+    True
+    >>> read_block(b, 3) == big_bytes[3 * 1024 * 1024: 4 * 1024 * 1024]
+    True
+
+Many small records compress much better with a dictionary trained from
+samples::
+
+    >>> rc = RecordCompressor.train(sample_records)
+    >>> compressed = rc.compress_many(records)
+    >>> rc.decompress_many(compressed) == records
+    True
 """
 
+import io
 import sys
+import bz2
 import types
 import zlib
+import heapq
+import struct
 import base64
 import pickle
+import collections
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    lzma = None
+
+try:
+    import lz4.frame
+except ImportError:  # pragma: no cover
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
 
 PY2 = sys.version_info[0] == 2
 PY3 = sys.version_info[0] == 3
@@ -28,7 +90,94 @@ else:  # pragma: no cover
     text_type = unicode
     binary_type = str
 
-__all__ = ["compress", "decompress"]
+__all__ = [
+    "compress", "decompress",
+    "compress_stream", "decompress_stream", "dump", "load",
+    "register_codec", "available_codecs",
+    "compress_blocks", "decompress_blocks", "read_block",
+    "train_dictionary", "RecordCompressor",
+]
+
+#: default chunk size of streaming API
+CHUNK_SIZE = 1024 * 1024
+
+#: protocol 4 and above write pickle frame by frame, memory usage is constant
+STREAM_PICKLE_PROTOCOL = min(4, pickle.HIGHEST_PROTOCOL)
+
+
+Codec = collections.namedtuple("Codec", "name id compress decompress")
+
+_codecs_by_name = dict()
+_codecs_by_id = dict()
+
+
+def register_codec(name, codec_id, compress_func, decompress_func):
+    """Register a codec.
+
+    :param name: codec name.
+    :param codec_id: 1 ~ 15, stored in the high 4 bits of the header byte.
+    :param compress_func: ``compress_func(data, level) -> bytes``.
+    :param decompress_func: ``decompress_func(data) -> bytes``.
+    """
+    if not (1 <= codec_id <= 15):
+        raise ValueError("codec_id has to be in 1 ~ 15!")
+    if codec_id in _codecs_by_id and _codecs_by_id[codec_id].name != name:
+        raise ValueError("codec_id %s is used by %r!" % (
+            codec_id, _codecs_by_id[codec_id].name))
+    codec = Codec(name, codec_id, compress_func, decompress_func)
+    _codecs_by_name[name] = codec
+    _codecs_by_id[codec_id] = codec
+
+
+def available_codecs():
+    """Names of all registered codecs.
+    """
+    return sorted(_codecs_by_name)
+
+
+register_codec("zlib", 1, zlib.compress, zlib.decompress)
+register_codec("bz2", 2,
+               lambda data, level: bz2.compress(data, max(level, 1)),
+               bz2.decompress)
+if lzma is not None:  # pragma: no cover
+    register_codec("lzma", 3,
+                   lambda data, level: lzma.compress(data, preset=level),
+                   lzma.decompress)
+if lz4 is not None:  # pragma: no cover
+    register_codec("lz4", 4,
+                   lambda data, level: lz4.frame.compress(
+                       data, compression_level=level),
+                   lz4.frame.decompress)
+if zstandard is not None:  # pragma: no cover
+    register_codec("zstd", 5,
+                   lambda data, level: zstandard.ZstdCompressor(
+                       level=level).compress(data),
+                   lambda data: zstandard.ZstdDecompressor().decompress(
+                       data, max_output_size=2 ** 31 - 1))
+
+# payload type, low 4 bits of the header byte. A zlib stream always starts
+# with 0x?8 (deflate), 8 is never used here, so legacy zlib data never looks
+# like it has a header.
+PAYLOAD_BYTES = 0
+PAYLOAD_STR = 1
+PAYLOAD_OBJ = 2
+
+_payload_to_return_type = {
+    PAYLOAD_BYTES: "bytes",
+    PAYLOAD_STR: "str",
+    PAYLOAD_OBJ: "obj",
+}
+
+
+def _serialize(obj):
+    """Convert object to bytes, return (bytes, payload type).
+    """
+    if isinstance(obj, binary_type):
+        return obj, PAYLOAD_BYTES
+    elif isinstance(obj, string_types):
+        return obj.encode("utf-8"), PAYLOAD_STR
+    else:
+        return pickle.dumps(obj, protocol=2), PAYLOAD_OBJ
 
 
 def _compress_obj(obj, level):
@@ -49,7 +198,7 @@ def _compress_bytes(b, level):
     return zlib.compress(b, level)
 
 
-def compress(obj, level=6, return_type="bytes"):
+def compress(obj, level=6, return_type="bytes", codec=None):
     """Compress anything to bytes or string.
 
     :param obj: could be any object, usually it could be binary, string, or
@@ -57,13 +206,28 @@ def compress(obj, level=6, return_type="bytes"):
     :param level:
     :param return_type: if bytes, then return bytes; if str, then return
         base64.b64encode bytes in utf-8 string.
+    :param codec: None, or name of a registered codec. If None, the output
+        is a plain zlib stream, as it always was. Otherwise, the output is
+        one header byte (codec id << 4 | payload type) plus the compressed
+        data.
     """
-    if isinstance(obj, binary_type):
-        b = _compress_bytes(obj, level)
-    elif isinstance(obj, string_types):
-        b = _compress_str(obj, level)
+    if codec is None:
+        if isinstance(obj, binary_type):
+            b = _compress_bytes(obj, level)
+        elif isinstance(obj, string_types):
+            b = _compress_str(obj, level)
+        else:
+            b = _compress_obj(obj, level)
     else:
-        b = _compress_obj(obj, level)
+        try:
+            codec = _codecs_by_name[codec]
+        except KeyError:
+            raise ValueError("codec %r is not available, try one of %s." % (
+                codec, available_codecs()))
+        data, payload_type = _serialize(obj)
+        b = bytearray([(codec.id << 4) | payload_type])
+        b.extend(codec.compress(data, level))
+        b = bytes(b)
 
     if return_type == "bytes":
         return b
@@ -73,21 +237,45 @@ def compress(obj, level=6, return_type="bytes"):
         raise ValueError("'return_type' has to be one of 'bytes', 'str'!")
 
 
-def decompress(obj, return_type="bytes"):
+def _decompress_bytes(b):
+    """Decompress bytes, return (bytes, payload type), payload type is None
+    for legacy zlib stream.
+    """
+    if b[:len(BLOCK_MAGIC)] == BLOCK_MAGIC:
+        return _decompress_blocks(b)
+    if b:
+        header = bytearray(b[:1])[0]
+        codec_id, payload_type = header >> 4, header & 0x0F
+        if payload_type in _payload_to_return_type:
+            try:
+                codec = _codecs_by_id[codec_id]
+            except KeyError:
+                raise ValueError("unknown codec id %s, is the codec "
+                                 "installed and registered?" % codec_id)
+            return codec.decompress(b[1:]), payload_type
+    return zlib.decompress(b), None
+
+
+def decompress(obj, return_type=None):
     """
     De-compress it to it's original.
 
     :param obj: Compressed object, could be bytes or str.
     :param return_type: if bytes, then return bytes; if str, then use
         base64.b64decode; if obj, then use pickle.loads return an object.
+        If None, use the payload type recorded in header, or bytes for
+        legacy zlib data.
     """
     if isinstance(obj, binary_type):
-        b = zlib.decompress(obj)
+        b, payload_type = _decompress_bytes(obj)
     elif isinstance(obj, string_types):
-        b = zlib.decompress(base64.b64decode(obj.encode("utf-8")))
+        b, payload_type = _decompress_bytes(base64.b64decode(obj.encode("utf-8")))
     else:
         raise TypeError("input cannot be anything other than str and bytes!")
 
+    if return_type is None:
+        return_type = _payload_to_return_type.get(payload_type, "bytes")
+
     if return_type == "bytes":
         return b
     elif return_type == "str":
@@ -97,3 +285,485 @@ def decompress(obj, return_type="bytes"):
     else:
         raise ValueError(
             "'return_type' has to be one of 'bytes', 'str' or 'obj'!")
+
+
+def _iter_chunks(data, chunk_size):
+    """Iterate bytes chunks from bytes, file-like object or iterable of bytes.
+    """
+    if isinstance(data, (binary_type, bytearray, memoryview)):
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+    elif hasattr(data, "read"):
+        while True:
+            chunk = data.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in data:
+            yield chunk
+
+
+def compress_stream(data, level=6, chunk_size=CHUNK_SIZE):
+    """Compress a stream of bytes.
+
+    :param data: bytes, binary file-like object, or iterable of bytes.
+    :param level: compression level, 0 ~ 9.
+    :param chunk_size: read size if ``data`` is file-like object.
+    :return: generator of compressed bytes chunks, they joined together is a
+        zlib stream.
+
+    **中文文档**
+
+    流式压缩, 每次只在内存中保留一个块。
+    """
+    compressor = zlib.compressobj(level)
+    for chunk in _iter_chunks(data, chunk_size):
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def decompress_stream(data, chunk_size=CHUNK_SIZE):
+    """Decompress a zlib stream.
+
+    :param data: bytes, binary file-like object, or iterable of bytes.
+    :param chunk_size: read size if ``data`` is file-like object, also the
+        max size of each decompressed chunk.
+    :return: generator of decompressed bytes chunks.
+
+    **中文文档**
+
+    流式解压, 每次输出的块不超过 ``chunk_size``。
+    """
+    decompressor = zlib.decompressobj()
+    for chunk in _iter_chunks(data, chunk_size):
+        while chunk:
+            decompressed = decompressor.decompress(chunk, chunk_size)
+            if decompressed:
+                yield decompressed
+            chunk = decompressor.unconsumed_tail
+    while True:
+        decompressed = decompressor.flush(chunk_size)
+        if not decompressed:
+            break
+        yield decompressed
+    if not decompressor.eof:
+        raise zlib.error("incomplete or truncated stream")
+
+
+class _CompressWriter(object):
+    """A write-only file-like object compress everything into ``fileobj``.
+    """
+
+    def __init__(self, fileobj, level):
+        self.fileobj = fileobj
+        self.compressor = zlib.compressobj(level)
+
+    def write(self, data):
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self.fileobj.write(compressed)
+        return len(data)
+
+    def close(self):
+        self.fileobj.write(self.compressor.flush())
+
+
+class _DecompressReader(io.RawIOBase):
+    """A read-only raw stream decompress ``fileobj`` on the fly.
+    """
+
+    def __init__(self, fileobj, chunk_size):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.decompressor = zlib.decompressobj()
+        self.unused = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = len(buffer)
+        while True:
+            if self.unused:
+                data = self.unused
+            elif self.decompressor.eof:
+                return 0
+            else:
+                data = self.fileobj.read(self.chunk_size)
+                if not data:
+                    raise EOFError("compressed stream ended unexpectedly")
+            decompressed = self.decompressor.decompress(data, size)
+            self.unused = self.decompressor.unconsumed_tail
+            if decompressed:
+                buffer[:len(decompressed)] = decompressed
+                return len(decompressed)
+
+
+def dump(obj, fileobj, level=6, protocol=STREAM_PICKLE_PROTOCOL):
+    """Pickle an object and write compressed data straight into a file,
+    without building the whole pickle in memory.
+
+    :param obj: any picklable python object.
+    :param fileobj: binary file-like object has ``write`` method.
+    :param level: compression level, 0 ~ 9.
+    :param protocol: pickle protocol, memory usage is constant with
+        protocol 4 and above.
+
+    **中文文档**
+
+    将对象 pickle 后直接压缩写入文件, 不在内存中生成完整的 pickle 结果。
+    """
+    writer = _CompressWriter(fileobj, level)
+    pickle.Pickler(writer, protocol=protocol).dump(obj)
+    writer.close()
+
+
+def load(fileobj, chunk_size=CHUNK_SIZE):
+    """Load object written by :func:`dump`, decompress while unpickling.
+
+    :param fileobj: binary file-like object has ``read`` method.
+    """
+    reader = io.BufferedReader(
+        _DecompressReader(fileobj, chunk_size), buffer_size=chunk_size)
+    return pickle.load(reader)
+
+
+# framed block format:
+#
+# - header: magic "SFMB", version, codec id, payload type, 1 byte reserved,
+#   block size (uint32), number of blocks (uint32)
+# - block index: compressed size and raw size of each block (uint32 x 2)
+# - compressed blocks
+#
+# "S" = 0x53, payload type 3 is never used, it doesn't look like a single
+# byte codec header nor a zlib stream.
+BLOCK_MAGIC = b"SFMB"
+BLOCK_VERSION = 1
+_block_header = struct.Struct("<4sBBBxII")
+
+
+def _run_in_pool(func, items, processes):
+    if processes == 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(min(processes or cpu_count(), len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def compress_blocks(obj, level=6, codec="zlib", block_size=CHUNK_SIZE,
+                    processes=None):
+    """Split data into independent blocks, compress them on a thread pool.
+    zlib, bz2, lzma, lz4 and zstd all release the GIL, so it scales with
+    number of cores.
+
+    :param obj: could be any object, as :func:`compress`.
+    :param level: compression level.
+    :param codec: name of a registered codec.
+    :param block_size: size of raw data in each block. Bigger block has
+        better ratio, smaller block has faster random access.
+    :param processes: number of threads, default is number of CPU.
+    :return: bytes in framed block format, use :func:`decompress`,
+        :func:`decompress_blocks` or :func:`read_block` to read it.
+
+    **中文文档**
+
+    将数据分成独立的块, 使用多线程并行压缩。每个块可以单独解压。
+    """
+    if not (1 <= block_size < 2 ** 32):
+        raise ValueError("block_size has to be in 1 ~ 2 ** 32 - 1!")
+    try:
+        codec = _codecs_by_name[codec]
+    except KeyError:
+        raise ValueError("codec %r is not available, try one of %s." % (
+            codec, available_codecs()))
+    data, payload_type = _serialize(obj)
+    view = memoryview(data)
+    blocks = [view[start:start + block_size]
+              for start in range(0, len(view), block_size)]
+    compressed_blocks = _run_in_pool(
+        lambda block: codec.compress(block, level), blocks, processes)
+
+    index = list()
+    for block, compressed in zip(blocks, compressed_blocks):
+        index.append(len(compressed))
+        index.append(len(block))
+    parts = [
+        _block_header.pack(BLOCK_MAGIC, BLOCK_VERSION, codec.id, payload_type,
+                           block_size, len(blocks)),
+        struct.pack("<%sI" % len(index), *index),
+    ]
+    parts.extend(compressed_blocks)
+    return b"".join(parts)
+
+
+def _read_block_index(read):
+    """Read header and block index with ``read(offset, size)``.
+
+    :return: (codec, payload type, block size, list of (offset, compressed
+        size, raw size))
+    """
+    magic, version, codec_id, payload_type, block_size, n_blocks = \
+        _block_header.unpack(read(0, _block_header.size))
+    if magic != BLOCK_MAGIC:
+        raise ValueError("not a framed block data!")
+    if version != BLOCK_VERSION:
+        raise ValueError("unsupported block format version %s!" % version)
+    try:
+        codec = _codecs_by_id[codec_id]
+    except KeyError:
+        raise ValueError("unknown codec id %s, is the codec "
+                         "installed and registered?" % codec_id)
+    index = struct.unpack(
+        "<%sI" % (2 * n_blocks), read(_block_header.size, 8 * n_blocks))
+    offset = _block_header.size + 8 * n_blocks
+    blocks = list()
+    for i in range(n_blocks):
+        compressed_size, raw_size = index[2 * i], index[2 * i + 1]
+        blocks.append((offset, compressed_size, raw_size))
+        offset += compressed_size
+    return codec, payload_type, block_size, blocks
+
+
+def _decompress_blocks(b, processes=None):
+    view = memoryview(b)
+    codec, payload_type, _, blocks = _read_block_index(
+        lambda offset, size: view[offset:offset + size].tobytes())
+
+    def decompress_block(block):
+        offset, compressed_size, raw_size = block
+        data = codec.decompress(view[offset:offset + compressed_size])
+        if len(data) != raw_size:
+            raise ValueError("block size mismatch, data is corrupted!")
+        return data
+
+    return b"".join(
+        _run_in_pool(decompress_block, blocks, processes)), payload_type
+
+
+def decompress_blocks(b, return_type=None, processes=None):
+    """Decompress framed block data made by :func:`compress_blocks` on a
+    thread pool.
+
+    :param b: bytes.
+    :param return_type: "bytes", "str", "obj", or None to use the payload
+        type recorded in header.
+    :param processes: number of threads, default is number of CPU.
+    """
+    data, payload_type = _decompress_blocks(b, processes)
+    if return_type is None:
+        return_type = _payload_to_return_type[payload_type]
+    if return_type == "bytes":
+        return data
+    elif return_type == "str":
+        return data.decode("utf-8")
+    elif return_type == "obj":
+        return pickle.loads(data)
+    else:
+        raise ValueError(
+            "'return_type' has to be one of 'bytes', 'str' or 'obj'!")
+
+
+def read_block(source, i):
+    """Read and decompress only the i-th block, the raw data is
+    ``data[i * block_size: (i + 1) * block_size]``.
+
+    :param source: bytes made by :func:`compress_blocks`, or a seekable
+        binary file-like object, only header, index and the block are read.
+    :param i: block number, starts from 0.
+    :return: bytes.
+    """
+    if hasattr(source, "read"):
+        base = source.tell()
+
+        def read(offset, size):
+            source.seek(base + offset)
+            return source.read(size)
+    else:
+        view = memoryview(source)
+
+        def read(offset, size):
+            return view[offset:offset + size]
+
+    codec, _, _, blocks = _read_block_index(
+        lambda offset, size: bytes(read(offset, size)))
+    offset, compressed_size, raw_size = blocks[i]
+    data = codec.decompress(read(offset, compressed_size))
+    if len(data) != raw_size:
+        raise ValueError("block size mismatch, data is corrupted!")
+    return data
+
+
+def _dmers(sample, d):
+    return set([sample[i:i + d] for i in range(len(sample) - d + 1)])
+
+
+def train_dictionary(samples, dict_size=32 * 1024, d=8):
+    """Build a raw content dictionary from sample records.
+
+    Samples are picked greedily by how many common ``d`` bytes substrings,
+    which are not yet covered by picked samples, they have per byte. The most
+    useful samples are put at the end of the dictionary, they are the closest
+    to the data, which gives shorter match distance.
+
+    :param samples: list of bytes, sample records.
+    :param dict_size: max size of the dictionary, zlib can use at most 32KB.
+    :param d: length of substring to count.
+    :return: bytes.
+
+    **中文文档**
+
+    从样本记录中构建压缩字典, 优先选择包含最多常见片段的样本。
+    """
+    samples = [sample for sample in samples if len(sample) >= d]
+    dmers_list = [_dmers(sample, d) for sample in samples]
+    frequency = collections.Counter()
+    for dmers in dmers_list:
+        frequency.update(dmers)
+
+    def score(i):
+        return float(sum([frequency[dmer] for dmer in dmers_list[i]])) / \
+            len(samples[i])
+
+    # lazy greedy, score only decreases after other samples are picked
+    heap = [(-score(i), i) for i in range(len(samples))]
+    heapq.heapify(heap)
+    picked = list()
+    total = 0
+    while heap and total < dict_size:
+        _, i = heapq.heappop(heap)
+        new_score = score(i)
+        if heap and new_score < -heap[0][0]:
+            heapq.heappush(heap, (-new_score, i))
+            continue
+        if new_score <= 1:  # nothing common any more
+            break
+        picked.append(samples[i])
+        total += len(samples[i])
+        for dmer in dmers_list[i]:
+            frequency[dmer] = 1
+    return b"".join(reversed(picked))[-dict_size:]
+
+
+class RecordCompressor(object):
+    """Compress many small records with a shared dictionary.
+
+    zlib: raw deflate (no header and checksum) primed with ``zdict``. The
+    primed compressor is copied for each record, it's much cheaper than
+    loading the dictionary every time.
+
+    zstd: a zstd dictionary, frame without checksum and dictionary id.
+
+    The dictionary is NOT stored in compressed record, keep
+    :attr:`dictionary` together with the data, use :attr:`dict_id` to check
+    it's the right one.
+
+    :param dictionary: bytes, from :func:`train_dictionary`, or a zstd
+        dictionary if codec is "zstd".
+    :param codec: "zlib" or "zstd".
+    :param level: compression level.
+
+    **中文文档**
+
+    使用共享字典压缩大量小记录, 对 200 ~ 2000 字节的记录压缩率提高很多。
+    """
+
+    def __init__(self, dictionary, codec="zlib", level=6):
+        self.dictionary = dictionary
+        self.codec = codec
+        self.level = level
+        if codec == "zlib":
+            self._compressor = zlib.compressobj(
+                level, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY,
+                dictionary)
+            self._decompressor = zlib.decompressobj(-15, dictionary)
+        elif codec == "zstd":
+            if zstandard is None:  # pragma: no cover
+                raise ValueError("codec 'zstd' requires zstandard installed!")
+            zstd_dict = zstandard.ZstdCompressionDict(dictionary)
+            self._compressor = zstandard.ZstdCompressor(
+                level=level, dict_data=zstd_dict, write_checksum=False,
+                write_content_size=True, write_dict_id=False)
+            self._decompressor = zstandard.ZstdDecompressor(
+                dict_data=zstd_dict)
+        else:
+            raise ValueError("codec has to be 'zlib' or 'zstd'!")
+
+    @classmethod
+    def train(cls, samples, dict_size=32 * 1024, codec="zlib", level=6):
+        """Train a dictionary from sample records and create a compressor.
+
+        For zstd, use zstd's own trainer if possible, fall back to
+        :func:`train_dictionary` if there are not enough samples.
+        """
+        samples = list(samples)
+        dictionary = None
+        if codec == "zstd" and zstandard is not None:
+            try:
+                dictionary = zstandard.train_dictionary(
+                    dict_size, samples).as_bytes()
+            except zstandard.ZstdError:
+                pass
+        if dictionary is None:
+            dictionary = train_dictionary(samples, min(dict_size, 32 * 1024))
+        return cls(dictionary, codec=codec, level=level)
+
+    @property
+    def dict_id(self):
+        """crc32 of the dictionary.
+        """
+        return zlib.crc32(self.dictionary) & 0xFFFFFFFF
+
+    def compress(self, record):
+        """Compress one record.
+
+        :param record: bytes.
+        """
+        return self.compress_many([record, ])[0]
+
+    def decompress(self, data):
+        """Decompress one record.
+        """
+        return self.decompress_many([data, ])[0]
+
+    def compress_many(self, records):
+        """Compress a list of records.
+
+        :param records: list of bytes.
+        :return: list of bytes.
+        """
+        if self.codec == "zlib":
+            copy = self._compressor.copy
+            result = list()
+            append = result.append
+            for record in records:
+                compressor = copy()
+                append(compressor.compress(record) + compressor.flush())
+            return result
+        else:
+            compress = self._compressor.compress
+            return [compress(record) for record in records]
+
+    def decompress_many(self, data_list):
+        """Decompress a list of compressed records.
+
+        :param data_list: list of bytes.
+        :return: list of bytes.
+        """
+        if self.codec == "zlib":
+            copy = self._decompressor.copy
+            result = list()
+            append = result.append
+            for data in data_list:
+                decompressor = copy()
+                append(decompressor.decompress(data) + decompressor.flush())
+            return result
+        else:
+            decompress = self._decompressor.decompress
+            return [decompress(data) for data in data_list]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import random
+import pytest
+from sfm.chunker import gear_hash, Chunker, ChunkIndex, GEAR
+
+
+def test_gear_hash():
+    data = bytearray(random.Random(0).getrandbits(8) for _ in range(300))
+    h = gear_hash(bytes(data))
+    mask = (1 << 64) - 1
+    expected = 0
+    for i, byte in enumerate(data):
+        expected = ((expected << 1) + int(GEAR[byte])) & mask
+        assert int(h[i]) == expected
+
+
+def test_chunker(tmpdir):
+    data = os.urandom(1000000)
+    chunker = Chunker(min_size=1024, avg_size=4096, max_size=16384)
+    chunks = chunker.chunks_of_bytes(data)
+
+    assert sum(chunk.length for chunk in chunks) == len(data)
+    assert [chunk.offset + chunk.length for chunk in chunks] == \
+        chunker.cut_points(data)
+    for chunk in chunks[:-1]:
+        assert 1024 <= chunk.length <= 16384
+        assert chunk.digest == chunker.fingerprint.of_bytes(
+            data[chunk.offset: chunk.offset + chunk.length])
+    assert 2000 < len(data) / len(chunks) < 8000
+
+    # streaming gives the same chunks
+    assert list(chunker.iter_chunks(io.BytesIO(data), block_size=1)) == chunks
+    path = str(tmpdir.join("data.bin"))
+    with open(path, "wb") as f:
+        f.write(data)
+    assert list(chunker.chunks_of_file(path)) == chunks
+
+    # only chunks near the modification change
+    index = ChunkIndex()
+    index.add(chunks)
+    new_data = data[:500000] + b"hello" + data[500000:]
+    missing = index.missing(chunker.chunks_of_bytes(new_data))
+    assert 1 <= len(missing) <= 3
+
+    index_path = str(tmpdir.join("index.json"))
+    index.dump(index_path)
+    index = ChunkIndex.load(index_path)
+    assert len(index) == len(set(chunk.digest for chunk in chunks))
+    assert chunks[0].digest in index
+
+    assert chunker.chunks_of_bytes(b"") == []
+    assert chunker.cut_points(b"abc") == [3, ]
+
+    with pytest.raises(ValueError):
+        Chunker(avg_size=5000)
+    with pytest.raises(ValueError):
+        Chunker(min_size=32)
+
+
+if __name__ == "__main__":
+    import os
+
+    basename = os.path.basename(__file__)
+    pytest.main([basename, "-s", "--tb=native"])
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function
+import io
+import os
+import pickle
+import hashlib
 import pytest
 from sfm.fingerprint import fingerprint
 from six import integer_types, string_types
@@ -31,6 +35,202 @@ def test_md5_file():
         fingerprint.of_file(a_file, chunk_size=0)
 
 
+def test_of_struct():
+    fingerprint.use_md5()
+    fingerprint.set_return_str()
+    obj1 = {"b": [1, 2.0, "x", b"y", None, True], "a": {1, 2}, "c": (3, )}
+    obj2 = {"c": (3, ), "a": {2, 1}, "b": [1, 2.0, "x", b"y", None, True]}
+    assert fingerprint.of_struct(obj1) == fingerprint.of_struct(obj2)
+    # str keys, non-ascii keys and mixed type keys take different paths
+    for obj in [{"bb": 1, "a": 2, "\xe9": 3}, {1: "a", "b": 2, (3, ): [4]}]:
+        reversed_obj = dict(reversed(list(obj.items())))
+        assert fingerprint.of_struct(obj) == fingerprint.of_struct(reversed_obj)
+    assert fingerprint.of_struct({"a": 1, "b": 2}) != \
+        fingerprint.of_struct({"a": 2, "b": 1})
+
+    digests = set(fingerprint.of_struct(obj) for obj in [
+        [1, 2], (1, 2), [1.0, 2.0], ["1", "2"], [b"1", b"2"], [True, 2],
+        [[1], 2], [[1, 2]], {1: 2}, {1, 2}, [], "", b"", None, 0,
+        ["ab", "c"], ["a", "bc"],
+    ])
+    assert len(digests) == 17
+
+    with pytest.raises(TypeError):
+        fingerprint.of_struct(object())
+
+
+def test_of_struct_numpy():
+    np = pytest.importorskip("numpy")
+    array = np.arange(12, dtype=np.float64).reshape(3, 4)
+    assert fingerprint.of_struct(array) == fingerprint.of_struct(array.copy())
+    assert fingerprint.of_struct(array.T) == \
+        fingerprint.of_struct(np.ascontiguousarray(array.T))
+    assert fingerprint.of_struct(array) != fingerprint.of_struct(array.T)
+    assert fingerprint.of_struct(array) != \
+        fingerprint.of_struct(array.astype(np.float32))
+    assert fingerprint.of_struct(array) != \
+        fingerprint.of_struct(array.reshape(4, 3))
+    assert fingerprint.of_struct({"x": array}) == \
+        fingerprint.of_struct({"x": array.copy()})
+    fingerprint.of_struct(np.array([1, "a"], dtype=object))
+
+
+def test_file_modes(tmpdir):
+    fingerprint.use_md5()
+    data = os.urandom(100000)
+    path = str(tmpdir.join("data.bin"))
+    with open(path, "wb") as f:
+        f.write(data)
+
+    expected = hashlib.md5(data).hexdigest()
+    for mode in ["stream", "mmap"]:
+        for chunk_size in [1000, 4096, 1024 * 1024]:
+            assert fingerprint.of_file(
+                path, mode=mode, chunk_size=chunk_size) == expected
+        assert fingerprint.of_file(path, nbytes=12345, mode=mode) == \
+            hashlib.md5(data[:12345]).hexdigest()
+
+    # tree root = hash(header + leaf digests)
+    root = hashlib.md5(b"sfm-tree:md5:4096:")
+    for start in range(0, len(data), 4096):
+        root.update(hashlib.md5(data[start:start + 4096]).digest())
+    for processes in [1, 3]:
+        assert fingerprint.of_file(
+            path, mode="tree", chunk_size=4096, processes=processes,
+        ) == root.hexdigest()
+    assert fingerprint.of_file(path, mode="tree", chunk_size=8192) != \
+        root.hexdigest()
+
+    empty = str(tmpdir.join("empty.bin"))
+    open(empty, "wb").close()
+    assert fingerprint.of_file(empty, mode="mmap") == hashlib.md5().hexdigest()
+    assert fingerprint.of_file(empty, mode="tree", chunk_size=4096) == \
+        hashlib.md5(b"sfm-tree:md5:4096:").hexdigest()
+
+    with pytest.raises(ValueError):
+        fingerprint.of_file(path, mode="unknown")
+
+
+def test_file_sample(tmpdir):
+    fingerprint.use_md5()
+    path = str(tmpdir.join("data.bin"))
+    data = bytearray(os.urandom(100000))
+    with open(path, "wb") as f:
+        f.write(data)
+
+    # small file is hashed entirely after the header
+    header = b"sfm-sample:md5:100000:1000:98:"
+    assert fingerprint.of_file_sample(path, n_samples=98, block_size=1000) == \
+        hashlib.md5(header + bytes(data)).hexdigest()
+
+    # head, 2 evenly spaced blocks, tail
+    header = b"sfm-sample:md5:100000:1000:2:"
+    expected = hashlib.md5(header + bytes(
+        data[0:1000] + data[33000:34000] + data[66000:67000]
+        + data[99000:100000]
+    )).hexdigest()
+    digest = fingerprint.of_file_sample(path, n_samples=2, block_size=1000)
+    assert digest == expected
+
+    def modified(position, append=b""):
+        new_data = bytearray(data)
+        if position is not None:
+            new_data[position] = (new_data[position] + 1) % 256
+        with open(path, "wb") as f:
+            f.write(new_data + append)
+        return fingerprint.of_file_sample(path, n_samples=2, block_size=1000)
+
+    assert modified(10) != digest  # head
+    assert modified(99999) != digest  # tail
+    assert modified(None, append=b"x") != digest  # size
+    assert modified(50000) == digest  # not sampled, collision by design
+
+    with pytest.raises(ValueError):
+        fingerprint.of_file_sample(path, block_size=0)
+
+
+def test_of_files_and_dir(tmpdir):
+    fingerprint.use_md5()
+    root = tmpdir.mkdir("root")
+    root.join("a.txt").write("a")
+    root.mkdir("sub").join("b.txt").write("b")
+    root.mkdir("empty")
+    cache_path = str(tmpdir.join("cache.json"))
+
+    paths = [str(root.join("a.txt")), str(root.join("sub", "b.txt"))]
+    mapping = fingerprint.of_files(paths, cache_path=cache_path)
+    assert mapping == dict(
+        (path, fingerprint.of_file(path)) for path in paths)
+    assert os.path.exists(cache_path)
+
+    mapping, digest = fingerprint.of_dir(str(root), cache_path=cache_path)
+    assert mapping == {
+        "a.txt": hashlib.md5(b"a").hexdigest(),
+        "sub/b.txt": hashlib.md5(b"b").hexdigest(),
+    }
+
+    # cached digest is used when inode, size and mtime not changed
+    calls = list()
+    fingerprint.of_file = lambda *args, **kwargs: calls.append(args)
+    try:
+        assert fingerprint.of_dir(str(root), cache_path=cache_path) == \
+            (mapping, digest)
+    finally:
+        del fingerprint.of_file
+    assert calls == []
+
+    # any change of content or structure changes the root digest
+    root.join("sub", "b.txt").write("c")
+    mapping1, digest1 = fingerprint.of_dir(str(root), cache_path=cache_path)
+    assert mapping1["sub/b.txt"] == hashlib.md5(b"c").hexdigest()
+    assert digest1 != digest
+    root.join("sub", "b.txt").rename(root.join("sub", "d.txt"))
+    assert fingerprint.of_dir(str(root))[1] != digest1
+    root.join("empty").remove()
+    assert fingerprint.of_dir(str(root))[1] != digest1
+
+
+def test_of_dir_skip_broken_symlink(tmpdir):
+    if not hasattr(os, "symlink"):
+        pytest.skip("symlink not supported")
+    fingerprint.use_md5()
+    root = tmpdir.mkdir("root")
+    root.join("a.txt").write("a" * 1000)
+    mapping, digest = fingerprint.of_dir(str(root))
+
+    os.symlink(str(root.join("missing.txt")), str(root.join("broken.txt")))
+    assert fingerprint.of_dir(str(root)) == (mapping, digest)
+
+    # tree mode of_file runs on the of_files thread pool without nesting
+    paths = [str(root.join("a.txt"))]
+    assert fingerprint.of_files(paths, mode="tree", chunk_size=100) == {
+        paths[0]: fingerprint.of_file(paths[0], mode="tree", chunk_size=100),
+    }
+
+
+def test_streaming():
+    fingerprint.use_md5()
+    fingerprint.set_return_str()
+    data = os.urandom(10000)
+    expected = fingerprint.of_bytes(data)
+
+    assert fingerprint.of_stream(io.BytesIO(data), chunk_size=999) == expected
+    assert fingerprint.of_stream(
+        io.BufferedReader(io.BytesIO(data)), chunk_size=999) == expected
+    assert fingerprint.of_chunks(
+        data[i:i + 999] for i in range(0, len(data), 999)) == expected
+
+    a_pyobj = {"key": list(range(1000)), "data": data}
+    for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+        fingerprint.set_pickle_protocol(protocol)
+        assert fingerprint.of_pyobj(a_pyobj, stream=True) == \
+            fingerprint.of_pyobj(a_pyobj)
+    fingerprint.set_pickle2()
+
+    with pytest.raises(ValueError):
+        fingerprint.set_pickle_protocol(1)
+
+
 def test_hash_anything():
     """This test may failed in different operation system.
     """
@@ -75,6 +275,29 @@ def test_basic_function():
         fingerprint.of_file(a_file)
 
 
+def test_fast_algorithm():
+    a_bytes = "Hello World!".encode("utf-8")
+
+    fingerprint.use("blake2b", digest_size=8)
+    assert fingerprint.algorithm == "blake2b-8"
+    assert fingerprint.of_bytes(a_bytes) == \
+        hashlib.blake2b(a_bytes, digest_size=8).hexdigest()
+    fingerprint.use("blake2s")
+    assert fingerprint.of_bytes(a_bytes) == hashlib.blake2s(a_bytes).hexdigest()
+
+    fingerprint.use("fast")
+    assert fingerprint.algorithm in ("xxh3_64", "blake2b-8")
+    assert len(fingerprint.of_bytes(a_bytes)) == 16
+
+    with pytest.raises(ValueError):
+        fingerprint.use("md5", digest_size=8)
+    with pytest.raises(ValueError):
+        fingerprint.use("blake2s", digest_size=64)
+    with pytest.raises(ValueError):
+        fingerprint.use("unknown")
+    fingerprint.use_md5()
+
+
 def test_int_digest():
     a_text = "Hello World!"
     fingerprint.set_return_int()
@@ -2,7 +2,12 @@
 
 import pytest
 import random
-from sfm.geo_search import GeoSearchEngine
+import multiprocessing
+from sfm import geo_search
+from sfm.geo_search import (
+    GeoSearchEngine, great_circle, great_circle_many, great_circle_pairwise,
+    in_polygon,
+)
 
 
 def assert_is_all_ascending(array):
@@ -48,6 +53,359 @@ def test_geo_search():
     assert_is_all_ascending(dist_array)
 
 
+@pytest.mark.parametrize("index", ["grid", "kdtree"])
+def test_reopen_sql_database(tmpdir, index):
+    # the index is built from an existing table
+    database = str(tmpdir.join("point.db"))
+    point_data = [(i, random.uniform(30, 40), random.uniform(-100, -90))
+                  for i in range(200)]
+    GeoSearchEngine(database=database, index=index).train(
+        point_data, key_id=lambda x: x[0],
+        key_lat=lambda x: x[1], key_lng=lambda x: x[2])
+
+    search_engine = GeoSearchEngine(database=database, index=index)
+    expected = GeoSearchEngine(database=database, index=None) \
+        .find_n_nearest(35, -95, n=5)
+    assert len(expected) == 5
+    assert search_engine.find_n_nearest(35, -95, n=5) == expected
+
+    search_engine = GeoSearchEngine(database=database, index=index)
+    search_engine.delete([expected[0][1][0]])
+    assert search_engine.find_n_nearest(35, -95, n=4) == expected[1:]
+
+    empty = GeoSearchEngine(database=str(tmpdir.join("empty.db")), index=index)
+    assert empty.find_n_nearest(35, -95, n=5) == []
+
+    # new points are not loaded twice from the table
+    search_engine = GeoSearchEngine(database=database, index=index)
+    search_engine.train([(1000, 35, -95)], key_id=lambda x: x[0],
+                        key_lat=lambda x: x[1], key_lng=lambda x: x[2])
+    search_engine = GeoSearchEngine(database=database, index=index)
+    search_engine.train([(2000, 35, -95)], key_id=lambda x: x[0],
+                        key_lat=lambda x: x[1], key_lng=lambda x: x[2],
+                        clear_old=False)
+    search_engine.insert([(3000, 35, -95)])
+    ids = [record[0] for _, record in search_engine.find_n_nearest(35, -95, n=3)]
+    assert sorted(ids) == [1000, 2000, 3000]
+
+    search_engine = GeoSearchEngine(database=database, index=index)
+    search_engine._key_id, search_engine._key_lat, search_engine._key_lng = \
+        lambda x: x[0], lambda x: x[1], lambda x: x[2]
+    search_engine.insert([(4000, 35, -95)])
+    ids = [record[0] for _, record in search_engine.find_n_nearest(35, -95, n=5)]
+    assert sorted(ids) == [1000, 2000, 3000, 4000]
+
+    search_engine = GeoSearchEngine(index=index)
+    search_engine.train(point_data[:3], key_id=lambda x: x[0],
+                        key_lat=lambda x: x[1], key_lng=lambda x: x[2],
+                        clear_old=False)
+    ids = [record[0] for _, record in search_engine.find_n_nearest(35, -95, n=5)]
+    assert sorted(ids) == [0, 1, 2]
+
+
+def test_great_circle_many():
+    points = [(45.7597, 4.8422), (48.8567, 2.3508), (-33.8688, 151.2093)]
+    lats = [lat for lat, _ in points]
+    lngs = [lng for _, lng in points]
+    for miles in [True, False]:
+        dists = great_circle_many(points[0], lats, lngs, miles=miles)
+        matrix = great_circle_pairwise(points, points, miles=miles)
+        assert matrix.shape == (3, 3)
+        for i, p1 in enumerate(points):
+            assert dists[i] == pytest.approx(
+                great_circle(points[0], p1, miles=miles))
+            for j, p2 in enumerate(points):
+                assert matrix[i, j] == pytest.approx(
+                    great_circle(p1, p2, miles=miles))
+
+
+def brute_force_n_nearest(point_data, lat, lng, n, radius=None):
+    result = list()
+    for point in point_data:
+        dist = great_circle((lat, lng), (point[1], point[2]))
+        if (radius is None) or (dist <= radius):
+            result.append((dist, point))
+    result.sort()
+    return result[:n]
+
+
+@pytest.mark.parametrize("index,storage", [
+    ("grid", "sql"), ("grid", "columnar"),
+    ("kdtree", "sql"), ("kdtree", "columnar"),
+])
+def test_index_matches_brute_force(index, storage):
+    random.seed(1)
+    point_data = [
+        (i + 1, random.uniform(-90, 90), random.uniform(-180, 180))
+        for i in range(2000)
+    ]
+    search_engine = GeoSearchEngine(
+        index=index, cell_size=5.0, leaf_size=8, storage=storage)
+    search_engine.train(point_data,
+                        key_id=lambda x: x[0],
+                        key_lat=lambda x: x[1],
+                        key_lng=lambda x: x[2],
+                        )
+
+    centers = [
+        (0.0, 0.0), (39.1, -94.6),
+        (89.9, 10.0), (-89.5, -170.0),  # near the pole
+        (10.0, 179.9), (-20.0, -179.9),  # near the anti-meridian
+    ]
+    for lat, lng in centers:
+        for n, radius in [(1, None), (10, None), (10, 500.0), (50, 100.0)]:
+            expected = brute_force_n_nearest(point_data, lat, lng, n, radius)
+            n_nearest = search_engine.find_n_nearest(lat, lng, n, radius)
+            assert [point for _, point in n_nearest] == \
+                [point for _, point in expected]
+
+    assert search_engine.find_n_nearest(0.0, 0.0, n=0) == []
+
+
+def test_columnar_storage():
+    point_data = [
+        {"id": "p%s" % i, "lat": 0.1 * i, "lng": 0.1 * i}
+        for i in range(100)
+    ]
+    search_engine = GeoSearchEngine(storage="columnar")
+    search_engine.train(point_data,
+                        key_id=lambda x: x["id"],
+                        key_lat=lambda x: x["lat"],
+                        key_lng=lambda x: x["lng"],
+                        )
+    n_nearest = search_engine.find_n_nearest(1.0, 1.0, n=3)
+    assert {point["id"] for _, point in n_nearest} == {"p9", "p10", "p11"}
+
+    search_engine.train(point_data[:10],
+                        key_id=lambda x: x["id"],
+                        key_lat=lambda x: x["lat"],
+                        key_lng=lambda x: x["lng"],
+                        )
+    n_nearest = search_engine.find_n_nearest(1.0, 1.0, n=3)
+    assert [point["id"] for _, point in n_nearest] == ["p9", "p8", "p7"]
+    assert len(search_engine._payloads) == 10
+
+    with pytest.raises(ValueError):
+        GeoSearchEngine(index=None, storage="columnar")
+
+
+@pytest.mark.parametrize("index,storage", [
+    ("grid", "sql"), ("kdtree", "columnar"), (None, "sql"),
+])
+def test_insert_delete_upsert(index, storage):
+    random.seed(4)
+
+    def random_point(id):
+        return (id, random.uniform(-90, 90), random.uniform(-180, 180))
+
+    point_data = [random_point(i) for i in range(500)]
+    search_engine = GeoSearchEngine(
+        index=index, cell_size=10.0, leaf_size=4, storage=storage)
+    search_engine.train(point_data,
+                        key_id=lambda x: x[0],
+                        key_lat=lambda x: x[1],
+                        key_lng=lambda x: x[2],
+                        )
+    points = dict((point[0], point) for point in point_data)
+
+    next_id = len(point_data)
+    for _ in range(10):
+        new_points = [random_point(next_id + i) for i in range(30)]
+        next_id += len(new_points)
+        search_engine.insert(new_points)
+        points.update((point[0], point) for point in new_points)
+
+        to_delete = random.sample(sorted(points), 20)
+        search_engine.delete(to_delete)
+        for id in to_delete:
+            del points[id]
+
+        to_update = [random_point(id) for id in random.sample(sorted(points), 20)]
+        search_engine.upsert(to_update)
+        points.update((point[0], point) for point in to_update)
+
+        lat, lng = random.uniform(-90, 90), random.uniform(-180, 180)
+        expected = brute_force_n_nearest(list(points.values()), lat, lng, 20)
+        n_nearest = search_engine.find_n_nearest(lat, lng, 20)
+        assert [tuple(point) for _, point in n_nearest] == \
+            [point for _, point in expected]
+
+
+@pytest.mark.parametrize("index,storage", [
+    ("grid", "sql"), ("kdtree", "columnar"),
+])
+def test_save_and_open(tmpdir, index, storage):
+    random.seed(5)
+    point_data = [
+        ("p%s" % i, random.uniform(-90, 90), random.uniform(-180, 180))
+        for i in range(1000)
+    ]
+    search_engine = GeoSearchEngine(index=index, storage=storage)
+    search_engine.train(point_data,
+                        key_id=lambda x: x[0],
+                        key_lat=lambda x: x[1],
+                        key_lng=lambda x: x[2],
+                        )
+    search_engine.delete(["p0", "p1"])
+    dirpath = str(tmpdir.join("snapshot"))
+    search_engine.save(dirpath)
+
+    opened = GeoSearchEngine.open(dirpath,
+                                  key_id=lambda x: x[0],
+                                  key_lat=lambda x: x[1],
+                                  key_lng=lambda x: x[2],
+                                  )
+    for lat, lng in [(0.0, 0.0), (45.0, 120.0), (-80.0, -179.0)]:
+        assert opened.find_n_nearest(lat, lng, n=10) == \
+            search_engine.find_n_nearest(lat, lng, n=10)
+
+    # the opened engine is still writable
+    opened.delete(["p2"])
+    opened.insert([("new", 10.0, 10.0)])
+    n_nearest = opened.find_n_nearest(10.0, 10.0, n=1)
+    assert n_nearest[0][1] == ("new", 10.0, 10.0)
+    assert "p2" not in [
+        point[0] for _, point in opened.find_n_nearest(0.0, 0.0, n=1000)]
+
+
+def test_in_polygon():
+    square = [(0, 0), (0, 10), (10, 10), (10, 0)]
+    assert list(in_polygon([5, 5, 15, -1], [5, 11, 5, 5], square)) == \
+        [True, False, False, False]
+    triangle = [(0, 0), (10, 0), (0, 10)]
+    assert list(in_polygon([1, 6], [1, 6], triangle)) == [True, False]
+
+
+@pytest.mark.parametrize("index", ["grid", "kdtree", None])
+def test_find_within_box_and_polygon(index):
+    random.seed(6)
+    point_data = [
+        (i, random.uniform(-90, 90), random.uniform(-180, 180))
+        for i in range(3000)
+    ]
+    search_engine = GeoSearchEngine(index=index, cell_size=5.0, leaf_size=8)
+    search_engine.train(point_data,
+                        key_id=lambda x: x[0],
+                        key_lat=lambda x: x[1],
+                        key_lng=lambda x: x[2],
+                        )
+    search_engine.delete([0, 1, 2])
+    new_points = [
+        (-1, 15.0, 15.0), (-2, 0.0, 175.0),
+        (-3, 10.0, 180.0), (-4, 10.0, -180.0),  # both in the first column
+    ]
+    search_engine.insert(new_points)
+    point_data = point_data[3:] + new_points
+
+    boxes = [
+        (10.0, 20.0, 10.0, 20.0),
+        (-90.0, 90.0, -180.0, 180.0),
+        (-20.0, 20.0, 170.0, -170.0),  # cross the anti-meridian
+        (80.0, 90.0, -180.0, 180.0),  # around the pole
+        (0.0, 20.0, 170.0, 180.0),  # reach the anti-meridian
+        (0.0, 20.0, -180.0, -170.0),
+    ]
+    for lat_lo, lat_hi, lng_lo, lng_hi in boxes:
+        expected = sorted(
+            point for point in point_data
+            if lat_lo <= point[1] <= lat_hi and (
+                (lng_lo <= point[2] <= lng_hi) if lng_lo <= lng_hi
+                else (point[2] >= lng_lo or point[2] <= lng_hi)
+            )
+        )
+        result = search_engine.find_within_box(lat_lo, lat_hi, lng_lo, lng_hi)
+        assert sorted(tuple(point) for point in result) == expected
+
+    polygon = [(0.0, 0.0), (40.0, 0.0), (40.0, 40.0), (20.0, 10.0), (0.0, 40.0)]
+    expected = sorted(
+        point for point, inside in zip(point_data, in_polygon(
+            [point[1] for point in point_data],
+            [point[2] for point in point_data],
+            polygon,
+        ))
+        if inside
+    )
+    assert len(expected) > 10
+    result = search_engine.find_within_polygon(polygon)
+    assert sorted(tuple(point) for point in result) == expected
+
+
+@pytest.mark.parametrize("index", ["grid", "kdtree"])
+def test_find_n_nearest_many(index):
+    random.seed(3)
+    point_data = [
+        (i + 1, random.uniform(-90, 90), random.uniform(-180, 180))
+        for i in range(2000)
+    ]
+    search_engine = GeoSearchEngine(index=index, cell_size=10.0)
+    search_engine.train(point_data,
+                        key_id=lambda x: x[0],
+                        key_lat=lambda x: x[1],
+                        key_lng=lambda x: x[2],
+                        )
+    centers = [
+        (random.uniform(-90, 90), random.uniform(-180, 180))
+        for _ in range(200)
+    ] + [(89.9, 10.0), (10.0, 179.9), (10.0, 179.8)]
+    for n, radius in [(1, None), (10, None), (10, 500.0)]:
+        results = search_engine.find_n_nearest_many(
+            centers, n=n, radius=radius, processes=1)
+        assert len(results) == len(centers)
+        for (lat, lng), n_nearest in zip(centers, results):
+            expected = search_engine.find_n_nearest(lat, lng, n, radius)
+            assert [point for _, point in n_nearest] == \
+                [point for _, point in expected]
+
+
+@pytest.mark.parametrize("index", ["grid", "kdtree"])
+def test_find_n_nearest_many_parallel(index, monkeypatch):
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("fork start method not supported")
+    random.seed(4)
+    point_data = [
+        (i + 1, random.uniform(-90, 90), random.uniform(-180, 180))
+        for i in range(1000)
+    ]
+    search_engine = GeoSearchEngine(index=index, cell_size=10.0)
+    search_engine.train(point_data,
+                        key_id=lambda x: x[0],
+                        key_lat=lambda x: x[1],
+                        key_lng=lambda x: x[2],
+                        )
+    centers = [
+        (random.uniform(-90, 90), random.uniform(-180, 180))
+        for _ in range(100)
+    ]
+    # run the forked worker pool even for a small batch
+    monkeypatch.setattr(geo_search, "PARALLEL_THRESHOLD", 10)
+    for n, radius in [(1, None), (10, 1000.0)]:
+        assert search_engine.find_n_nearest_many(
+            centers, n=n, radius=radius, processes=2) == \
+            search_engine.find_n_nearest_many(
+                centers, n=n, radius=radius, processes=1)
+    assert geo_search._pool_engine is None
+
+
+def test_sql_scan_matches_brute_force():
+    random.seed(2)
+    point_data = [
+        (i + 1, random.uniform(30, 50), random.uniform(-100, -80))
+        for i in range(500)
+    ]
+    search_engine = GeoSearchEngine(index=None)
+    search_engine.train(point_data,
+                        key_id=lambda x: x[0],
+                        key_lat=lambda x: x[1],
+                        key_lng=lambda x: x[2],
+                        )
+    lat, lng = 39.1, -94.6
+    for n, radius in [(1, None), (10, None), (10, 200.0)]:
+        expected = brute_force_n_nearest(point_data, lat, lng, n, radius)
+        n_nearest = search_engine.find_n_nearest(lat, lng, n, radius)
+        assert [point for _, point in n_nearest] == \
+            [point for _, point in expected]
+
+
 if __name__ == "__main__":
     import os
 
@@ -9,6 +9,22 @@ def test_lines_count():
     assert lines_count.count_lines(__file__) >= 22
 
 
+@pytest.mark.parametrize("content", [
+    b"", b"\n", b"a", b"a\n", b"a\nb", b"a\nb\n", b"\n\n\n",
+    b"a\r\nb\rc\n" * 1000 + b"last",
+])
+def test_count_lines_same_as_iteration(tmpdir, content):
+    path = str(tmpdir.join("data.txt"))
+    with open(path, "wb") as f:
+        f.write(content)
+    with open(path, "rb") as f:
+        expected = len(list(f))
+    for processes in [1, 3]:
+        for chunk_size in [1, 7, 1024 * 1024]:
+            assert lines_count.count_lines(
+                path, processes=processes, chunk_size=chunk_size) == expected
+
+
 def test_lines_stats():
     n_files, n_lines = lines_count.lines_stats(
         os.path.dirname(__file__), lines_count.filter_python_script)
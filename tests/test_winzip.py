@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import io
 import os
+import gzip
+import zipfile
 import pytest
 from sfm import winzip
 
@@ -27,6 +30,272 @@ def test_winzip():
     winzip.zip_many_files([__file__, ], "3.zip")
 
 
+def test_zip_archive_builder(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("a" * 10000)
+    src.join("b.jpg").write("b" * 10000)
+    src.join("random.bin").write_binary(os.urandom(10000))
+    src.mkdir("sub").join("c.txt").write("c")
+    src.mkdir("empty")
+    dst = str(src.join("src.zip"))  # archive inside the folder is skipped
+
+    with winzip.ZipArchiveBuilder(dst, processes=2) as builder:
+        builder.add_dir(str(src), arcname="src")
+        builder.add_file(str(src.join("a.txt")), arcname="copy/a.txt")
+
+    with zipfile.ZipFile(dst) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == [
+            "src/a.txt", "src/b.jpg", "src/random.bin", "src/sub/c.txt",
+            "copy/a.txt",
+        ]
+        assert zf.read("src/a.txt") == b"a" * 10000
+        assert zf.read("src/sub/c.txt") == b"c"
+        info = dict((zinfo.filename, zinfo) for zinfo in zf.infolist())
+        assert info["src/a.txt"].compress_type == zipfile.ZIP_DEFLATED
+        assert info["src/b.jpg"].compress_type == zipfile.ZIP_STORED
+        # not compressible
+        assert info["src/random.bin"].compress_type == zipfile.ZIP_STORED
+
+    dst = str(tmpdir.join("everything.zip"))
+    winzip.zip_everything_in_a_folder(str(src.join("sub")), dst)
+    with zipfile.ZipFile(dst) as zf:
+        assert zf.namelist() == ["c.txt", ]
+
+
+def test_zip_symlink(tmpdir):
+    if not hasattr(os, "symlink"):
+        pytest.skip("symlink not supported")
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("a")
+    os.symlink(str(tmpdir), str(src.join("loop")))  # loop -> ..
+    os.symlink(str(src.join("a.txt")), str(src.join("link.txt")))
+    dst = str(tmpdir.join("src.zip"))
+    winzip.zip_a_folder(str(src), dst)
+    with zipfile.ZipFile(dst) as zf:
+        assert zf.namelist() == ["src/a.txt", "src/link.txt"]
+        assert zf.read("src/link.txt") == b"a"
+
+    # archive reached through a symlinked directory is skipped
+    dst = str(src.join("src.zip"))
+    with winzip.ZipArchiveBuilder(dst) as builder:
+        builder.add_file(str(src.join(
+            "loop", "src", os.path.basename(builder._tmp_path))))
+        builder.add_file(str(src.join("a.txt")))
+    with zipfile.ZipFile(dst) as zf:
+        assert zf.namelist() == ["a.txt", ]
+
+
+def test_zip_abort(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("a")
+    dst = str(tmpdir.join("src.zip"))
+    with pytest.raises(RuntimeError):
+        with winzip.ZipArchiveBuilder(dst) as builder:
+            builder.add_dir(str(src))
+            raise RuntimeError
+    assert sorted(os.listdir(str(tmpdir))) == ["src"]
+
+
+def test_zip_without_raw_write(tmpdir, monkeypatch):
+    # ZipFile internals changed, fall back to ZipFile.write
+    monkeypatch.setattr(winzip, "_supports_raw_write", lambda zf: False)
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("a" * 10000)
+    src.join("b.jpg").write("b" * 10000)
+    dst = str(tmpdir.join("src.zip"))
+    for update in [False, True]:
+        with winzip.ZipArchiveBuilder(dst, update=update) as builder:
+            builder.add_dir(str(src))
+        assert builder.n_unchanged == 0
+        with zipfile.ZipFile(dst) as zf:
+            assert zf.read("a.txt") == b"a" * 10000
+            info = dict((zinfo.filename, zinfo) for zinfo in zf.infolist())
+            assert info["a.txt"].compress_type == zipfile.ZIP_DEFLATED
+            assert info["b.jpg"].compress_type == zipfile.ZIP_STORED
+
+
+def test_supports_raw_write(tmpdir):
+    with zipfile.ZipFile(str(tmpdir.join("a.zip")), "w") as zf:
+        assert winzip._supports_raw_write(zf)
+
+
+def test_zip_update(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("a" * 10000)
+    src.join("b.txt").write("b" * 10000)
+    src.join("c.txt").write("c" * 10000)
+    src.join("d.txt").write("d" * 10000)
+    dst = str(tmpdir.join("src.zip"))
+    winzip.zip_a_folder(str(src), dst)
+
+    mtime = os.path.getmtime(str(src.join("a.txt")))
+    os.utime(str(src.join("b.txt")), (mtime + 100, mtime + 100))  # touch
+    src.join("c.txt").write("C" * 10000)  # same size, new content
+    os.utime(str(src.join("c.txt")), (mtime + 100, mtime + 100))
+    src.join("d.txt").remove()
+    src.join("e.txt").write("e")
+
+    with winzip.ZipArchiveBuilder(dst, update=True) as builder:
+        builder.add_dir(str(src), arcname="src")
+    assert builder.n_unchanged == 2
+    with zipfile.ZipFile(dst) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == [
+            "src/a.txt", "src/b.txt", "src/c.txt", "src/e.txt"]
+        assert zf.read("src/a.txt") == b"a" * 10000
+        assert zf.read("src/b.txt") == b"b" * 10000
+        assert zf.read("src/c.txt") == b"C" * 10000
+        for zinfo in zf.infolist():
+            assert not zinfo.flag_bits & 0x08
+    assert sorted(os.listdir(str(tmpdir))) == ["src", "src.zip"]
+
+    # failure keeps the existing archive
+    with pytest.raises(RuntimeError):
+        with winzip.ZipArchiveBuilder(dst, update=True) as builder:
+            builder.add_file(str(src.join("e.txt")))
+            raise RuntimeError
+    with zipfile.ZipFile(dst) as zf:
+        assert len(zf.namelist()) == 4
+    assert sorted(os.listdir(str(tmpdir))) == ["src", "src.zip"]
+
+    winzip.zip_a_folder(str(src), dst, update=True)
+    with zipfile.ZipFile(dst) as zf:
+        assert len(zf.namelist()) == 4
+
+
+def test_zip_update_corrupt_dst(tmpdir, monkeypatch):
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("a")
+    dst = tmpdir.join("out.zip")
+    dst.write("not a zip")
+    winzip.zip_a_folder(str(src), str(dst), update=True)
+    with zipfile.ZipFile(str(dst)) as zf:
+        assert zf.read("src/a.txt") == b"a"
+    assert sorted(os.listdir(str(tmpdir))) == ["out.zip", "src"]
+
+    # failure in __init__ removes the temporary archive
+    def fail(zf):
+        raise RuntimeError
+    monkeypatch.setattr(winzip, "_supports_raw_write", fail)
+    with pytest.raises(RuntimeError):
+        winzip.ZipArchiveBuilder(str(dst), update=True)
+    assert sorted(os.listdir(str(tmpdir))) == ["out.zip", "src"]
+
+
+def test_zip_update_same_time_slot(tmpdir):
+    # rewritten within the same 2 seconds DOS time slot, same size
+    src = tmpdir.mkdir("src")
+    path = str(src.join("a.txt"))
+    src.join("a.txt").write("hello ")
+    mtime = os.path.getmtime(path)
+    dst = str(tmpdir.join("src.zip"))
+    winzip.zip_a_folder(str(src), dst)
+
+    src.join("a.txt").write("world!")
+    os.utime(path, (mtime, mtime))
+    winzip.zip_a_folder(str(src), dst, update=True)
+    with zipfile.ZipFile(dst) as zf:
+        assert zf.read("src/a.txt") == b"world!"
+
+    # modified long before the archive was written, copied without CRC
+    os.utime(path, (mtime - 100, mtime - 100))
+    winzip.zip_a_folder(str(src), dst, update=True)
+    with winzip.ZipArchiveBuilder(dst, update=True) as builder:
+        builder.add_dir(str(src), arcname="src")
+    assert builder.n_unchanged == 1
+
+
+def test_extract(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.join("a.txt").write("a" * 10000)
+    src.mkdir("sub").join("b.pdf").write("b")
+    src.join("sub", "c.txt").write("c")
+    dst = str(tmpdir.join("src.zip"))
+    winzip.zip_a_folder(str(src), dst)
+
+    out = tmpdir.join("out")
+    paths = winzip.extract(dst, str(out), processes=2)
+    assert len(paths) == 3
+    assert out.join("src", "a.txt").read() == "a" * 10000
+    assert out.join("src", "sub", "b.pdf").read() == "b"
+
+    out = tmpdir.join("out1")
+    winzip.extract(dst, str(out), members=["*.txt"])
+    assert sorted(os.listdir(str(out.join("src", "sub")))) == ["c.txt"]
+    out = tmpdir.join("out2")
+    winzip.extract(dst, str(out), members=lambda name: name.endswith(".pdf"))
+    assert not out.join("src", "a.txt").exists()
+    assert out.join("src", "sub", "b.pdf").exists()
+
+    # zip slip
+    evil = str(tmpdir.join("evil.zip"))
+    with zipfile.ZipFile(evil, "w") as zf:
+        zf.writestr("../evil.txt", b"evil")
+    with pytest.raises(ValueError):
+        winzip.extract(evil, str(tmpdir.join("out3")))
+    assert not tmpdir.join("evil.txt").exists()
+
+
+def test_read_member(tmpdir):
+    dst = str(tmpdir.join("a.zip"))
+    with zipfile.ZipFile(dst, "w") as zf:
+        zf.writestr("a.txt", b"a")
+    assert winzip.read_member(dst, "a.txt") == b"a"
+    item = winzip._acquire_archive(dst)
+    assert winzip._acquire_archive(dst) is item
+    winzip._release_archive(item)
+
+    # dropped from the cache while in use, closed after released
+    winzip.close_archives()
+    assert item.zf.read("a.txt") == b"a"
+    winzip._release_archive(item)
+    assert item.zf.fp is None
+
+    # archive changed, it's reopened
+    with zipfile.ZipFile(dst, "w") as zf:
+        zf.writestr("a.txt", b"aa")
+        zf.writestr("b.txt", b"b")
+    os.utime(dst, (0, 0))
+    assert winzip.read_member(dst, "b.txt") == b"b"
+    with pytest.raises(KeyError):
+        winzip.read_member(dst, "c.txt")
+    winzip.close_archives()
+
+
+def test_gzip(tmpdir):
+    data = os.urandom(100000) + b"hello world " * 50000
+    path = str(tmpdir.join("data.gz"))
+    for processes in [1, 3]:
+        for source in [data, io.BytesIO(data), [data[:7], data[7:]]]:
+            winzip.write_gzip(
+                source, path, processes=processes, block_size=30000)
+            with open(path, "rb") as f:
+                assert gzip.decompress(f.read()) == data
+            assert winzip.read_gzip(path) == data
+            chunks = list(winzip.iter_gzip(path, chunk_size=1000))
+            assert max(len(chunk) for chunk in chunks) <= 1000
+    winzip.write_gzip(b"", path, processes=2)
+    assert winzip.read_gzip(path) == b""
+
+    # multi-member
+    winzip.write_gzip(data, path)
+    winzip.write_gzip(b"abc", path, append=True)
+    assert winzip.read_gzip(path) == data + b"abc"
+    shard = str(tmpdir.join("shard.gz"))
+    winzip.write_gzip(b"xyz", shard, processes=2)
+    merged = str(tmpdir.join("merged.gz"))
+    winzip.concat_gzip([path, shard], merged)
+    with gzip.open(merged) as f:
+        assert f.read() == data + b"abcxyz"
+    assert winzip.read_gzip(merged) == data + b"abcxyz"
+
+    with open(path, "rb") as f:
+        truncated = f.read()[:-10]
+    with pytest.raises(EOFError):
+        list(winzip.iter_gzip(io.BytesIO(truncated)))
+
+
 if __name__ == "__main__":
     import os
 
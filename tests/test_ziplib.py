@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import io
+import os
+import json
+import base64
+import random
+import zlib
 import pytest
 from sfm import ziplib
 
@@ -80,6 +86,125 @@ def test_compress():
     assert len(obj2_after) < len(obj_str)  # size is reduced
 
 
+def test_codec():
+    assert set(["zlib", "bz2", "lzma"]) <= set(ziplib.available_codecs())
+    for codec in ziplib.available_codecs():
+        for obj in [obj_byte, obj_str, obj_dict]:
+            for return_type in ["bytes", "str"]:
+                compressed = ziplib.compress(
+                    obj, codec=codec, return_type=return_type)
+                assert ziplib.decompress(compressed) == obj
+        assert ziplib.decompress(
+            ziplib.compress(obj_str, codec=codec), return_type="bytes",
+        ) == obj_byte
+
+    # legacy zlib data is still readable
+    assert ziplib.decompress(ziplib.compress(obj_byte)) == obj_byte
+    assert ziplib.decompress(
+        ziplib.compress(obj_dict, level=0), return_type="obj") == obj_dict
+
+    with pytest.raises(ValueError):
+        ziplib.compress(obj_byte, codec="unknown")
+    with pytest.raises(ValueError):
+        ziplib.decompress(b"\xf0abc")
+    with pytest.raises(ValueError):
+        ziplib.register_codec("new", 1, zlib.compress, zlib.decompress)
+
+
+def test_blocks():
+    data = os.urandom(10000) + obj_byte * 100
+    for codec in ziplib.available_codecs():
+        b = ziplib.compress_blocks(data, codec=codec, block_size=3000)
+        assert ziplib.decompress(b) == data
+        assert ziplib.decompress_blocks(b, processes=1) == data
+        for i in range(0, len(data) // 3000 + 1):
+            block = data[i * 3000: (i + 1) * 3000]
+            assert ziplib.read_block(b, i) == block
+            assert ziplib.read_block(io.BytesIO(b), i) == block
+        with pytest.raises(IndexError):
+            ziplib.read_block(b, len(data) // 3000 + 1)
+
+    for obj in [obj_str, obj_dict, b""]:
+        b = ziplib.compress_blocks(obj, block_size=100)
+        assert ziplib.decompress(b) == obj
+        assert ziplib.decompress(
+            base64.b64encode(b).decode("utf-8")) == obj
+
+    b = ziplib.compress_blocks(obj_str, block_size=100)
+    with pytest.raises(ValueError):
+        ziplib.decompress_blocks(b[:4] + b"\x09" + b[5:])
+    with pytest.raises(ValueError):
+        ziplib.compress_blocks(obj_str, block_size=0)
+
+
+def test_record_compressor():
+    rnd = random.Random(0)
+    records = [
+        json.dumps({
+            "id": rnd.randint(0, 10 ** 9),
+            "name": rnd.choice(["alice", "bob", "carol"]),
+            "email": "user%s@example.com" % rnd.randint(0, 10 ** 6),
+            "score": rnd.random(),
+        }).encode("utf-8")
+        for _ in range(2000)
+    ]
+    dictionary = ziplib.train_dictionary(records[:500], dict_size=4096)
+    assert 0 < len(dictionary) <= 4096
+
+    codecs = ["zlib", ]
+    if "zstd" in ziplib.available_codecs():
+        codecs.append("zstd")
+    for codec in codecs:
+        rc = ziplib.RecordCompressor.train(records[:500], codec=codec)
+        compressed = rc.compress_many(records[500:])
+        assert rc.decompress_many(compressed) == records[500:]
+        assert rc.decompress(rc.compress(records[0])) == records[0]
+        assert rc.decompress(rc.compress(b"")) == b""
+        assert sum(map(len, compressed)) < \
+            sum(len(zlib.compress(record)) for record in records[500:]) * 0.7
+
+        # a compressor created from the same dictionary can read the data
+        rc1 = ziplib.RecordCompressor(rc.dictionary, codec=codec)
+        assert rc1.dict_id == rc.dict_id
+        assert rc1.decompress_many(compressed) == records[500:]
+
+    with pytest.raises(ValueError):
+        ziplib.RecordCompressor(dictionary, codec="bz2")
+
+
+def test_stream():
+    data = os.urandom(100000) + obj_byte * 1000
+    expected = zlib.compress(data)
+
+    for source in [data, io.BytesIO(data), [data[:5], data[5:]]]:
+        compressed = b"".join(ziplib.compress_stream(source, chunk_size=999))
+        assert zlib.decompress(compressed) == data
+        assert ziplib.decompress(compressed) == data
+    assert len(compressed) < len(expected) + 100
+
+    for source in [expected, io.BytesIO(expected), [expected[:5], expected[5:]]]:
+        chunks = list(ziplib.decompress_stream(source, chunk_size=999))
+        assert max(len(chunk) for chunk in chunks) <= 999
+        assert b"".join(chunks) == data
+
+    with pytest.raises(zlib.error):
+        list(ziplib.decompress_stream(expected[:-10]))
+
+
+def test_dump_load():
+    obj = {"data": list(range(100000)), "content": obj_str}
+    for protocol in [2, ziplib.STREAM_PICKLE_PROTOCOL]:
+        buffer = io.BytesIO()
+        ziplib.dump(obj, buffer, protocol=protocol)
+        assert ziplib.decompress(buffer.getvalue(), return_type="obj") == obj
+        buffer.seek(0)
+        assert ziplib.load(buffer, chunk_size=100) == obj
+
+    # data compressed by compress() can be loaded too
+    buffer = io.BytesIO(ziplib.compress(obj_dict))
+    assert ziplib.load(buffer) == obj_dict
+
+
 if __name__ == "__main__":
     import os
 